@@ -1,15 +1,15 @@
 import os
 import json
-import spotipy
-from helpers.config import read_config, write_config, get_absolute_rolling_songs_dir
+from helpers.config import read_config, write_token, get_absolute_rolling_songs_dir
 
 TEMP_CACHE_FILENAME = ".temp-token-cache"
 
 # get the spotify token with the necessary credentials
-# and write it to config.json for use by rolling.py
+# and write it next to config.json for use by rolling.py
 def get_and_cache_spotify_token():
     # this will require you to sign in with a web browser
     # and hit "allow access" for this app on your spotify account
+    import spotipy.util
     config = read_config()
     temp_cache_file = get_absolute_rolling_songs_dir() + TEMP_CACHE_FILENAME
     spotipy.util.prompt_for_user_token(
@@ -22,13 +22,12 @@ def get_and_cache_spotify_token():
     )
     
     # then read the cache file that spotipy just wrote and rewrite it to
-    # our config.json file so everything's in one place
+    # our token file next to config.json so everything's in one place
     with open(temp_cache_file, "r") as tcfile:
         spotify_token = json.load(tcfile)
     
     # store it and write it for later
-    config["SPOTIFY_TOKEN"] = spotify_token
-    write_config(config)
+    write_token(spotify_token)
     
     # now delete the spotipy cache file
     os.remove(temp_cache_file)
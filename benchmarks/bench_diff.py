@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+# times helpers.diff.diff_tracklists over synthetic tracklists of growing size.
+# usage: python3 benchmarks/bench_diff.py [--check]
+# with --check, exits nonzero if the per-track cost at the largest size blows up
+# relative to the smallest measured size (i.e. the diff stopped being linear)
+
+import sys
+import time
+import random
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from helpers.diff import diff_tracklists
+
+SIZES = [25, 100, 1000, 10000, 100000]
+CHURN = 0.1
+REPEATS = 5
+MAX_PER_TRACK_RATIO = 4.0
+
+def make_track(i):
+    return {
+        "name": f"Song {i}",
+        "artists": [ f"Artist {i % 997}", f"Feature {i % 13}" ],
+        "album": f"Album {i % 4999}",
+        "uri": f"spotify:track:{i:022d}",
+    }
+
+# old tracklist has playcounts, new tracklist swaps out CHURN of the old tracks
+# and occasionally relinks a kept track to a new uri
+def make_tracklists(size, rng):
+    old = [ dict(make_track(i), playcount=rng.randrange(500)) for i in range(size) ]
+    new = {}
+    swapped = max(1, int(size * CHURN))
+    for i in range(size - swapped):
+        track = make_track(i)
+        if rng.random() < 0.01:
+            track["uri"] = f"spotify:track:relinked{i:014d}"
+        new[track["uri"]] = track
+    for i in range(size, size + swapped):
+        track = make_track(i)
+        new[track["uri"]] = track
+    return new, old
+
+def bench(size, rng):
+    new, old = make_tracklists(size, rng)
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        added, kept, removed = diff_tracklists(new.values(), old)
+        best = min(best, time.perf_counter() - start)
+    assert len(added) == len(removed) == max(1, int(size * CHURN))
+    assert len(kept) == size - len(removed)
+    return best
+
+def main():
+    check = "--check" in sys.argv[1:]
+    rng = random.Random(0)
+    per_track = {}
+    print(f"{'tracks':>8} {'total (ms)':>12} {'per track (us)':>16}")
+    for size in SIZES:
+        elapsed = bench(size, rng)
+        per_track[size] = elapsed / size
+        print(f"{size:>8} {elapsed * 1e3:>12.3f} {per_track[size] * 1e6:>16.3f}")
+
+    # tiny sizes are all noise, so compare against the first size >= 1000
+    baseline = next(per_track[s] for s in SIZES if s >= 1000)
+    ratio = per_track[SIZES[-1]] / baseline
+    print(f"per-track cost ratio {SIZES[-1]} vs baseline: {ratio:.2f}x")
+    if check and ratio > MAX_PER_TRACK_RATIO:
+        print("ERROR: diff no longer scales linearly")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
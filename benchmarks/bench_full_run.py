@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+
+# drives full rolling.run and finalize.finalize cycles for synthetic users
+# against benchmarks/fake_services.py, no real accounts needed.
+# each simulated day swaps some tracks on every user's rolling playlist and adds
+# a day of scrobbles, then runs every user. usage:
+#   python3 benchmarks/bench_full_run.py --users 4 --tracks 2000 --scrobbles 50000 --days 5
+# see --help for latency, page size and 429 knobs
+
+import argparse
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import spotipy
+
+import rolling
+import finalize
+from helpers.config import get_absolute_rolling_songs_dir
+from helpers.gmail import GmailSession
+from helpers.outbox import enqueue, flush_outbox
+from helpers.lastfm import get_lastfm_network
+from helpers.transport import get_transport, get_requests_session
+
+from fake_services import FakeServer, SmtpSink, World, make_spotify_track, redirect_lastfm
+
+DATA_ROOT = "benchmarks/.data/"
+DAY = 24 * 60 * 60
+
+class SimUser:
+    def __init__(self, i, args, world, catalog_size, rng):
+        self.i = i
+        self.rng = rng
+        self.spotify_username = f"spotify-user-{i}"
+        self.lastfm_username = f"lastfm-user-{i}"
+        self.catalog_size = catalog_size
+        self.next_track = args.tracks
+        self.config = {
+            "SPOTIFY_USERNAME": self.spotify_username,
+            "SPOTIFY_PLAYLIST": "rolling",
+            "SPOTIFY_LOG_PLAYLIST": "rolling log",
+            "SPOTIFY_CLIENT_ID": "fake",
+            "SPOTIFY_CLIENT_SECRET": "fake",
+            "SPOTIFY_REDIRECT_URI": "http://localhost:8888/callback",
+            "LASTFM_USERNAME": self.lastfm_username,
+            "LASTFM_PASSWORD": "fake",
+            "LASTFM_API_KEY": "fake",
+            "LASTFM_SECRET": "fake",
+            "DATA_DIR": f"{DATA_ROOT}user{i}/",
+            "STORAGE_FILENAME": "current-tracklist.json",
+            "LOG_FILENAME": "rolling-log.json",
+            "SENDER_EMAIL": "sender@example.com",
+            "SENDER_PASSWORD": "fake",
+            "RECEIVER_EMAIL": f"user{i}@example.com",
+            # the fake server has no rate limit of its own beyond --rate-limit's 429s
+            "LASTFM_REQUESTS_PER_SECOND": args.lastfm_rate,
+        }
+        if not args.scrobble_store:
+            self.config["SCROBBLE_DB_FILENAME"] = ""
+
+        # every user gets the same catalog, but their own playlists and listening history
+        self.tracks = [ make_spotify_track(t) for t in rng.sample(range(catalog_size), args.tracks) ]
+        self.rolling_id = f"rolling{i}"
+        world.add_playlist(self.spotify_username, self.rolling_id, "rolling", self.tracks)
+        world.add_playlist(self.spotify_username, f"log{i}", "rolling log", self.tracks)
+        for j in range(args.other_playlists):
+            world.add_playlist(self.spotify_username, f"other{i}-{j}", f"other {j}", [])
+
+        now = int(time.time())
+        world.add_scrobbles(self.lastfm_username, [
+            self.make_scrobble(rng.randrange(catalog_size), now - rng.randrange(365 * DAY))
+            for _ in range(args.scrobbles)
+        ])
+
+        self.spotify = None
+        self.lastfm = None
+
+    def make_scrobble(self, t, timestamp):
+        track = make_spotify_track(t)
+        return (track["artists"][0]["name"], track["name"], track["album"]["name"], timestamp)
+
+    def simulate_day(self, world, churn, plays):
+        for _ in range(churn):
+            self.tracks[self.rng.randrange(len(self.tracks))] = make_spotify_track(self.rng.randrange(self.catalog_size))
+        world.set_tracks(self.rolling_id, self.tracks)
+        now = int(time.time())
+        world.add_scrobbles(self.lastfm_username, [
+            self.make_scrobble(int(self.rng.choice(self.tracks)["uri"].rsplit(":", 1)[1]), now - self.rng.randrange(DAY))
+            for _ in range(plays)
+        ])
+
+    def get_spotify(self, server):
+        if self.spotify is None:
+            self.spotify = spotipy.Spotify(auth="fake-token", requests_session=get_requests_session())
+            self.spotify.prefix = server.url + "/v1/"
+        return self.spotify
+
+    def get_lastfm(self):
+        if self.lastfm is None:
+            # pylast spaces calls 0.2s apart to keep to the real last.fm's limit, the fake has none
+            network = get_lastfm_network(self.config)
+            network.disable_rate_limit()
+            self.lastfm = network.get_authenticated_user()
+        return self.lastfm
+
+def timed_runs(users, workers, fn):
+    times = []
+    def run_one(user):
+        start = time.perf_counter()
+        fn(user)
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run_one, users))
+    return time.perf_counter() - start, times
+
+def report(label, wall, times, before, after):
+    requests = { key: after[key] - before[key] for key in after }
+    print(f"{label:<12} wall {wall:8.2f} s   per user mean {sum(times) / len(times):7.3f} s max {max(times):7.3f} s   "
+          f"spotify {requests['spotify']:>6} lastfm {requests['lastfm']:>6} 429s {requests['rate_limited']:>4}   "
+          f"retries {requests['retries']:>4} retry wait {requests['retry_wait']:6.2f} s "
+          f"queue wait {requests['queue_wait']:6.2f} s coalesced {requests['coalesced']:>4}")
+
+# the fake server's request counts plus the client side transport's
+def measure(server):
+    return dict(server.stats, **get_transport().snapshot())
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark full runs against fake spotify/last.fm services")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--tracks", type=int, default=1000, help="tracks on each rolling playlist")
+    parser.add_argument("--catalog", type=int, default=20000, help="distinct tracks to draw from")
+    parser.add_argument("--scrobbles", type=int, default=20000, help="scrobbles of history per user")
+    parser.add_argument("--other-playlists", type=int, default=60, help="unrelated playlists per user to page past")
+    parser.add_argument("--days", type=int, default=3, help="daily runs after the first")
+    parser.add_argument("--churn", type=int, default=5, help="tracks swapped per user per day")
+    parser.add_argument("--plays", type=int, default=100, help="scrobbles added per user per day")
+    parser.add_argument("--workers", type=int, default=4, help="users run at the same time")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake request")
+    parser.add_argument("--spotify-page-size", type=int, default=100)
+    parser.add_argument("--lastfm-page-size", type=int, default=50)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds on spotify 429s")
+    parser.add_argument("--lastfm-rate", type=float, default=1000, help="last.fm requests per second the client allows itself")
+    parser.add_argument("--no-scrobble-store", dest="scrobble_store", action="store_false",
+                        help="look up playcounts per track instead of through the local scrobble store")
+    parser.add_argument("--keep-data", action="store_true", help="leave the generated data dirs in place")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    world = World()
+    data_root = get_absolute_rolling_songs_dir() + DATA_ROOT
+    shutil.rmtree(data_root, ignore_errors=True)
+
+    print(f"setting up {args.users} users, {args.tracks} tracks and {args.scrobbles} scrobbles each")
+    users = [ SimUser(i, args, world, args.catalog, random.Random(rng.random())) for i in range(args.users) ]
+
+    server = FakeServer(world, latency=args.latency, spotify_page_size=args.spotify_page_size,
+                        lastfm_page_size=args.lastfm_page_size, rate_limit_probability=args.rate_limit,
+                        retry_after=args.retry_after)
+    with server, SmtpSink() as sink:
+        undo = redirect_lastfm(server.url)
+        try:
+            def run_user(user):
+                rolling.run(user.config, user.get_spotify(server), user.get_lastfm)
+
+            before = measure(server)
+            wall, times = timed_runs(users, args.workers, run_user)
+            report("first run", wall, times, before, measure(server))
+
+            for day in range(args.days):
+                for user in users:
+                    user.simulate_day(world, args.churn, args.plays)
+                before = measure(server)
+                wall, times = timed_runs(users, args.workers, run_user)
+                report(f"day {day + 1}", wall, times, before, measure(server))
+
+            before = measure(server)
+            wall, times = timed_runs(users, args.workers, run_user)
+            report("no change", wall, times, before, measure(server))
+
+            before = measure(server)
+            wall, times = timed_runs(users, args.workers,
+                                     lambda user: finalize.finalize("finalized.json", user.config, user.get_lastfm()))
+            report("finalize", wall, times, before, measure(server))
+
+            # every user shares the one sender address, so this is one smtp session for all of them
+            start = time.perf_counter()
+            session = GmailSession("sender@example.com", "fake", host="127.0.0.1", port=sink.port, use_ssl=False)
+            with session:
+                for user in users:
+                    user.config.update(EMAIL_UPDATES="each", SMTP_HOST="127.0.0.1", SMTP_PORT=sink.port, SMTP_SSL=False)
+                    enqueue(user.config, "your rolling playlist was updated!", "benchmark")
+                    flush_outbox(user.config, session)
+            print(f"{'email':<12} {len(sink.messages)} messages in {time.perf_counter() - start:.3f} s")
+        finally:
+            undo()
+            if not args.keep_data:
+                shutil.rmtree(data_root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
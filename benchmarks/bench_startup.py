@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# times how long each cli.py command takes to get going from a cold interpreter:
+# starting python, importing cli, and loading the command (its imports), but not running it.
+# also lists which of the heavy third-party/stdlib modules each command ended up loading.
+# usage: python3 benchmarks/bench_startup.py [--repeats N] [--check]
+# with --check, exits nonzero if query (which needs no network) loads any of them
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from os.path import dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cli import COMMANDS
+
+HEAVY_MODULES = [ "spotipy", "pylast", "requests", "httpx", "smtplib", "ssl", "email.mime.text", "numpy" ]
+
+LOAD_COMMAND = f"""
+import sys
+sys.path.insert(0, {ROOT!r})
+import cli
+cli.COMMANDS[sys.argv[1]]()
+print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+def time_command(command, repeats):
+    times = []
+    loaded = ""
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([ sys.executable, "-c", LOAD_COMMAND, command ],
+                                capture_output=True, text=True, cwd=ROOT)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        loaded = result.stdout.strip()
+    return times, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="cold-start time of each cli.py command")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    # the floor: an interpreter that does nothing at all
+    bare = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        subprocess.run([ sys.executable, "-c", "pass" ], check=True)
+        bare.append(time.perf_counter() - start)
+    print(f"{'command':<10} {'median (ms)':>12} {'min (ms)':>10}  heavy modules loaded")
+    print(f"{'(python)':<10} {statistics.median(bare) * 1e3:>12.1f} {min(bare) * 1e3:>10.1f}")
+
+    failed = False
+    for command in COMMANDS:
+        times, loaded = time_command(command, args.repeats)
+        if times is None:
+            print(f"{command:<10} failed to load: {loaded}")
+            continue
+        print(f"{command:<10} {statistics.median(times) * 1e3:>12.1f} {min(times) * 1e3:>10.1f}  {loaded or '-'}")
+        if command == "query" and loaded:
+            failed = True
+
+    if args.check and failed:
+        print("ERROR: query loaded service clients it doesn't need")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+# builds a helpers.timeline.Timeline over years of synthetic daily substitutions
+# and times its queries against replaying the whole log from the starting tracks,
+# both in memory and the way cli.py query runs: from the log file on disk, with
+# the timeline's index persisted next to it.
+# usage: python3 benchmarks/bench_timeline.py [years]
+
+import os
+import sys
+import json
+import time
+import random
+import datetime
+import tempfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from helpers.date import DATE_FORMAT
+from helpers.diff import get_track_id
+from helpers.timeline import Timeline
+
+PLAYLIST_SIZE = 25
+QUERIES = 200
+
+def make_track(i):
+    return {
+        "name": f"Song {i}",
+        "artists": [ f"Artist {i % 997}" ],
+        "album": f"Album {i % 4999}",
+        "uri": f"spotify:track:{i:022d}",
+    }
+
+# one to three substitutions a day, most days
+def make_events(years, rng):
+    start = datetime.date(2000, 1, 1)
+    current = [ make_track(i) for i in range(PLAYLIST_SIZE) ]
+    next_id = PLAYLIST_SIZE
+    events = [{ "date": start.strftime(DATE_FORMAT), "starting_tracks": list(current) }]
+    for day in range(1, years * 365):
+        if rng.random() < 0.3:
+            continue
+        out = []
+        for _ in range(rng.randint(1, 3)):
+            track = current.pop(rng.randrange(len(current)))
+            out.append(dict(track, playcount=rng.randrange(100)))
+        ins = [ make_track(next_id + i) for i in range(len(out)) ]
+        next_id += len(out)
+        current.extend(ins)
+        date = (start + datetime.timedelta(days=day)).strftime(DATE_FORMAT)
+        events.append({ "date": date, "in": ins, "out": out })
+    return events
+
+# what answering "contents on date D" costs without the timeline
+def replay_contents_on(events, date):
+    state = set(get_track_id(track) for track in events[0]["starting_tracks"])
+    for event in events[1:]:
+        if event["date"] > date:
+            break
+        for track in event["out"]:
+            state.discard(get_track_id(track))
+        for track in event["in"]:
+            state.add(get_track_id(track))
+    return state
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    rng = random.Random(0)
+    events = make_events(years, rng)
+    print(f"{years} years, {len(events) - 1} substitution events")
+
+    timeline, elapsed = timed(Timeline, events)
+    print(f"build: {elapsed * 1e3:.1f} ms")
+
+    dates = [ rng.choice(events[1:])["date"] for _ in range(QUERIES) ]
+    naive = 0.0
+    indexed = 0.0
+    for date in dates:
+        expected, elapsed = timed(replay_contents_on, events, date)
+        naive += elapsed
+        got, elapsed = timed(timeline.contents_on, date)
+        indexed += elapsed
+        assert set(get_track_id(track) for track in got) == expected
+    print(f"contents_on: replay {naive / QUERIES * 1e6:.1f} us/query, timeline {indexed / QUERIES * 1e6:.1f} us/query")
+
+    tracks = [ track for event in events[1:] for track in event["in"] ]
+    _, elapsed = timed(lambda: [ timeline.tenure(rng.choice(tracks)) for _ in range(QUERIES) ])
+    print(f"tenure: {elapsed / QUERIES * 1e6:.1f} us/query")
+
+    _, elapsed = timed(timeline.monthly_top_tracks)
+    print(f"monthly_top_tracks over {years * 12} months: {elapsed * 1e3:.1f} ms")
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        bench_persisted(events, dates, data_dir)
+
+def write_log(path, events):
+    with open(path, "a", encoding="utf-8") as logfile:
+        for event in events:
+            logfile.write(json.dumps(event) + "\n")
+
+# one query per process, as cli.py query does it: read the log from disk
+# and replay it, against opening the persisted index (caught up with the log)
+def bench_persisted(events, dates, data_dir):
+    log_path = os.path.join(data_dir, "rolling-log.jsonl")
+    write_log(log_path, events[:-1])
+    timeline, elapsed = timed(Timeline.from_path, log_path)
+    timeline.close()
+    print(f"persisted index: first build {elapsed * 1e3:.1f} ms")
+
+    write_log(log_path, events[-1:])
+    timeline, elapsed = timed(Timeline.from_path, log_path)
+    timeline.close()
+    print(f"persisted index: catching up on one appended event {elapsed * 1e3:.2f} ms")
+
+    def replay_file(date):
+        with open(log_path, encoding="utf-8") as logfile:
+            return replay_contents_on([ json.loads(line) for line in logfile ], date)
+
+    def query_index(date):
+        timeline = Timeline.from_path(log_path)
+        try:
+            return timeline.contents_on(date)
+        finally:
+            timeline.close()
+
+    naive = 0.0
+    indexed = 0.0
+    for date in dates:
+        expected, elapsed = timed(replay_file, date)
+        naive += elapsed
+        got, elapsed = timed(query_index, date)
+        indexed += elapsed
+        assert set(get_track_id(track) for track in got) == expected
+    print(f"one query from disk: replay the log {naive / len(dates) * 1e3:.2f} ms, open the index {indexed / len(dates) * 1e3:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# times counting one track's scrobbles per month (helpers.date.count_in_windows)
+# against checking every scrobble against every window one by one.
+# usage: python3 benchmarks/bench_windows.py [--check]
+# with --check, exits nonzero if the two ever disagree. uses numpy if it's installed
+
+import sys
+import time
+import random
+import datetime
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from helpers.date import as_timestamp_array, count_in_windows, day_start_timestamp, month_windows, get_numpy
+
+SIZES = [1000, 10000, 100000, 1000000]
+YEAR = 2022
+REPEATS = 3
+
+def make_timestamps(size, rng):
+    start, end = month_windows(YEAR)[0][0], month_windows(YEAR)[-1][1]
+    return [ rng.randrange(start - 86400 * 30, end + 86400 * 30) for _ in range(size) ]
+
+# one [t0, t1) window per day of the year
+def day_windows(year):
+    start = datetime.date(year, 1, 1)
+    days = [ start + datetime.timedelta(days=i) for i in range((datetime.date(year + 1, 1, 1) - start).days + 1) ]
+    bounds = [ day_start_timestamp(day) for day in days ]
+    return list(zip(bounds, bounds[1:]))
+
+def count_one_by_one(timestamps, windows):
+    counts = [ 0 ] * len(windows)
+    for timestamp in timestamps:
+        for i, (t0, t1) in enumerate(windows):
+            if t0 <= timestamp < t1:
+                counts[i] += 1
+    return counts
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    check = "--check" in sys.argv[1:]
+    rng = random.Random(0)
+    windows = {
+        "months": month_windows(YEAR),
+        "days": day_windows(YEAR),
+    }
+    print(f"numpy: {'yes' if get_numpy() is not None else 'no'}")
+    print(f"{'scrobbles':>10} {'windows':>8} {'one by one (ms)':>16} {'sort (ms)':>10} {'count (ms)':>11}")
+    for size in SIZES:
+        timestamps = make_timestamps(size, rng)
+        for name, wins in windows.items():
+            # checking every day against every scrobble takes minutes at the big sizes
+            if name == "days" and size > 10000:
+                naive, expected = float("nan"), None
+            else:
+                naive, expected = best_of(lambda: count_one_by_one(timestamps, wins))
+            sort, array = best_of(lambda: as_timestamp_array(timestamps))
+            count, counts = best_of(lambda: count_in_windows(array, wins))
+            print(f"{size:>10} {name:>8} {naive * 1e3:>16.1f} {sort * 1e3:>10.1f} {count * 1e3:>11.3f}")
+            if check and expected is not None and counts != expected:
+                print("ERROR: windowed counts don't match")
+                exit(1)
+
+if __name__ == "__main__":
+    main()
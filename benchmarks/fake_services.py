@@ -0,0 +1,439 @@
+# local stand-ins for everything rolling.py and finalize.py talk to, so full
+# runs can be benchmarked offline:
+# - FakeServer: one http server speaking the spotify web api endpoints spotipy
+#   hits here (/v1/...) and the last.fm web service endpoint pylast hits (/2.0/)
+# - SmtpSink: a plain smtp server that accepts and keeps every message
+# latency, page sizes and 429s are all configurable.
+# spotipy is pointed at the server through Spotify.prefix, pylast through
+# redirect_lastfm (pylast always builds https://ws.audioscrobbler.com urls itself)
+
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from xml.sax.saxutils import escape
+
+LASTFM_HOST = "ws.audioscrobbler.com"
+
+class World:
+    """
+    The fake services' data: spotify playlists and last.fm scrobbles per user.
+    Playlists are dicts of id, name, owner, snapshot_id, a list of track objects
+    shaped like the spotify api's and when each track was added (by uri).
+    Scrobbles are (artist, track, album, timestamp).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.playlists = {}
+        self.user_playlists = {}
+        self.scrobbles = {}
+        self.catalog = {}
+        self.snapshot_counter = 0
+
+    def next_snapshot_id(self):
+        self.snapshot_counter += 1
+        return f"snapshot-{self.snapshot_counter}"
+
+    def add_playlist(self, owner, playlist_id, name, tracks):
+        with self.lock:
+            self.catalog.update((track["uri"], track) for track in tracks)
+            self.playlists[playlist_id] = {
+                "id": playlist_id,
+                "uri": f"spotify:playlist:{playlist_id}",
+                "name": name,
+                "owner": { "id": owner },
+                "snapshot_id": self.next_snapshot_id(),
+                "tracks": list(tracks),
+                "added_at": added_now(tracks, {}),
+            }
+            self.user_playlists.setdefault(owner, []).append(playlist_id)
+
+    def set_tracks(self, playlist_id, tracks):
+        with self.lock:
+            self.catalog.update((track["uri"], track) for track in tracks)
+            playlist = self.playlists[playlist_id]
+            playlist["tracks"] = list(tracks)
+            playlist["added_at"] = added_now(tracks, playlist["added_at"])
+            playlist["snapshot_id"] = self.next_snapshot_id()
+
+    def append_tracks(self, playlist_id, tracks):
+        with self.lock:
+            playlist = self.playlists[playlist_id]
+            playlist["tracks"].extend(tracks)
+            playlist["added_at"] = added_now(playlist["tracks"], playlist["added_at"])
+            playlist["snapshot_id"] = self.next_snapshot_id()
+            return playlist["snapshot_id"]
+
+    def add_scrobbles(self, user, scrobbles):
+        with self.lock:
+            self.scrobbles.setdefault(user, []).extend(scrobbles)
+            # newest first, like user.getRecentTracks
+            self.scrobbles[user].sort(key=lambda scrobble: -scrobble[3])
+
+# tracks already on the playlist keep their added_at, new ones are added as of now
+def added_now(tracks, added_at):
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return { track["uri"]: added_at.get(track["uri"], now) for track in tracks }
+
+def playlist_items(playlist):
+    return [ { "added_at": playlist["added_at"][track["uri"]], "track": track } for track in playlist["tracks"] ]
+
+def make_spotify_track(i):
+    return {
+        "name": f"Song {i}",
+        "uri": f"spotify:track:{i:022d}",
+        "artists": [ { "name": f"Artist {i % 397}" } ],
+        "album": { "name": f"Album {i % 1999}" },
+    }
+
+class FakeServer:
+    """
+    Threaded http server for the fake spotify and last.fm apis.
+    :param world: The World to serve
+    :param latency: Seconds to sleep before answering each request
+    :param spotify_page_size: Max items per page spotify hands back, whatever limit was asked for
+    :param lastfm_page_size: Scrobbles per page last.fm hands back
+    :param rate_limit_probability: Chance of answering any request with a 429 instead
+    :param retry_after: Retry-After seconds sent with spotify 429s
+    """
+
+    def __init__(self, world, latency=0.0, spotify_page_size=100, lastfm_page_size=50,
+                 rate_limit_probability=0.0, retry_after=0, seed=0):
+        self.world = world
+        self.latency = latency
+        self.spotify_page_size = spotify_page_size
+        self.lastfm_page_size = lastfm_page_size
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.stats = { "spotify": 0, "lastfm": 0, "rate_limited": 0 }
+
+        server = self
+        class Handler(FakeHandler):
+            fake = server
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def should_rate_limit(self):
+        with self.stats_lock:
+            return self.random.random() < self.rate_limit_probability
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers={}):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, obj, headers={}):
+        self.send_body(status, json.dumps(obj), "application/json", headers)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length).decode("utf-8") if length else ""
+
+    def handle_request(self, method):
+        time.sleep(self.fake.latency)
+        url = urlparse(self.path)
+        query = { key: values[-1] for key, values in parse_qs(url.query).items() }
+        body = self.read_body()
+
+        if url.path.startswith("/2.0"):
+            self.fake.count("lastfm")
+            params = dict(query, **{ key: values[-1] for key, values in parse_qs(body).items() })
+            if self.fake.should_rate_limit():
+                self.fake.count("rate_limited")
+                return self.send_body(429, lastfm_error(29, "Rate Limit Exceeded"), "text/xml")
+            return self.send_body(200, *handle_lastfm(self.fake, params))
+
+        self.fake.count("spotify")
+        if self.fake.should_rate_limit():
+            self.fake.count("rate_limited")
+            return self.send_json(429, { "error": { "status": 429, "message": "API rate limit exceeded" } },
+                                  { "Retry-After": str(self.fake.retry_after) })
+        status, obj = handle_spotify(self.fake, method, url.path, query, body)
+        self.send_json(status, obj)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+def spotify_page(fake, path, query, items):
+    limit = min(int(query.get("limit", 20)), fake.spotify_page_size)
+    offset = int(query.get("offset", 0))
+    page = items[offset:offset + limit]
+    next_url = None
+    if offset + limit < len(items):
+        next_url = fake.url + path + "?" + urlencode(dict(query, offset=offset + limit, limit=limit))
+    return { "items": page, "next": next_url, "offset": offset, "limit": limit, "total": len(items) }
+
+# spotify renamed a playlist's /tracks to /items, spotipy uses whichever it was written against
+PLAYLIST_ITEMS = ("tracks", "items")
+
+def playlist_metadata(playlist):
+    return { key: playlist[key] for key in ("id", "uri", "name", "owner", "snapshot_id") }
+
+def handle_spotify(fake, method, path, query, body):
+    world = fake.world
+    parts = path.strip("/").split("/")
+    with world.lock:
+        # GET /v1/users/{user}/playlists
+        if method == "GET" and len(parts) == 4 and parts[1] == "users" and parts[3] == "playlists":
+            ids = world.user_playlists.get(parts[2], [])
+            items = [ playlist_metadata(world.playlists[i]) for i in ids ]
+            return 200, spotify_page(fake, path, query, items)
+
+        if len(parts) >= 3 and parts[1] == "playlists":
+            playlist = world.playlists.get(parts[2])
+            if playlist is None:
+                return 404, { "error": { "status": 404, "message": "Not found." } }
+
+            # GET /v1/playlists/{id}
+            if method == "GET" and len(parts) == 3:
+                result = playlist_metadata(playlist)
+                if "tracks" in query.get("fields", "tracks"):
+                    items = playlist_items(playlist)
+                    result["tracks"] = spotify_page(fake, path + "/tracks", { "limit": 100 }, items)
+                return 200, result
+
+            # GET /v1/playlists/{id}/tracks (/items in newer spotipy versions)
+            if method == "GET" and len(parts) == 4 and parts[3] in PLAYLIST_ITEMS:
+                items = playlist_items(playlist)
+                return 200, spotify_page(fake, path, dict(query, limit=query.get("limit", 100)), items)
+
+    # POST /v1/playlists/{id}/tracks (or /items), outside the lock since append_tracks takes it
+    if method == "POST" and len(parts) == 4 and parts[1] == "playlists" and parts[3] in PLAYLIST_ITEMS:
+        payload = json.loads(body) if body else {}
+        uris = payload["uris"] if isinstance(payload, dict) else payload
+        if len(uris) > 100:
+            return 400, { "error": { "status": 400, "message": "Too many ids requested" } }
+        unknown = [ uri for uri in uris if uri not in world.catalog ]
+        if unknown:
+            return 400, { "error": { "status": 400, "message": f"Invalid track uri: {unknown[0]}" } }
+        tracks = [ world.catalog[uri] for uri in uris ]
+        return 201, { "snapshot_id": world.append_tracks(parts[2], tracks) }
+
+    return 404, { "error": { "status": 404, "message": "Service not found" } }
+
+def lastfm_error(code, message):
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="failed"><error code="{code}">{escape(message)}</error></lfm>'
+
+def lastfm_ok(body):
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="ok">{body}</lfm>'
+
+def lastfm_track_xml(artist, track, album, timestamp):
+    return (
+        f"<track><artist>{escape(artist)}</artist><name>{escape(track)}</name>"
+        f"<album>{escape(album)}</album><date uts=\"{timestamp}\">{timestamp}</date></track>"
+    )
+
+def lastfm_paged(tag, user, scrobbles, page, page_size):
+    total_pages = max(1, -(-len(scrobbles) // page_size))
+    page_scrobbles = scrobbles[(page - 1) * page_size:page * page_size]
+    tracks = "".join(lastfm_track_xml(*scrobble) for scrobble in page_scrobbles)
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="ok">'
+        f'<{tag} user="{escape(user)}" page="{page}" perPage="{page_size}" totalPages="{total_pages}" total="{len(scrobbles)}">'
+        f"{tracks}</{tag}></lfm>"
+    )
+
+def handle_lastfm(fake, params):
+    world = fake.world
+    method = params.get("method", "")
+    if method == "auth.getMobileSession":
+        body = (
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="ok"><session>'
+            f"<name>{escape(params.get('username', ''))}</name><key>fake-session-key</key><subscriber>0</subscriber>"
+            f"</session></lfm>"
+        )
+        return body, "text/xml"
+
+    user = params.get("user", "")
+    page = int(params.get("page", 1))
+    with world.lock:
+        scrobbles = world.scrobbles.get(user, [])
+        if method == "user.getTrackScrobbles":
+            artist = params.get("artist", "").casefold()
+            track = params.get("track", "").casefold()
+            matches = [ s for s in scrobbles if s[0].casefold() == artist and s[1].casefold() == track ]
+            return lastfm_paged("trackscrobbles", user, matches, page, fake.lastfm_page_size), "text/xml"
+
+        if method == "user.getRecentTracks":
+            start = int(params.get("from", 0))
+            end = int(params.get("to", 2 ** 62))
+            matches = [ s for s in scrobbles if start <= s[3] <= end ]
+            page_size = min(int(params.get("limit", fake.lastfm_page_size)), 200)
+            return lastfm_paged("recenttracks", user, matches, page, page_size), "text/xml"
+
+        # the lookups helpers/identity.py makes to match spotify names up with last.fm's
+        if method == "track.getInfo":
+            artist = params.get("artist", "").casefold()
+            track = params.get("track", "").casefold()
+            plays = sum(1 for s in world.scrobbles.get(params.get("username", ""), [])
+                        if s[0].casefold() == artist and s[1].casefold() == track)
+            return lastfm_ok(
+                f"<track><name>{escape(params.get('track', ''))}</name>"
+                f"<artist><name>{escape(params.get('artist', ''))}</name></artist>"
+                f"<userplaycount>{plays}</userplaycount></track>"
+            ), "text/xml"
+
+        # the fake catalog has no misspellings, so corrections hand the names straight back
+        if method == "track.getCorrection":
+            return lastfm_ok(
+                f"<corrections><correction index=\"0\"><track><name>{escape(params.get('track', ''))}</name>"
+                f"<artist><name>{escape(params.get('artist', ''))}</name></artist></track></correction></corrections>"
+            ), "text/xml"
+
+        if method == "artist.getCorrection":
+            return lastfm_ok(
+                f"<corrections><correction index=\"0\"><artist><name>{escape(params.get('artist', ''))}</name>"
+                f"</artist></correction></corrections>"
+            ), "text/xml"
+
+        if method == "track.search":
+            title = params.get("track", "").casefold()
+            matches = [ t for t in world.catalog.values() if t["name"].casefold().startswith(title) ][:5]
+            tracks = "".join(
+                f"<track><name>{escape(t['name'])}</name><artist>{escape(t['artists'][0]['name'])}</artist></track>"
+                for t in matches
+            )
+            return lastfm_ok(
+                f"<results><opensearch:totalResults>{len(matches)}</opensearch:totalResults>"
+                f"<trackmatches>{tracks}</trackmatches></results>"
+            ), "text/xml"
+
+    return lastfm_error(3, "Invalid Method"), "text/xml"
+
+def redirect_lastfm(server_url):
+    """
+    Sends every request pylast makes to ws.audioscrobbler.com to server_url instead,
+    by rewriting urls in httpx.Client.send. Returns a function that undoes it.
+    """
+    from helpers.transport import get_pylast_httpx
+    httpx = get_pylast_httpx()
+
+    target = httpx.URL(server_url)
+    send = httpx.Client.send
+
+    def redirected_send(self, request, *args, **kwargs):
+        if request.url.host == LASTFM_HOST:
+            request.url = request.url.copy_with(scheme=target.scheme, host=target.host, port=target.port)
+            request.headers["Host"] = f"{target.host}:{target.port}"
+        return send(self, request, *args, **kwargs)
+
+    httpx.Client.send = redirected_send
+
+    def undo():
+        httpx.Client.send = send
+    return undo
+
+class SmtpSink:
+    """
+    Minimal plain-text smtp server that accepts any login and keeps every
+    message it's sent in self.messages as (sender, recipients, data).
+    """
+
+    def __init__(self, latency=0.0):
+        self.messages = []
+        self.latency = latency
+        self.lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write((line + "\r\n").encode("ascii"))
+
+            def handle(self):
+                self.reply("220 localhost fake smtp")
+                sender = None
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode("utf-8", "replace").strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    time.sleep(sink.latency)
+                    if verb == "EHLO":
+                        self.reply("250-localhost")
+                        self.reply("250 AUTH PLAIN LOGIN")
+                    elif verb == "HELO":
+                        self.reply("250 localhost")
+                    elif verb == "AUTH":
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif verb == "MAIL":
+                        sender = command.split(":", 1)[1].strip()
+                        recipients = []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        recipients.append(command.split(":", 1)[1].strip())
+                        self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        while True:
+                            data_line = self.rfile.readline()
+                            if data_line in (b".\r\n", b".\n", b""):
+                                break
+                            data.append(data_line)
+                        with sink.lock:
+                            sink.messages.append((sender, recipients, b"".join(data)))
+                        self.reply("250 OK")
+                    elif verb in ("RSET", "NOOP"):
+                        self.reply("250 OK")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+# one entry point for everything, e.g.
+#   python3 cli.py run [--debug] [--profile REPORT]     same as rolling.py
+#   python3 cli.py finalize OUTPUT_FILENAME              same as finalize.py
+#   python3 cli.py auth                                  same as auth.py
+#   python3 cli.py watch [CONFIG]                        same as watch.py
+#   python3 cli.py query on 2022-06-01                   what was on the playlist that day
+#   python3 cli.py query top 2022-06-01 2022-09-01       longest stays in that window
+#   python3 cli.py query tenure "song name"              days on the playlist, per stay
+#   python3 cli.py analyze [LOG_OR_FOLDER ...]           stats across many finalized logs
+# a command only imports the modules it needs once it's been picked, so e.g. query
+# never loads spotipy, pylast or smtplib. see benchmarks/bench_startup.py
+
+import argparse
+import sys
+
+# only stdlib underneath, so the parser can use its --profile flags for free
+from helpers import instrument
+
+def load_run():
+    import rolling
+
+    def run(args):
+        rolling.debug = args.debug
+        instrument.run_profiled(rolling.main, args.profile, args.cprofile)
+    return run
+
+def load_finalize():
+    import finalize
+
+    def run(args):
+        instrument.run_profiled(lambda: finalize.finalize(args.outfilename), args.profile, args.cprofile)
+    return run
+
+def load_auth():
+    import auth
+    return lambda args: auth.get_and_cache_spotify_token()
+
+def load_watch():
+    import os
+    import rolling
+    import watch
+
+    def run(args):
+        rolling.debug = args.debug
+        watch.watch(os.path.abspath(args.config) if args.config else None)
+    return run
+
+def describe(track):
+    return f"{track['name']} by {', '.join(track['artists'])}"
+
+def load_query():
+    from helpers.config import read_config
+    from helpers.log import get_log_path, log_exists
+    from helpers.timeline import Timeline
+
+    def run(args):
+        config = read_config()
+        if not log_exists(config):
+            print("ERROR: no log yet at", get_log_path(config), "(run rolling.py first)")
+            exit(1)
+        try:
+            timeline = Timeline.from_log(config)
+        except ValueError as e:
+            print("ERROR:", e)
+            exit(1)
+        if args.query == "on":
+            for track in sorted(timeline.contents_on(args.date), key=lambda t: t["name"]):
+                print(describe(track))
+        elif args.query == "top":
+            for track, days in timeline.top_tracks_by_days(args.start, args.end, args.count):
+                print(f"{days:>4} days  {describe(track)}")
+        elif args.query == "tenure":
+            for track in timeline.find_tracks(args.name):
+                print(f"{describe(track)}: {timeline.tenure(track)} days")
+                for start, end, _ in timeline.find_intervals(track):
+                    print(f"    {start.isoformat()} to {end.isoformat() if end else 'now'}")
+    return run
+
+def load_analyze():
+    import os
+    from helpers import analytics
+    from helpers.config import read_config, get_absolute_rolling_songs_dir
+    from helpers.state import PRETTY, write_state
+
+    def run(args):
+        paths = args.paths
+        cache_dir = args.cache_dir
+        skip = ()
+        if not paths or cache_dir is None:
+            config = read_config()
+            data_dir = get_absolute_rolling_songs_dir() + config["DATA_DIR"]
+            paths = paths or [ data_dir ]
+            cache_dir = cache_dir or data_dir + analytics.CACHE_DIRNAME
+            # the tracklist and the log being kept now aren't finished cycles
+            skip = ( config["STORAGE_FILENAME"], config["LOG_FILENAME"], config["LOG_FILENAME"] + ".migrated" )
+        if not cache_dir.endswith("/"):
+            cache_dir += "/"
+        for path in paths:
+            if not os.path.exists(path):
+                print("ERROR: no such file or folder:", path)
+                exit(1)
+
+        logs = analytics.find_logs(paths, skip)
+        if len(logs) == 0:
+            print("ERROR: no finalized logs found in", ", ".join(paths))
+            exit(1)
+        summaries, reprocessed = analytics.summarize_logs(logs, cache_dir, args.workers)
+        cycles, index = analytics.build_index(summaries)
+        if args.out:
+            write_state(args.out, { "cycles": cycles, "tracks": index }, PRETTY)
+
+        print(f"{len(cycles)} cycles from {len(logs)} files ({reprocessed} read, the rest cached), {len(index)} tracks")
+        for cycle in cycles:
+            print(f"    {cycle['name']}: {cycle['start']} to {cycle['end']}")
+        recurring = analytics.recurring_tracks(index)
+        print(f"\nin more than one cycle ({len(recurring)}):")
+        for track in recurring[:args.count]:
+            print(f"{len(track['cycles']):>4} cycles  {describe(track)} ({', '.join(track['cycles'])})")
+        print("\nlongest tenures ever:")
+        for track in analytics.longest_tenures(index, args.count):
+            print(f"{track['days']:>4} days  {describe(track)}")
+        print("\nmost played ever:")
+        for track in analytics.most_played(index, args.count):
+            print(f"{track['plays']:>4} plays  {describe(track)}")
+    return run
+
+# command name -> loader, which does the command's imports and returns its run(args)
+COMMANDS = {
+    "run": load_run,
+    "finalize": load_finalize,
+    "auth": load_auth,
+    "watch": load_watch,
+    "query": load_query,
+    "analyze": load_analyze,
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="rolling-songs: the sliding window playlist statkeeper")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="check the rolling playlist and record any changes")
+    run.add_argument("--debug", action="store_true")
+    instrument.add_profile_arguments(run)
+
+    finalize = commands.add_parser("finalize", help="close out the log and write the year-end stats")
+    finalize.add_argument("outfilename", help="file to write in {DATA_DIR}, overwritten if it exists")
+    instrument.add_profile_arguments(finalize)
+
+    commands.add_parser("auth", help="log in to spotify and save the token next to config.json")
+
+    watch = commands.add_parser("watch", help="keep checking the rolling playlist and log changes as they happen")
+    watch.add_argument("config", nargs="?", help="config file, defaults to config/config.json")
+    watch.add_argument("--debug", action="store_true")
+
+    query = commands.add_parser("query", help="answer questions from the log, no network needed")
+    queries = query.add_subparsers(dest="query", required=True)
+    on = queries.add_parser("on", help="tracks on the playlist at the end of a day")
+    on.add_argument("date", help="YYYY-MM-DD")
+    top = queries.add_parser("top", help="tracks with the most days on the playlist in [start, end)")
+    top.add_argument("start", help="YYYY-MM-DD")
+    top.add_argument("end", help="YYYY-MM-DD")
+    top.add_argument("--count", type=int, default=10)
+    tenure = queries.add_parser("tenure", help="days on the playlist of tracks whose name contains NAME")
+    tenure.add_argument("name")
+
+    analyze = commands.add_parser("analyze", help="tracks and tenures across many finalized logs (cycles)")
+    analyze.add_argument("paths", nargs="*", help="finalized logs or folders of them, defaults to {DATA_DIR}")
+    analyze.add_argument("--cache-dir", help="where each log's summary is cached, defaults to {DATA_DIR}analytics-cache/")
+    analyze.add_argument("--workers", type=int, help="processes to read logs with, defaults to one per cpu")
+    analyze.add_argument("--out", help="also write the whole per-track index to this json file")
+    analyze.add_argument("--count", type=int, default=10)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    COMMANDS[args.command]()(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+# long-running alternative to cron-jobbing rolling.py, for running many users
+# (or many rolling playlists) out of one process:
+#   python3 daemon.py config/users/           every *.json in the folder
+#   python3 daemon.py alice.json bob.json     or any list of config files
+# each config is a full config.json of its own, with its own DATA_DIR
+
+import argparse
+import glob
+import heapq
+import os
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import rolling
+from helpers.config import read_config, get_absolute_rolling_songs_dir
+from helpers.outbox import OutboxSender
+
+# how often each user's playlist gets checked, overridable per user with
+# RUN_INTERVAL_MINUTES in their config. runs with no changes cost one spotify request
+DEFAULT_RUN_INTERVAL_MINUTES = 60
+
+# a failing user is retried sooner than their usual interval, doubling up to that interval
+FAILURE_BACKOFF_SECONDS = 60
+
+def find_config_paths(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            found.append(path)
+    return [ os.path.abspath(path) for path in found ]
+
+class User:
+    """
+    One config file's worth of state: the parsed config, its authenticated
+    clients (created on first use and kept between runs) and its schedule.
+    """
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.config = read_config(config_path)
+        self.interval = float(self.config.get("RUN_INTERVAL_MINUTES", DEFAULT_RUN_INTERVAL_MINUTES)) * 60
+        self.failures = 0
+        self.spotify = None
+        self.lastfm = None
+
+    def get_spotify(self):
+        if self.spotify is None:
+            self.spotify = rolling.authenticate_spotify(self.config, self.config_path)
+        return self.spotify
+
+    def get_lastfm(self):
+        if self.lastfm is None:
+            self.lastfm = rolling.authenticate_lastfm(self.config)
+        return self.lastfm
+
+    def reset_clients(self):
+        # after a failure, start over with fresh clients in case one of them is wedged
+        self.spotify = None
+        self.lastfm = None
+
+    def next_delay(self):
+        if self.failures == 0:
+            return self.interval
+        return min(self.interval, FAILURE_BACKOFF_SECONDS * 2 ** (self.failures - 1))
+
+class Daemon:
+    """
+    Runs rolling.run for every user on a shared thread pool, each on their own
+    interval. Calls to each service are capped across all users at once.
+    """
+
+    def __init__(self, users, workers, spotify_concurrency, lastfm_concurrency):
+        self.users = users
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.limits = {
+            "spotify": threading.BoundedSemaphore(spotify_concurrency),
+            "lastfm": threading.BoundedSemaphore(lastfm_concurrency),
+        }
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        # spread first runs out a little so everyone doesn't hit spotify at once
+        now = time.monotonic()
+        self.schedule = [ (now + random.uniform(0, 5), i) for i in range(len(users)) ]
+        heapq.heapify(self.schedule)
+
+    def limit(self, service):
+        return self.limits[service]
+
+    def run_user(self, i):
+        user = self.users[i]
+        try:
+            changed = rolling.run(user.config, user.get_spotify(), user.get_lastfm, self.limit)
+            user.failures = 0
+            rolling.debug_print(f"{user.config_path}: {'updated' if changed else 'unchanged'}")
+        except (Exception, SystemExit):
+            # one user's bad token or missing playlist shouldn't take down everyone else
+            user.failures += 1
+            user.reset_clients()
+            print(f"run for {user.config_path} failed ({user.failures} in a row):")
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                heapq.heappush(self.schedule, (time.monotonic() + user.next_delay(), i))
+            self.wakeup.set()
+
+    def serve_forever(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.schedule and self.schedule[0][0] <= now:
+                    _, i = heapq.heappop(self.schedule)
+                    self.executor.submit(self.run_user, i)
+                timeout = self.schedule[0][0] - now if self.schedule else None
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+def load_users(config_paths):
+    users = [ User(path) for path in config_paths ]
+
+    # two users writing to the same files would corrupt each other's history
+    data_dirs = {}
+    for user in users:
+        data_dir = os.path.abspath(get_absolute_rolling_songs_dir() + user.config["DATA_DIR"])
+        if data_dir in data_dirs:
+            print(f"ERROR: {user.config_path} and {data_dirs[data_dir]} share the DATA_DIR {data_dir}")
+            exit(1)
+        data_dirs[data_dir] = user.config_path
+    return users
+
+def main():
+    parser = argparse.ArgumentParser(description="check many rolling playlists on a schedule")
+    parser.add_argument("configs", nargs="+", help="config files, or folders of them")
+    parser.add_argument("--workers", type=int, default=4, help="users run at the same time")
+    parser.add_argument("--spotify-concurrency", type=int, default=4, help="users talking to spotify at the same time")
+    parser.add_argument("--lastfm-concurrency", type=int, default=2, help="users talking to last.fm at the same time")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    rolling.debug = args.debug
+    config_paths = find_config_paths(args.configs)
+    if len(config_paths) == 0:
+        print("no config files found")
+        exit(1)
+
+    users = load_users(config_paths)
+
+    # emails queued by the runs go out from here, over one smtp session per sender
+    OutboxSender(lambda: [ user.config for user in users ]).start()
+
+    daemon = Daemon(users, args.workers, args.spotify_concurrency, args.lastfm_concurrency)
+    daemon.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,75 @@
 #!/usr/bin/python3
 
-import json
-import sys
-import shutil
+import argparse
 
+from helpers import instrument
+from helpers.instrument import stage
 from helpers.config import read_config, get_absolute_rolling_songs_dir
+from helpers.date import get_timezone
 from helpers.lastfm import get_lastfm_network
-from helpers.log import append_to_log
+from helpers.log import export_legacy_log, make_changelog
+from helpers.scrobbles import expire_scrobble_sync, get_playcounts, get_window_playcounts
+from helpers.state import get_state_encoding, read_state, write_state
+from helpers.stats import StatsAccumulator
 
 # takes the current tracklist and appends
 # the relevant information to the logfile
-# also re-parses and pretty prints the logfile, 
-# which has probably been pretty ugly up until now
-def finalize(outfilename):
-    config = read_config()
-    lastfm = get_lastfm_network(config).get_authenticated_user()
+# also exports the logfile as one json list,
+# the format the log used to be kept in, and in the same pass
+# writes the year-end rankings to {OUTPUT_FILENAME}-stats.json.
+# returns those stats
+# config and lastfm default to config/config.json and a fresh login,
+# benchmarks/bench_full_run.py passes its own
+def finalize(outfilename, config=None, lastfm=None):
+    if config is None:
+        config = read_config()
+    if lastfm is None:
+        with stage("authenticate_lastfm"):
+            lastfm = get_lastfm_network(config).get_authenticated_user()
 
     trackfilename = config["DATA_DIR"] + config["STORAGE_FILENAME"]
-    with open(get_absolute_rolling_songs_dir() + trackfilename, "r") as trackfile:
-        tracklist = json.load(trackfile)
+    tracklist = read_state(get_absolute_rolling_songs_dir() + trackfilename)
     
-    for track in tracklist:
-        # update playcounts to be as up-to-date as possible
-        scrobs = lastfm.get_track_scrobbles(track["artists"][0], track["name"])
-        track["playcount"] = len(scrobs) - track["playcount"]
+    # update playcounts to be as up-to-date as possible
+    expire_scrobble_sync(config)
+    with stage("finalize_playcounts"):
+        playcounts = get_playcounts(config, lastfm, tracklist)
+    for track, playcount in zip(tracklist, playcounts):
+        track["playcount"] = playcount - track["playcount"]
     
-    # cheekily rewrite the local config variable (not the config file itself)
-    # so we don't touch the old logfile
-    shutil.copy(config["DATA_DIR"] + config["LOG_FILENAME"], config["DATA_DIR"] + outfilename)
-    config["LOG_FILENAME"] = outfilename
-    append_to_log(config, tracklist, [])
-
-    # write log to new file prettily
-    with open(get_absolute_rolling_songs_dir() + config["DATA_DIR"] + outfilename, "r") as outfile:
-        unformatted = json.load(outfile)
-    
-    with open(get_absolute_rolling_songs_dir() + config["DATA_DIR"] + outfilename, "w") as outfile:
-        json.dump(unformatted, outfile, indent=4)
-    
-    # still return the json object
-    return unformatted
+    # the current tracks go out as one last substitution event, written
+    # alongside the existing log into a new file (prettily printed unless
+    # STATE_ENCODING says otherwise) so we don't touch the old logfile
+    with stage("finalize_write"):
+        final_event = make_changelog(tracklist, [])
+        outpath = get_absolute_rolling_songs_dir() + config["DATA_DIR"] + outfilename
+        stats = StatsAccumulator()
+        encoding = get_state_encoding(config)
+        export_legacy_log(config, outpath, [final_event], on_event=stats.add, encoding=encoding)
+
+    # month and season play rankings count the scrobbles in each month of each stay
+    with stage("finalize_stats"):
+        stats = stats.finish(window_plays=lambda tracks, windows: get_window_playcounts(config, lastfm, tracks, windows),
+                             tz=get_timezone(config))
+        write_state(get_stats_filename(outpath), stats, encoding)
+    return stats
+
+def get_stats_filename(outpath):
+    if outpath.endswith(".json"):
+        outpath = outpath[:-len(".json")]
+    return outpath + "-stats.json"
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("usage: python3 finalize.py {OUTPUT_FILENAME}")
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("outfilename", nargs="?")
+    instrument.add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.outfilename is None:
+        print("usage: python3 finalize.py {OUTPUT_FILENAME} [--profile REPORT] [--cprofile DUMP]")
         print("this will overwrite that file if it does not exist, dumping the json contents of the log into it.")
         print("this file will be stored in the {DATA_DIR} folder.")
         exit(1)
-    rolling_songs = finalize(sys.argv[1])
+    rolling_songs = instrument.run_profiled(lambda: finalize(args.outfilename), args.profile, args.cprofile)
 
     # now, using that finalized json object, generate web content
     # using vue, TODO this will belong in a diff file most likely
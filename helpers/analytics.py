@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.diff import get_track_id
+from helpers.state import COMPACT, GZIP_MAGIC, read_state, write_state
+from helpers.stats import StatsAccumulator
+
+# year-over-year stats across many finalized logs (finalize.py's output, one per cycle).
+# each log is boiled down to per-track totals on its own, in parallel across a process
+# pool, and that summary is cached under the hash of the log's contents, so rerunning
+# only reads logs that are new or have changed. the summaries are then merged into
+# one index of every track ever on the playlist and which cycles it was in
+CACHE_DIRNAME = "analytics-cache/"
+
+# bump when the summary format changes, so old cached summaries are ignored
+SUMMARY_VERSION = 1
+
+# files in DATA_DIR that are json but not finalized logs
+NOT_LOGS = ("-stats.json", "playlist-state.json", "log-playlist-uris.json", "run-journal.json")
+
+# how much of a file is read to tell whether it could be a finalized log
+SNIFF_BYTES = 64
+
+# finalize.py takes any OUTPUT_FILENAME, so folders are searched by what's in the
+# files rather than their names: a finalized log is a json list, maybe gzipped
+def looks_like_log(path):
+    try:
+        with open(path, "rb") as logfile:
+            head = logfile.read(SNIFF_BYTES)
+        if head.startswith(GZIP_MAGIC):
+            with gzip.open(path, "rb") as logfile:
+                head = logfile.read(SNIFF_BYTES)
+    except (OSError, EOFError):
+        return False
+    return head.lstrip().startswith(b"[")
+
+def find_logs(paths, skip=()):
+    """
+    :param paths: Finalized logs, or folders whose files that look like finalized
+                  logs are all taken to be (whatever they're named). anything that
+                  turns out not to be one is left out by summarize_logs
+    :param skip: Further file names to leave out of folders
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [ os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if not name.endswith(NOT_LOGS) and name not in skip ]
+            found.extend(name for name in names if os.path.isfile(name) and looks_like_log(name))
+        else:
+            found.append(path)
+    return found
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as logfile:
+        for chunk in iter(lambda: logfile.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def summarize_log(path):
+    """
+    Per-track totals (plays, days, stays) for one finalized log.
+    Runs in a worker process, so it takes and returns plain data.
+    :return: The summary dict, with "tracks" None if the file isn't a finalized log
+    """
+    try:
+        events = read_state(path)
+    except (OSError, EOFError, ValueError):
+        events = None
+    if not isinstance(events, list) or len(events) == 0 or "starting_tracks" not in events[0]:
+        return { "version": SUMMARY_VERSION, "start": None, "end": None, "tracks": None }
+
+    stats = StatsAccumulator()
+    for event in events:
+        stats.add(event)
+    result = stats.finish()
+    return {
+        "version": SUMMARY_VERSION,
+        "start": result["start"],
+        "end": result["end"],
+        "tracks": result["tracks"],
+    }
+
+def load_cached_summary(cache_dir, digest):
+    path = cache_dir + digest + ".json"
+    if not os.path.exists(path):
+        return None
+    summary = read_state(path)
+    if summary.get("version") != SUMMARY_VERSION:
+        return None
+    return summary
+
+def summarize_logs(paths, cache_dir, workers=None):
+    """
+    Summarizes each log, from the cache where its contents haven't changed
+    and on a process pool otherwise.
+    :param cache_dir: Folder for the cached summaries, created if needed
+    :param workers: Worker processes, defaults to one per cpu
+    :return: (summaries, reprocessed), summaries being (path, summary) for each
+             finalized log in the order given. a log found under more than one
+             path is only listed under the first
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    digests = [ hash_file(path) for path in paths ]
+    summaries = { digest: load_cached_summary(cache_dir, digest) for digest in set(digests) }
+    missing = [ (path, digest) for path, digest in zip(paths, digests) if summaries[digest] is None ]
+
+    # the same log under two names only needs doing once
+    missing = list({ digest: path for path, digest in missing }.items())
+    if len(missing) > 0:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(missing))) as executor:
+            results = executor.map(summarize_log, [ path for _, path in missing ])
+            for (digest, _), summary in zip(missing, results):
+                # files that turned out not to be logs are cached too, so they aren't read every time
+                summaries[digest] = summary
+                write_state(cache_dir + digest + ".json", summary, COMPACT)
+
+    found = []
+    seen = set()
+    for path, digest in zip(paths, digests):
+        if summaries[digest]["tracks"] is not None and digest not in seen:
+            found.append((path, summaries[digest]))
+            seen.add(digest)
+    return found, len(missing)
+
+def get_cycle_names(paths):
+    # cycles go by file name, with the folder added where two share a name
+    names = [ os.path.splitext(os.path.basename(path))[0] for path in paths ]
+    return [ name if names.count(name) == 1 else os.path.join(os.path.basename(os.path.dirname(path)), name)
+             for path, name in zip(paths, names) ]
+
+def build_index(summaries):
+    """
+    Merges per-log summaries into one entry per track, across every cycle.
+    :param summaries: List of (path, summary) as returned by summarize_logs
+    :return: (cycles, index). cycles is a list of {"name", "start", "end"} in start order.
+             index maps track key (uri, or name/artists/album) to the track's details plus
+             "cycles" (names, in order), "tenures" and "playcounts" (days and plays per cycle),
+             and "days", "plays" and "stays" in total
+    """
+    ordered = sorted(zip(get_cycle_names([ path for path, _ in summaries ]), [ s for _, s in summaries ]),
+                     key=lambda cycle: cycle[1]["start"] or "")
+    cycles = []
+    index = {}
+    for name, summary in ordered:
+        cycles.append({ "name": name, "start": summary["start"], "end": summary["end"] })
+        for track in summary["tracks"]:
+            key = get_track_id(track)
+            if key not in index:
+                index[key] = {
+                    "name": track["name"],
+                    "artists": track["artists"],
+                    "album": track["album"],
+                    "uri": track.get("uri"),
+                    "cycles": [],
+                    "tenures": {},
+                    "playcounts": {},
+                    "days": 0,
+                    "plays": 0,
+                    "stays": 0,
+                }
+            entry = index[key]
+            entry["cycles"].append(name)
+            entry["tenures"][name] = track["days"]
+            entry["playcounts"][name] = track["plays"]
+            entry["days"] += track["days"]
+            entry["plays"] += track["plays"]
+            entry["stays"] += track["stays"]
+    return cycles, index
+
+def recurring_tracks(index, min_cycles=2):
+    tracks = [ track for track in index.values() if len(track["cycles"]) >= min_cycles ]
+    return sorted(tracks, key=lambda t: (-len(t["cycles"]), -t["days"], t["name"]))
+
+def longest_tenures(index, count=10):
+    return sorted(index.values(), key=lambda t: (-t["days"], t["name"]))[:count]
+
+def most_played(index, count=10):
+    return sorted(index.values(), key=lambda t: (-t["plays"], t["name"]))[:count]
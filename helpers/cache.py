@@ -1,18 +1,19 @@
 from spotipy import CacheHandler
 
-from helpers.config import write_config, read_config
+from helpers.config import read_token, write_token
 
 class ConfigCacheHandler(CacheHandler):
     """
     Handles reading and writing cached Spotify authorization tokens
-    by appending them to the config JSON file.
+    in the token file that sits next to the config JSON file.
+    :param config_path: The config file to use, defaults to config/config.json
     """
 
+    def __init__(self, config_path=None):
+        self.config_path = config_path
+
     def get_cached_token(self):
-        config = read_config()
-        return config.get("SPOTIFY_TOKEN", None)
+        return read_token(self.config_path)
 
     def save_token_to_cache(self, token_info):
-        config = read_config()
-        config["SPOTIFY_TOKEN"] = token_info
-        write_config(config)
\ No newline at end of file
+        write_token(token_info, self.config_path)
@@ -1,36 +1,96 @@
+import copy
 import json
+import os
+import threading
 from os.path import dirname, abspath
 
+from helpers.files import atomic_write, locked
+
 def get_absolute_rolling_songs_dir():
     return dirname(dirname(abspath(__file__))) + "/"
 
-def read_config(): # TODO add functionality for leaving out the lastfm info
-    # IMPORTANT: config.json is the only thing that's .gitignore'd
-    # don't put your details in example.json, or a file with any other name
-    with open(get_absolute_rolling_songs_dir() + "config/config.json", "r") as cfile:
-        config = json.load(cfile)
+def get_default_config_path():
+    return get_absolute_rolling_songs_dir() + "config/config.json"
 
-    # get required fields from the example file
-    with open(get_absolute_rolling_songs_dir() + "config/example.json", "r") as example_conf:
-        required_fields = json.load(example_conf).keys()
+# the spotify token lives in its own small file next to the config,
+# e.g. config/config.json -> config/config.token.json, so refreshing
+# it every hour doesn't mean rewriting the whole config
+def get_token_path(config_path=None):
+    path = config_path or get_default_config_path()
+    if path.endswith(".json"):
+        path = path[:-len(".json")]
+    return path + ".token.json"
 
+# parsed configs and tokens are kept for the life of the process,
+# keyed by absolute path. tokens also remember the file's mtime so
+# a refresh written by another process gets picked up
+configs = {}
+tokens = {}
+required_fields = None
+store_lock = threading.Lock()
+
+def get_required_fields():
+    global required_fields
+    if required_fields is None:
+        # get required fields from the example file
+        with open(get_absolute_rolling_songs_dir() + "config/example.json", "r") as example_conf:
+            required_fields = list(json.load(example_conf).keys())
+    return required_fields
+
+def validate_config(config, path):
     error = False
     error_msg = ''
-    for field in required_fields:
+    for field in get_required_fields():
         if field not in config.keys():
             error = True
             error_msg += f'\"{field}\", '
-    
+
     if error:
-        print('ERROR: your config.json is missing the following required fields:')
+        print(f'ERROR: your {path or "config.json"} is missing the following required fields:')
         print('\t[ ', end='')
         error_msg = error_msg[:-2] # pop trailing comma and space
         print(error_msg, end='')
         print(' ]')
         exit(1)
 
-    return config
+# path defaults to config/config.json, the daemon passes one path per user.
+# the file is only parsed and validated the first time, callers get their own copy
+def read_config(path=None): # TODO add functionality for leaving out the lastfm info
+    # IMPORTANT: config.json is the only thing that's .gitignore'd
+    # don't put your details in example.json, or a file with any other name
+    key = abspath(path or get_default_config_path())
+    with store_lock:
+        if key not in configs:
+            with open(key, "r") as cfile:
+                config = json.load(cfile)
+            validate_config(config, path)
+            configs[key] = config
+        return copy.deepcopy(configs[key])
+
+def read_token(config_path=None):
+    """
+    Returns the cached spotify token, or None if there isn't one yet.
+    Falls back on SPOTIFY_TOKEN in the config itself, where older versions kept it.
+    """
+    token_path = get_token_path(config_path)
+    with store_lock:
+        try:
+            mtime = os.stat(token_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is not None:
+            cached = tokens.get(token_path)
+            if cached is None or cached[0] != mtime:
+                with open(token_path, "r") as tfile:
+                    tokens[token_path] = (mtime, json.load(tfile))
+            return copy.deepcopy(tokens[token_path][1])
+
+    token = read_config(config_path).get("SPOTIFY_TOKEN", None)
+    return token if isinstance(token, dict) else None
 
-def write_config(config):
-    with open(get_absolute_rolling_songs_dir() + "config/config.json", "w") as cfile:
-        json.dump(config, cfile, indent=4)
\ No newline at end of file
+def write_token(token, config_path=None):
+    token_path = get_token_path(config_path)
+    with store_lock, locked(token_path):
+        atomic_write(token_path, json.dumps(token, indent=4))
+        tokens[token_path] = (os.stat(token_path).st_mtime_ns, copy.deepcopy(token))
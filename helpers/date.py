@@ -1,13 +1,106 @@
+import bisect
 import datetime
 
+# numpy is optional, it only makes counting over very long histories faster.
+# it's slow to import, so that waits until something is actually counted
+numpy = None
+numpy_checked = False
+
+def get_numpy():
+    global numpy, numpy_checked
+    if not numpy_checked:
+        try:
+            import numpy as numpy_module
+            numpy = numpy_module
+        except ImportError:
+            pass
+        numpy_checked = True
+    return numpy
+
 DATE_FORMAT = "%Y-%m-%d"
 
+# stand-ins for an open end of a window, the range of an int64 timestamp
+MIN_TIMESTAMP = -2 ** 63
+MAX_TIMESTAMP = 2 ** 63 - 1
+
 # returns current date as a formatted string
 def get_date():
     return datetime.datetime.today().strftime(DATE_FORMAT)
 
-def is_ts_before_yesterday(timestamp):
-    today = datetime.datetime.today()
-    yesterday = today - datetime.timedelta(days=1)
-    date = datetime.datetime.fromtimestamp(timestamp)
-    return date < yesterday
+# unix timestamp of this time yesterday, only plays before this count towards a new track's playcount.
+# "yesterday" is by the clock in tz, so it's 23 or 25 hours back across a daylight saving change
+def get_yesterday_timestamp(tz=None):
+    yesterday = datetime.datetime.now(tz) - datetime.timedelta(days=1)
+    return int(yesterday.timestamp())
+
+# unix timestamp of one of spotify's iso 8601 times, e.g. a playlist item's added_at
+def parse_spotify_timestamp(timestamp):
+    return int(datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp())
+
+# the optional TIMEZONE field in config.json (e.g. "America/New_York") decides where
+# days and months start. None means the machine's local timezone
+def get_timezone(config):
+    name = config.get("TIMEZONE")
+    if not name:
+        return None
+    import zoneinfo
+    return zoneinfo.ZoneInfo(name)
+
+def to_date(date):
+    if isinstance(date, str):
+        return datetime.datetime.strptime(date, DATE_FORMAT).date()
+    return date
+
+def day_start_timestamp(date, tz=None):
+    """
+    Unix timestamp of midnight at the start of a day, in the given timezone.
+    Goes through the timezone rather than adding 86400s a day, so days around
+    daylight saving changes come out 23 or 25 hours long like they should.
+    :param date: A datetime.date or a DATE_FORMAT string
+    :param tz: A tzinfo, None for the machine's local timezone
+    """
+    date = to_date(date)
+    return int(datetime.datetime(date.year, date.month, date.day, tzinfo=tz).timestamp())
+
+def month_windows(year, tz=None):
+    """
+    One [t0, t1) window per calendar month of a year.
+    :return: List of 12 (t0, t1) unix timestamp pairs
+    """
+    bounds = [ day_start_timestamp(datetime.date(year, month, 1), tz) for month in range(1, 13) ]
+    bounds.append(day_start_timestamp(datetime.date(year + 1, 1, 1), tz))
+    return list(zip(bounds, bounds[1:]))
+
+def as_timestamp_array(timestamps, presorted=False):
+    """
+    Sorts timestamps into the form count_in_windows expects:
+    an int64 numpy array if numpy is around, otherwise a plain sorted list.
+    :param presorted: The timestamps are already in order (say, from an ORDER BY), skip sorting them
+    """
+    numpy = get_numpy()
+    if numpy is not None:
+        array = numpy.fromiter(timestamps, dtype=numpy.int64)
+        if not presorted:
+            array.sort()
+        return array
+    if presorted:
+        return [ int(timestamp) for timestamp in timestamps ]
+    return sorted(int(timestamp) for timestamp in timestamps)
+
+def count_in_windows(timestamps, windows):
+    """
+    Counts the timestamps falling in each [t0, t1) window, with two binary
+    searches per window instead of a look at every timestamp.
+    :param timestamps: Sorted timestamps, as returned by as_timestamp_array
+    :param windows: List of (t0, t1) pairs, either end can be None for no bound
+    :return: List of counts, one per window
+    """
+    starts = [ MIN_TIMESTAMP if t0 is None else int(t0) for t0, _ in windows ]
+    ends = [ MAX_TIMESTAMP if t1 is None else int(t1) for _, t1 in windows ]
+    numpy = get_numpy()
+    if numpy is not None and isinstance(timestamps, numpy.ndarray):
+        lower = numpy.searchsorted(timestamps, numpy.array(starts, dtype=numpy.int64), side="left")
+        upper = numpy.searchsorted(timestamps, numpy.array(ends, dtype=numpy.int64), side="left")
+        return numpy.maximum(upper - lower, 0).tolist()
+    return [ max(0, bisect.bisect_left(timestamps, t1) - bisect.bisect_left(timestamps, t0))
+             for t0, t1 in zip(starts, ends) ]
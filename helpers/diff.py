@@ -0,0 +1,87 @@
+from collections import defaultdict, deque
+
+def normalize_field(value):
+    return " ".join(str(value).split()).casefold()
+
+# identity key for a track: same name, same artists (in order), same album.
+# spotify sometimes hands out a new uri for the same song (relinking, re-releases),
+# so this is what we fall back on when the uris don't line up
+def track_key(track):
+    return (
+        normalize_field(track["name"]),
+        tuple(normalize_field(artist) for artist in track["artists"]),
+        normalize_field(track["album"]),
+    )
+
+# one string per track: its uri where it has one, otherwise its track_key.
+# what the timeline, the analytics index and the identity cache key tracks on
+def get_track_id(track):
+    uri = track.get("uri")
+    if uri is not None:
+        return uri
+    name, artists, album = track_key(track)
+    return "\x1f".join([ name, *artists, album ])
+
+def index_tracklist(tracklist):
+    """
+    Builds uri and name/artists/album indexes over a list of tracks.
+    :param tracklist: A list of track dicts
+    :return: (by_uri, by_key), each mapping to a deque of positions in tracklist,
+             in order, so duplicates get matched first-come-first-served
+    """
+    by_uri = defaultdict(deque)
+    by_key = defaultdict(deque)
+    for i, track in enumerate(tracklist):
+        uri = track.get("uri")
+        if uri is not None:
+            by_uri[uri].append(i)
+        by_key[track_key(track)].append(i)
+    return by_uri, by_key
+
+def pop_unmatched(positions, matched):
+    while positions:
+        i = positions.popleft()
+        if not matched[i]:
+            return i
+    return None
+
+def diff_tracklists(new_tracks, old_tracks):
+    """
+    Diffs two tracklists in O(n+m).
+    Each old track is matched to at most one new track, preferring an exact uri
+    match and falling back on the normalized name/artists/album key.
+    :param new_tracks: Iterable of tracks currently on the playlist
+    :param old_tracks: List of previously stored tracks (with playcounts)
+    :return: (added, kept, removed). added are new track dicts in playlist order,
+             kept are the matching old track dicts in playlist order, and removed
+             are the unmatched old track dicts in their stored order
+    """
+    new_tracks = list(new_tracks)
+    old_tracks = list(old_tracks)
+    by_uri, by_key = index_tracklist(old_tracks)
+    matched = [False] * len(old_tracks)
+
+    # every exact uri match first, so a relinked copy of a track earlier in the
+    # playlist can't take the old track from the one that really is it
+    matches = [None] * len(new_tracks)
+    for j, new_track in enumerate(new_tracks):
+        uri = new_track.get("uri")
+        if uri is not None and uri in by_uri:
+            matches[j] = pop_unmatched(by_uri[uri], matched)
+            if matches[j] is not None:
+                matched[matches[j]] = True
+
+    # then name/artists/album for what's left
+    for j, new_track in enumerate(new_tracks):
+        if matches[j] is None:
+            key = track_key(new_track)
+            if key in by_key:
+                matches[j] = pop_unmatched(by_key[key], matched)
+                if matches[j] is not None:
+                    matched[matches[j]] = True
+
+    added = [ new_track for new_track, i in zip(new_tracks, matches) if i is None ]
+    kept = [ old_tracks[i] for i in matches if i is not None ]
+
+    removed = [ track for i, track in enumerate(old_tracks) if not matched[i] ]
+    return added, kept, removed
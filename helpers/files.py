@@ -0,0 +1,67 @@
+import os
+import contextlib
+import threading
+
+# fcntl is unix only, which is fine for cron boxes. elsewhere, writes are
+# still atomic, they just aren't serialized between processes
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+@contextlib.contextmanager
+def locked(path):
+    """
+    Holds an exclusive lock on {path}.lock for the duration of the with block,
+    so concurrent runs take turns writing path.
+    """
+    lock_path = path + ".lock"
+    with open(lock_path, "a") as lockfile:
+        if fcntl is not None:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+def fsync_dir(path):
+    # makes a rename in path's folder durable. windows can't open folders, and doesn't need to
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w"):
+    """
+    Opens a temp file next to path for writing, and once the with block is done
+    fsyncs it and renames it over path. Readers see either the old file or the
+    new one, never half of each. If the block raises, path is left alone and
+    the temp file is removed. The temp file's name is unique to this process
+    and thread, so writers racing on the same path can't clobber each other's.
+    :param mode: "w" for text (utf-8) or "wb" for bytes
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    encoding = None if "b" in mode else "utf-8"
+    try:
+        with open(temp_path, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+    fsync_dir(path)
+
+def atomic_write(path, data):
+    """
+    Writes data (str or bytes) to path atomically, see atomic_open.
+    """
+    with atomic_open(path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
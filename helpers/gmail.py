@@ -1,22 +1,12 @@
-import email, smtplib, ssl
+# smtplib, ssl and the email modules are imported when a message is actually
+# built or sent, so queueing an email (see helpers/outbox.py) doesn't load them
 
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+SMTP_HOST = "smtp.gmail.com"
+SMTP_SSL_PORT = 465
 
-def send_gmail(sender, sender_pw, receiver, subject, content):
-    """
-    Sends a simple text-based email over GMail.
-    :param sender: The gmail address of the sending account
-    :param sender_pw: The password associated with the sender gmail account
-    :param receiver: The gmail address you'd like to send the email to
-    :param content: The actual text content of the email
-    """
-    port = 465  # for ssl
-
-    # necessary for secure ssl context
-    context = ssl.create_default_context()
+def make_message(sender, receiver, subject, content):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
 
     message = MIMEMultipart()
     message["From"] = sender
@@ -25,7 +15,76 @@ def send_gmail(sender, sender_pw, receiver, subject, content):
 
     # specify utf-8, definitely could have some weird characters
     message.attach(MIMEText(content, "plain", "utf-8"))
+    return message
+
+class GmailSession:
+    """
+    One logged-in SMTP connection reused across many messages.
+    Connects on the first send and reconnects once if the server has hung up in between.
+    :param sender: The gmail address of the sending account
+    :param sender_pw: The password associated with the sender gmail account
+    :param host: The smtp server, only worth changing to point at a local test sink
+    :param port: The smtp server's port
+    :param use_ssl: Whether to connect over ssl (a local test sink speaks plain smtp)
+    """
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", port, context=context) as server:
-        server.login(sender, sender_pw)
-        server.sendmail(sender, receiver, message.as_string())
+    def __init__(self, sender, sender_pw, host=SMTP_HOST, port=SMTP_SSL_PORT, use_ssl=True):
+        self.sender = sender
+        self.sender_pw = sender_pw
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.server = None
+
+    def connect(self):
+        import smtplib
+        if self.use_ssl:
+            import ssl
+            # necessary for secure ssl context
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context)
+        else:
+            server = smtplib.SMTP(self.host, self.port)
+        server.login(self.sender, self.sender_pw)
+        self.server = server
+
+    def send(self, receiver, subject, content):
+        import smtplib
+        message = make_message(self.sender, receiver, subject, content).as_string()
+        if self.server is None:
+            self.connect()
+        try:
+            self.server.sendmail(self.sender, receiver, message)
+        except smtplib.SMTPServerDisconnected:
+            # idle connections get dropped, so try once more on a fresh one
+            self.connect()
+            self.server.sendmail(self.sender, receiver, message)
+
+    def close(self):
+        import smtplib
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def send_gmail(sender, sender_pw, receiver, subject, content, host=SMTP_HOST, port=SMTP_SSL_PORT, use_ssl=True):
+    """
+    Sends a simple text-based email over GMail.
+    :param sender: The gmail address of the sending account
+    :param sender_pw: The password associated with the sender gmail account
+    :param receiver: The gmail address you'd like to send the email to
+    :param content: The actual text content of the email
+    :param host: The smtp server, only worth changing to point at a local test sink
+    :param port: The smtp server's port
+    :param use_ssl: Whether to connect over ssl (a local test sink speaks plain smtp)
+    """
+    with GmailSession(sender, sender_pw, host, port, use_ssl) as session:
+        session.send(receiver, subject, content)
@@ -0,0 +1,218 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import instrument
+from helpers.config import get_absolute_rolling_songs_dir
+from helpers.diff import get_track_id
+from helpers.lastfm import get_lookup_concurrency
+
+# spotify names and last.fm's don't always agree ("Help! - Remastered 2009" vs "Help!",
+# feature credits in the title, a first artist last.fm spells differently), so each
+# track's last.fm (artist, track) is worked out once and kept in DATA_DIR under this
+# name unless IDENTITY_CACHE_FILENAME says otherwise. set it to "" to skip all of
+# this and look tracks up under spotify's names as they are
+DEFAULT_IDENTITY_CACHE_FILENAME = "track-identities.sqlite3"
+
+# least recently used entries are dropped past this many
+MAX_CACHED_IDENTITIES = 20000
+
+# a track found in the user's scrobbles stays resolved for months. one that wasn't
+# (usually a song that hasn't been played yet) is tried again the next day
+FOUND_TTL_SECONDS = 180 * 24 * 60 * 60
+NOT_FOUND_TTL_SECONDS = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS identities (
+    key TEXT PRIMARY KEY,
+    artist TEXT NOT NULL,
+    track TEXT NOT NULL,
+    found INTEGER NOT NULL,
+    resolved_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS identities_used_at ON identities (used_at);
+"""
+
+# feature credits, "(feat. x)" or "[ft. y]"
+FEATURE_PATTERN = re.compile(r"\s*[\(\[](feat\.?|ft\.?|featuring)\s[^\)\]]*[\)\]]", re.IGNORECASE)
+
+# spotify's "(with x & y)" credits. only a credit when it names one of the track's
+# artists, otherwise it's part of the title ("Song (With Love)")
+WITH_PATTERN = re.compile(r"\s*[\(\[]with\s([^\)\]]*)[\)\]]", re.IGNORECASE)
+CREDIT_SEPARATOR = re.compile(r"\s*(?:,|&|\band\b)\s*")
+
+# remaster and mono/stereo tags, " - Remastered 2011", " - 2009 Mono Version" or "(2015 Remaster)".
+# remixes, live takes and edits are left alone, those really are different tracks
+EDITION_PATTERN = re.compile(
+    r"\s+-\s+[^-]*\b(remaster(ed)?|mono|stereo)\b[^-]*$"
+    r"|\s*[\(\[][^\)\]]*\b(remaster(ed)?|mono|stereo)\b[^\)\]]*[\)\]]",
+    re.IGNORECASE)
+
+def clean_name(name, artists=()):
+    artists = { artist.casefold() for artist in artists }
+
+    def drop_credit(match):
+        credited = CREDIT_SEPARATOR.split(match.group(1).casefold())
+        return "" if any(artist.strip() in artists for artist in credited) else match.group(0)
+
+    cleaned = EDITION_PATTERN.sub("", WITH_PATTERN.sub(drop_credit, FEATURE_PATTERN.sub("", name)))
+    return " ".join(cleaned.split()) or name
+
+class IdentityCache:
+    """
+    SQLite map from a spotify track (by uri) to the (artist, track) it's scrobbled
+    as on last.fm, with entries expiring after a TTL and the least recently used
+    dropped past a size limit. Shared by every script working on the same DATA_DIR.
+    """
+
+    def __init__(self, path, max_entries=MAX_CACHED_IDENTITIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def get_many(self, keys, now):
+        """
+        :return: Dict of key -> (artist, track) for the keys with a live entry
+        """
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT artist, track, found, resolved_at FROM identities WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                artist, track, was_found, resolved_at = row
+                ttl = FOUND_TTL_SECONDS if was_found else NOT_FOUND_TTL_SECONDS
+                if now - resolved_at < ttl:
+                    found[key] = (artist, track)
+            with self.conn:
+                self.conn.executemany("UPDATE identities SET used_at = ? WHERE key = ?",
+                                      [ (now, key) for key in found ])
+        return found
+
+    def put_many(self, entries, now):
+        """
+        :param entries: List of (key, artist, track, found)
+        """
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO identities VALUES (?, ?, ?, ?, ?, ?)",
+                                  [ (key, artist, track, int(found), now, now) for key, artist, track, found in entries ])
+            self.conn.execute(
+                "DELETE FROM identities WHERE key IN "
+                "(SELECT key FROM identities ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def close(self):
+        self.conn.close()
+
+# one cache per file per process, like helpers.scrobbles.stores
+caches = {}
+caches_lock = threading.Lock()
+
+def get_identity_cache(config):
+    filename = config.get("IDENTITY_CACHE_FILENAME", DEFAULT_IDENTITY_CACHE_FILENAME)
+    if filename == "":
+        return None
+
+    data_dir_path = get_absolute_rolling_songs_dir() + config["DATA_DIR"]
+    path = data_dir_path + filename
+    with caches_lock:
+        if path not in caches:
+            os.makedirs(data_dir_path, exist_ok=True)
+            caches[path] = IdentityCache(path)
+        return caches[path]
+
+# last.fm answers unknown tracks and artists with an error rather than an empty result
+def ask_lastfm(call):
+    import pylast
+    try:
+        return call()
+    except pylast.WSError:
+        return None
+
+def get_correction(lastfm, artist, title):
+    network = lastfm.network
+    corrected_artist = ask_lastfm(lambda: network.get_artist(artist).get_correction()) or artist
+    corrected_title = ask_lastfm(lambda: network.get_track(corrected_artist, title).get_correction()) or title
+    return corrected_artist, corrected_title
+
+def get_search_result(lastfm, artist, title):
+    results = ask_lastfm(lambda: lastfm.network.search_for_track(artist, title).get_next_page())
+    if not results:
+        return None
+    return results[0].artist.name, results[0].title
+
+def make_lastfm_has_plays(lastfm):
+    import pylast
+    def has_plays(artist, title):
+        track = pylast.Track(artist, title, lastfm.network, username=lastfm.name)
+        return (ask_lastfm(track.get_userplaycount) or 0) > 0
+    return has_plays
+
+def resolve_track(lastfm, track, has_plays):
+    """
+    Finds the (artist, track) a spotify track is scrobbled under, trying
+    the names as they are, then cleaned up, then last.fm's correction of those
+    and finally its top search result, stopping at the first the user has plays of.
+    :param has_plays: Callable (artist, track) -> whether the user has scrobbled it
+    :return: ((artist, track), found), the names as they are if nothing had plays
+    """
+    artist = track["artists"][0]
+    title = track["name"]
+    cleaned = clean_name(title, track["artists"])
+    candidates = [
+        lambda: (artist, title),
+        lambda: (artist, cleaned),
+        lambda: get_correction(lastfm, artist, cleaned),
+        lambda: get_search_result(lastfm, artist, cleaned),
+    ]
+
+    tried = set()
+    for candidate in candidates:
+        names = candidate()
+        if names is None or names in tried:
+            continue
+        tried.add(names)
+        if has_plays(*names):
+            return names, True
+    return (artist, title), False
+
+def resolve_tracks(config, lastfm, tracks, has_plays=None):
+    """
+    Gets the last.fm (artist, track) of each spotify track, from the identity
+    cache where possible and by asking last.fm (on a thread pool, throttled
+    like every other last.fm lookup) otherwise.
+    :param has_plays: Callable (artist, track) -> whether the user has scrobbled it,
+                      asks last.fm for the user's playcount if not given
+    :return: List of (artist, track), in the same order as tracks
+    """
+    tracks = list(tracks)
+    cache = get_identity_cache(config)
+    if cache is None or len(tracks) == 0:
+        return [ (track["artists"][0], track["name"]) for track in tracks ]
+
+    now = time.time()
+    keys = [ get_track_id(track) for track in tracks ]
+    identities = cache.get_many(set(keys), now)
+    missing = { key: track for key, track in zip(keys, tracks) if key not in identities }
+    if len(missing) > 0:
+        if has_plays is None:
+            has_plays = make_lastfm_has_plays(lastfm)
+
+        with ThreadPoolExecutor(max_workers=min(get_lookup_concurrency(config), len(missing))) as executor:
+            resolve = instrument.carry_stage(lambda track: resolve_track(lastfm, track, has_plays))
+            resolved = list(executor.map(resolve, missing.values()))
+
+        entries = []
+        for key, (names, found) in zip(missing, resolved):
+            identities[key] = names
+            entries.append((key, names[0], names[1], found))
+        cache.put_many(entries, now)
+
+    return [ identities[key] for key in keys ]
@@ -0,0 +1,163 @@
+import contextlib
+import cProfile
+import json
+import sys
+import threading
+import time
+
+# lightweight per-stage instrumentation. nothing is recorded unless
+# start() has been called (rolling.py/finalize.py --profile), so the
+# stage() context managers sprinkled through the code are free otherwise
+
+class Report:
+    """
+    Collects wall time, HTTP calls, bytes received, retries and time spent waiting
+    (on retries, and for a turn at a busy host) per stage, see helpers/transport.py.
+    HTTP traffic is attributed to whichever stage its thread is in when it happens.
+    Each thread has its own stack of stages (daemon.py runs several users at once),
+    and worker threads pick up the stage that handed them work, see carry_stage.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                "calls": 0,
+                "wall_time": 0.0,
+                "http_calls": 0,
+                "bytes": 0,
+                "retries": 0,
+                "retry_wait": 0.0,
+                "queue_wait": 0.0,
+                "coalesced": 0,
+            }
+        return self.stages[name]
+
+    # this thread's stages, innermost last
+    def get_stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def set_stack(self, stack):
+        self.local.stack = stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.get_stack()
+        stack.append(name)
+        with self.lock:
+            self.get_stage(name)["calls"] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                self.get_stage(name)["wall_time"] += elapsed
+
+    def current_stage(self):
+        stack = self.get_stack()
+        return self.get_stage(stack[-1] if stack else "other")
+
+    def record_http(self, nbytes, status):
+        with self.lock:
+            stats = self.current_stage()
+            stats["http_calls"] += 1
+            stats["bytes"] += nbytes
+
+    def record_transport(self, **amounts):
+        with self.lock:
+            stats = self.current_stage()
+            for key, amount in amounts.items():
+                stats[key] += amount
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "total_wall_time": time.perf_counter() - self.started,
+                "stages": { name: dict(stats) for name, stats in self.stages.items() },
+            }
+
+report = None
+
+def enabled():
+    return report is not None
+
+def stage(name):
+    if report is None:
+        return contextlib.nullcontext()
+    return report.stage(name)
+
+def carry_stage(fn):
+    """
+    Wraps fn so that, wherever it's called (say, on a thread pool's workers),
+    it's counted towards the stage the calling thread is in right now.
+    """
+    if report is None:
+        return fn
+    stack = list(report.get_stack())
+
+    def run(*args, **kwargs):
+        previous = report.get_stack()
+        report.set_stack(list(stack))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            report.set_stack(previous)
+    return run
+
+def record_http(nbytes, status):
+    if report is not None:
+        report.record_http(nbytes, status)
+
+def record_transport(**amounts):
+    if report is not None:
+        report.record_transport(**amounts)
+
+def start():
+    global report
+    report = Report()
+    return report
+
+def write_report(path):
+    output = json.dumps(report.to_dict(), indent=4)
+    if path == "-":
+        print(output)
+        return
+    with open(path, "w") as reportfile:
+        reportfile.write(output + "\n")
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="write a json report of wall time, http calls, bytes, retries and waits per stage to REPORT (- for stdout)")
+    parser.add_argument("--cprofile", metavar="DUMP",
+                        help="also run under cProfile and dump its stats to DUMP (for pstats/snakeviz)")
+
+def run_profiled(fn, report_path=None, cprofile_path=None):
+    """
+    Calls fn(), recording a stage report if report_path is set and
+    a cProfile dump if cprofile_path is set. Either way returns fn's result.
+    """
+    if report_path is None and cprofile_path is None:
+        return fn()
+
+    start()
+    profiler = cProfile.Profile() if cprofile_path is not None else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        return fn()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        if report_path is not None:
+            write_report(report_path)
+        sys.stdout.flush()
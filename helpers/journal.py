@@ -0,0 +1,53 @@
+import os
+import time
+
+from helpers.config import get_absolute_rolling_songs_dir
+from helpers.state import COMPACT, read_state, write_state
+
+# once a run has fetched the rolling playlist and worked out what changed, it writes
+# that here before looking anything up or touching anything, then checks off each
+# step that follows as it completes, saving the step's results (the playcounts)
+# along with it. if the run dies partway, the next run finishes the journal's
+# remaining steps from the saved results instead of starting over, and the steps
+# themselves are written so redoing one is harmless.
+# the journal is deleted once every step is done
+JOURNAL_FILENAME = "run-journal.json"
+
+def get_journal_path(config):
+    return get_absolute_rolling_songs_dir() + config["DATA_DIR"] + JOURNAL_FILENAME
+
+def load_journal(config):
+    """
+    :return: The unfinished run's journal, or None if the last run finished
+    """
+    path = get_journal_path(config)
+    if not os.path.exists(path):
+        return None
+    return read_state(path)
+
+def start_journal(config, **results):
+    """
+    Durably records a run's results before any of its steps are carried out.
+    :param results: Everything the remaining steps need, json-ready
+    :return: The journal
+    """
+    journal = dict(results, started=time.time(), done=[])
+    write_state(get_journal_path(config), journal, COMPACT)
+    return journal
+
+def is_done(journal, step):
+    return step in journal["done"]
+
+def mark_done(config, journal, step, **results):
+    """
+    Durably checks off a step.
+    :param results: Anything the step worked out that later steps need, json-ready
+    """
+    journal.update(results)
+    journal["done"].append(step)
+    write_state(get_journal_path(config), journal, COMPACT)
+
+def finish_journal(config):
+    path = get_journal_path(config)
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,10 +1,60 @@
-import pylast
+from concurrent.futures import ThreadPoolExecutor
 
+from helpers import instrument
+from helpers.transport import get_transport, install_httpx
+
+# last.fm asks for no more than 5 requests per second per originating ip,
+# averaged over a 5 minute period. these can be overridden in config.json
+# with the optional LASTFM_CONCURRENCY and LASTFM_REQUESTS_PER_SECOND fields
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_SECOND = 5
+
+LASTFM_HOST = "ws.audioscrobbler.com"
+
+# pylast is only imported once something actually needs last.fm.
+# its requests go through the shared transport (see helpers/transport.py),
+# which holds every one of them, each page of a lookup included, to the rate
 def get_lastfm_network(config):
+    import pylast
+    install_httpx()
+    get_transport().throttle(LASTFM_HOST, get_lastfm_rate(config))
     network = pylast.LastFMNetwork(
         api_key=config["LASTFM_API_KEY"],
         api_secret=config["LASTFM_SECRET"],
         username=config["LASTFM_USERNAME"],
         password_hash=pylast.md5(config["LASTFM_PASSWORD"])
     )
-    return network
\ No newline at end of file
+    return network
+
+def get_lastfm_rate(config):
+    return float(config.get("LASTFM_REQUESTS_PER_SECOND", DEFAULT_REQUESTS_PER_SECOND))
+
+def get_lookup_concurrency(config):
+    return max(1, int(config.get("LASTFM_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+def fetch_track_scrobbles(lastfm, track):
+    return lastfm.get_track_scrobbles(track["artists"][0], track["name"])
+
+def get_scrobbles_for_tracks(lastfm, tracks, concurrency=DEFAULT_CONCURRENCY, fetch=fetch_track_scrobbles):
+    """
+    Looks up the scrobbles of many tracks at once on a thread pool.
+    The requests themselves are throttled by the transport, see get_lastfm_network.
+    :param lastfm: The authenticated pylast user (passed through to fetch)
+    :param tracks: List of track dicts with "name" and "artists" fields
+    :param concurrency: Max number of lookups in flight at once
+    :param fetch: Callable (lastfm, track) -> scrobbles, swappable for a fake in testing
+    :return: List of scrobble lists, in the same order as tracks
+    """
+    tracks = list(tracks)
+    if len(tracks) == 0:
+        return []
+
+    # the lookups count towards whichever stage asked for them
+    @instrument.carry_stage
+    def lookup(track):
+        return fetch(lastfm, track)
+
+    # executor.map yields results in submission order, and re-raises
+    # the first lookup failure here just like the serial version would
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(tracks))) as executor:
+        return list(executor.map(lookup, tracks))
@@ -1,69 +1,214 @@
 import os
+import gzip
+import contextlib
 import json
+import itertools
+import textwrap
 
 from helpers.date import get_date
 from helpers.config import get_absolute_rolling_songs_dir
+from helpers.files import atomic_open
+from helpers.state import GZIP, PRETTY
 
-def truncate_utf8_chars(filename, count, ignore_newlines=True):
+# the log is an append-only changelog with one json object per line:
+# the first line holds the starting tracks, every line after it is a substitution event.
+# it lives next to where the old single-array LOG_FILENAME would be, e.g.
+# rolling-log.json -> rolling-log.jsonl
+def get_legacy_log_path(config):
+    return get_absolute_rolling_songs_dir() + config["DATA_DIR"] + config["LOG_FILENAME"]
+
+def get_log_path(config):
+    legacy = get_legacy_log_path(config)
+    if legacy.endswith(".json"):
+        return legacy + "l"
+    return legacy + ".jsonl"
+
+def write_lines_atomically(path, lines):
+    with atomic_open(path) as f:
+        for line in lines:
+            f.write(line + "\n")
+
+def encode_event(event):
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+
+def repair_torn_tail(path):
+    """
+    Drops a partially written last line left behind by a crash mid-append,
+    so the next append starts on a fresh line. Only looks at the end of the file.
+    """
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+
+        # walk back a chunk at a time to the last complete line
+        end = size
+        chunk = 4096
+        while end > 0:
+            start = max(0, end - chunk)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+def read_last_line(path):
     """
-    Yoinked from Stack Overflow. - MJ
+    Returns a file's last line (without its newline), or None if it's empty.
+    Only reads as much of the end of the file as that takes.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b""
+        while end > 0 and tail.rstrip(b"\n").find(b"\n") == -1:
+            start = max(0, end - 4096)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+    last = tail.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+    return last.decode("utf-8") if last else None
+
+def append_line(path, line):
+    # a single O_APPEND write of one whole line, then fsync, so each event either
+    # lands completely or (on a crash) leaves a torn tail that repair_torn_tail drops
+    repair_torn_tail(path)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    try:
+        os.write(fd, (line + "\n").encode("utf-8"))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
-    Truncates last `count` characters of a text file encoded in UTF-8.
-    :param filename: The path to the text file to read
-    :param count: Number of UTF-8 characters to remove from the end of the file
-    :param ignore_newlines: Set to true, if the newline character at the end of the file should be ignored
+def migrate_legacy_log(config):
     """
-    with open(filename, 'rb+') as f:
-        size = os.fstat(f.fileno()).st_size
-
-        offset = 1
-        chars = 0
-        while offset <= size:
-            f.seek(-offset, os.SEEK_END)
-            b = ord(f.read(1))
-
-            if ignore_newlines:
-                if b == 0x0D or b == 0x0A:
-                    offset += 1
-                    continue
-
-            if b & 0b10000000 == 0 or b & 0b11000000 == 0b11000000:
-                # This is the first byte of a UTF8 character
-                chars += 1
-                if chars == count:
-                    # When `count` number of characters have been found, move current position back
-                    # with one byte (to include the byte just checked) and truncate the file
-                    f.seek(-1, os.SEEK_CUR)
-                    f.truncate()
-                    return
-            offset += 1
-
-def append_to_log(config, removed, added):
-    # no appending needed if no tracks were removed
-    if len(removed) == 0:
+    Converts an old single-json-array log into the changelog format, if there
+    is one and it hasn't been converted yet. The old file is renamed to
+    {LOG_FILENAME}.migrated rather than deleted.
+    :return: True if a migration happened
+    """
+    legacy = get_legacy_log_path(config)
+    path = get_log_path(config)
+    if os.path.exists(path) or not os.path.exists(legacy):
         return False
 
-    # add diff to logfile
-    logfilename = get_absolute_rolling_songs_dir() + config["DATA_DIR"] + config["LOG_FILENAME"]
-    with open(logfilename, "a") as logfile:
-        # remove the trailing ] character first
-        truncate_utf8_chars(logfilename, 1)
-
-        changelog = {
-            "date": get_date(),
-            "in": [],
-            "out": []
-        }
-        for rtrack in removed:
-            changelog["out"].append(rtrack)
-        for atrack in added:
-            # playcounts are not necessary for new tracks in log
-            # this is what the updated data store is for
-            atrack.pop("playcount")
-            changelog["in"].append(atrack)
-        logfile.write(',\n' + json.dumps(changelog, indent=4))
-
-        # aaaaand now re-add the trailing ] to ensure valid json list
-        logfile.write('\n]')
-
-    return True
\ No newline at end of file
+    with open(legacy, "r", encoding="utf-8") as logfile:
+        events = json.load(logfile)
+    write_lines_atomically(path, [ encode_event(event) for event in events ])
+    os.replace(legacy, legacy + ".migrated")
+    return True
+
+# an old single-json-array log the next run hasn't converted yet. reading one
+# leaves it as it is, only the runs that append to the log migrate it
+def is_unmigrated(config):
+    return not os.path.exists(get_log_path(config)) and os.path.exists(get_legacy_log_path(config))
+
+def log_exists(config):
+    return os.path.exists(get_log_path(config)) or is_unmigrated(config)
+
+def create_log(config, tracklist):
+    """
+    Starts a new changelog holding the starting tracklist. Does nothing if one exists.
+    :return: True if the log was created
+    """
+    migrate_legacy_log(config)
+    if os.path.exists(get_log_path(config)):
+        return False
+
+    header = {
+        "date": get_date(),
+        "starting_tracks": tracklist
+    }
+    write_lines_atomically(get_log_path(config), [ encode_event(header) ])
+    return True
+
+def read_log(config):
+    """
+    Yields each event in the changelog in order, one line at a time.
+    A torn last line (crash mid-append) is skipped.
+    An unmigrated old log is read as it is, all at once.
+    """
+    if is_unmigrated(config):
+        with open(get_legacy_log_path(config), "r", encoding="utf-8") as logfile:
+            yield from json.load(logfile)
+        return
+
+    with open(get_log_path(config), "r", encoding="utf-8") as logfile:
+        for line in logfile:
+            if not line.endswith("\n"):
+                return
+            if line.strip() == "":
+                continue
+            yield json.loads(line)
+
+def make_changelog(removed, added, date=None):
+    changelog = {
+        "date": date or get_date(),
+        "in": [],
+        "out": []
+    }
+    for rtrack in removed:
+        changelog["out"].append(rtrack)
+    for atrack in added:
+        # playcounts are not necessary for new tracks in log
+        # this is what the updated data store is for
+        atrack.pop("playcount", None)
+        changelog["in"].append(atrack)
+    return changelog
+
+def append_event_once(config, event):
+    """
+    Appends an already made changelog event, unless it's the log's last line
+    already. A run resumed from its journal (see helpers/journal.py) may have
+    gotten as far as appending before it died, and mustn't log the change twice.
+    :return: True if the event was appended
+    """
+    migrate_legacy_log(config)
+    path = get_log_path(config)
+    line = encode_event(event)
+    repair_torn_tail(path)
+    if read_last_line(path) == line:
+        return False
+    append_line(path, line)
+    return True
+
+# text stream writing path atomically, gzipped if asked
+@contextlib.contextmanager
+def open_export(path, encoding):
+    if encoding == GZIP:
+        with atomic_open(path, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as outfile:
+            yield outfile
+    else:
+        with atomic_open(path) as outfile:
+            yield outfile
+
+def export_legacy_log(config, outfilename, extra_events=(), on_event=None, encoding=PRETTY):
+    """
+    Streams the changelog (plus any extra events) out in the old single
+    json array format, in one pass and one atomic write.
+    Only one event is held in memory at a time.
+    :param outfilename: Absolute path of the file to write
+    :param on_event: Optional callable given each event as it's written
+    :param encoding: One of helpers.state.ENCODINGS, pretty printed by default
+    :return: The number of events exported
+    """
+    count = 0
+    with open_export(outfilename, encoding) as outfile:
+        outfile.write("[")
+        for event in itertools.chain(read_log(config), extra_events):
+            if encoding == PRETTY:
+                # same bytes json.dump(events, outfile, indent=4) would produce
+                outfile.write(",\n" if count > 0 else "\n")
+                outfile.write(textwrap.indent(json.dumps(event, indent=4), "    "))
+            else:
+                outfile.write("," if count > 0 else "")
+                outfile.write(encode_event(event))
+            if on_event is not None:
+                on_event(event)
+            count += 1
+        outfile.write("\n]" if count > 0 and encoding == PRETTY else "]")
+    return count
@@ -0,0 +1,212 @@
+import json
+import os
+import contextlib
+import random
+import threading
+import time
+import uuid
+
+from helpers.config import get_absolute_rolling_songs_dir
+from helpers.date import get_date
+from helpers.files import atomic_write, locked
+from helpers.gmail import GmailSession, SMTP_HOST, SMTP_SSL_PORT
+
+# emails go through an on-disk outbox instead of being sent inline, so a run
+# only ever has to write a small file. outbox.py (or the daemon's sender
+# thread) sends them later over one smtp session, retrying with backoff.
+#
+# EMAIL_UPDATES in config.json picks what gets sent:
+#   "off" (default): nothing
+#   "each": one email per run that changed something
+#   "digest": one email a day with all of that day's changes, sent the next day
+OUTBOX_DIRNAME = "outbox/"
+FAILED_DIRNAME = "failed/"
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 60
+MAX_BACKOFF_SECONDS = 6 * 60 * 60
+
+def get_email_mode(config):
+    return config.get("EMAIL_UPDATES", "off")
+
+def get_outbox_dir(config):
+    return get_absolute_rolling_songs_dir() + config["DATA_DIR"] + OUTBOX_DIRNAME
+
+def enqueue(config, subject, content):
+    """
+    Spools an email to the configured receiver. Returns right away.
+    :return: True if something was spooled (email updates are on and there's content)
+    """
+    mode = get_email_mode(config)
+    if mode == "off" or content == "":
+        return False
+
+    outbox_dir = get_outbox_dir(config)
+    os.makedirs(outbox_dir, exist_ok=True)
+    message = {
+        "receiver": config["RECEIVER_EMAIL"],
+        "subject": subject,
+        "content": content,
+        "created": time.time(),
+        "attempts": 0,
+        "next_attempt": 0,
+    }
+    if mode == "digest":
+        message["digest"] = get_date()
+
+    # names sort in the order messages were queued
+    filename = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+    atomic_write(outbox_dir + filename, json.dumps(message))
+    return True
+
+def has_pending(config):
+    outbox_dir = get_outbox_dir(config)
+    return os.path.isdir(outbox_dir) and any(name.endswith(".json") for name in os.listdir(outbox_dir))
+
+def load_pending(outbox_dir):
+    pending = []
+    for name in sorted(os.listdir(outbox_dir)):
+        if not name.endswith(".json"):
+            continue
+        # sent by someone else since the listing
+        with contextlib.suppress(FileNotFoundError):
+            with open(outbox_dir + name, "r") as messagefile:
+                pending.append((outbox_dir + name, json.load(messagefile)))
+    return pending
+
+# yesterday's (and older) digest messages get merged into one email per day,
+# today's are left alone until the day is over
+def group_digests(pending, today):
+    batches = []
+    digests = {}
+    for path, message in pending:
+        digest = message.get("digest")
+        if digest is None:
+            batches.append(([path], message))
+        elif digest < today:
+            key = (digest, message["receiver"])
+            if key not in digests:
+                digests[key] = ([], dict(message, subject=f"your rolling playlist on {digest}", content=""))
+                batches.append(digests[key])
+            paths, merged = digests[key]
+            paths.append(path)
+            merged["content"] += message["content"]
+            merged["attempts"] = max(merged["attempts"], message["attempts"])
+            merged["next_attempt"] = max(merged["next_attempt"], message["next_attempt"])
+    return batches
+
+def backoff(attempts):
+    delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def make_session(config):
+    return GmailSession(
+        config["SENDER_EMAIL"], config["SENDER_PASSWORD"],
+        host=config.get("SMTP_HOST", SMTP_HOST),
+        port=int(config.get("SMTP_PORT", SMTP_SSL_PORT)),
+        use_ssl=config.get("SMTP_SSL", True),
+    )
+
+def flush_outbox(config, session=None, now=None):
+    """
+    Sends every message in the config's outbox that's due, over one smtp session.
+    Failed messages are rescheduled with exponential backoff, and moved to
+    outbox/failed/ after MAX_ATTEMPTS.
+    Every run starts an outbox.py and the daemon has a sender thread of its own,
+    so the outbox is locked while it's flushed, and each message only goes out once.
+    :param session: A GmailSession to reuse, one is opened (and closed) if not given
+    :return: (sent, failed) counts for this flush
+    """
+    outbox_dir = get_outbox_dir(config)
+    if not os.path.isdir(outbox_dir):
+        return 0, 0
+
+    with locked(outbox_dir):
+        return flush_locked(config, outbox_dir, session, now)
+
+def flush_locked(config, outbox_dir, session, now):
+    now = now if now is not None else time.time()
+    batches = [ batch for batch in group_digests(load_pending(outbox_dir), get_date())
+                if batch[1]["next_attempt"] <= now ]
+    if len(batches) == 0:
+        return 0, 0
+
+    own_session = session is None
+    if own_session:
+        session = make_session(config)
+
+    sent = 0
+    failed = 0
+    try:
+        for paths, message in batches:
+            try:
+                session.send(message["receiver"], message["subject"], message["content"])
+            except Exception:
+                failed += 1
+                reschedule(outbox_dir, paths, message, now)
+                # a dead session is reopened on the next send
+                session.close()
+                continue
+            sent += 1
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+    finally:
+        if own_session:
+            session.close()
+    return sent, failed
+
+def reschedule(outbox_dir, paths, message, now):
+    attempts = message["attempts"] + 1
+    if attempts >= MAX_ATTEMPTS:
+        os.makedirs(outbox_dir + FAILED_DIRNAME, exist_ok=True)
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.replace(path, outbox_dir + FAILED_DIRNAME + os.path.basename(path))
+        return
+
+    next_attempt = now + backoff(attempts)
+    for path in paths:
+        try:
+            with open(path, "r") as messagefile:
+                spooled = json.load(messagefile)
+        except FileNotFoundError:
+            continue
+        spooled["attempts"] = attempts
+        spooled["next_attempt"] = next_attempt
+        atomic_write(path, json.dumps(spooled))
+
+class OutboxSender(threading.Thread):
+    """
+    Background thread that flushes a set of outboxes every interval seconds,
+    keeping one smtp session per sender address open between flushes.
+    :param get_configs: Callable returning the configs whose outboxes to watch
+    """
+
+    def __init__(self, get_configs, interval=60):
+        super().__init__(daemon=True)
+        self.get_configs = get_configs
+        self.interval = interval
+        self.sessions = {}
+        self.stopped = threading.Event()
+
+    def flush_all(self):
+        for config in self.get_configs():
+            if get_email_mode(config) == "off":
+                continue
+            key = (config["SENDER_EMAIL"], config.get("SMTP_HOST", SMTP_HOST))
+            if key not in self.sessions:
+                self.sessions[key] = make_session(config)
+            try:
+                flush_outbox(config, self.sessions[key])
+            except Exception as e:
+                print(f"flushing outbox for {config['RECEIVER_EMAIL']} failed: {e}")
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.flush_all()
+            self.stopped.wait(self.interval)
+        for session in self.sessions.values():
+            session.close()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,35 @@
+import threading
+import time
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    :param rate: Tokens added per second (sustained requests per second)
+    :param capacity: Max tokens held at once (burst size), defaults to rate
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, tokens=1):
+        # block until enough tokens are available, then take them.
+        # sleeping happens outside the lock so other threads can refill/check too
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
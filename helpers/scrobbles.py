@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import threading
+
+from helpers.config import get_absolute_rolling_songs_dir
+from helpers.date import as_timestamp_array, count_in_windows
+from helpers.identity import resolve_tracks
+from helpers.lastfm import get_lookup_concurrency, get_scrobbles_for_tracks
+
+# the store lives in DATA_DIR under this name unless SCROBBLE_DB_FILENAME says otherwise.
+# set SCROBBLE_DB_FILENAME to "" to skip the store and ask last.fm about each track directly
+DEFAULT_SCROBBLE_DB_FILENAME = "scrobbles.sqlite3"
+
+# scrobbles stored per commit while syncing, a few of last.fm's pages
+SYNC_BATCH_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrobbles (
+    artist TEXT NOT NULL,
+    track TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (artist, track, timestamp)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# last.fm matches track.getScrobbles case-insensitively, so do the same locally
+def normalize_name(name):
+    return " ".join(name.split()).casefold()
+
+class ScrobbleStore:
+    """
+    Local SQLite copy of a user's scrobble history, synced incrementally
+    from last.fm's recent tracks and indexed by (artist, track, timestamp)
+    so playcounts in a time range are a single index range scan.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.synced = False
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row is not None else None
+
+    def get_synced_through(self):
+        return self.get_meta("synced_through")
+
+    def sync(self, lastfm):
+        """
+        Pulls every scrobble since the last finished sync (or the whole history
+        on the first run) and stores it, committing as it goes so a sync that dies
+        partway (say last.fm times out) carries on from there next time.
+        :param lastfm: The authenticated pylast user
+        :return: Number of scrobbles fetched
+        """
+        with self.lock:
+            fetched = 0
+            resuming = True
+            # a resumed sync only covers up to where the unfinished one started,
+            # so it's followed by a normal one for anything scrobbled since
+            while resuming:
+                resuming = self.get_meta("sync_cursor") is not None
+                fetched += self.sync_range(lastfm)
+            self.synced = True
+            return fetched
+
+    # recent tracks come back newest first, so an unfinished sync has stored everything
+    # from its cursor up to the newest scrobble it saw (sync_newest), and what's left is
+    # synced_through up to the cursor. the watermark only moves once that's all in
+    def sync_range(self, lastfm):
+        since = self.get_synced_through()
+        cursor = self.get_meta("sync_cursor")
+        newest = self.get_meta("sync_newest") or since or 0
+        fetched = 0
+        rows = []
+        # one past the cursor, so scrobbles sharing its second that didn't make
+        # it into the last batch aren't missed (the ones that did are ignored)
+        until = cursor + 1 if cursor is not None else None
+        for played in lastfm.get_recent_tracks(limit=None, time_from=since, time_to=until, stream=True):
+            timestamp = int(played.timestamp)
+            rows.append((normalize_name(played.track.artist.name), normalize_name(played.track.title), timestamp))
+            newest = max(newest, timestamp)
+            if len(rows) == SYNC_BATCH_SIZE:
+                with self.conn:
+                    self.conn.executemany("INSERT OR IGNORE INTO scrobbles VALUES (?, ?, ?)", rows)
+                    self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('sync_cursor', ?)", (str(min(row[2] for row in rows)),))
+                    self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('sync_newest', ?)", (str(newest),))
+                fetched += len(rows)
+                rows = []
+
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO scrobbles VALUES (?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('synced_through', ?)", (str(newest),))
+            self.conn.execute("DELETE FROM meta WHERE key IN ('sync_cursor', 'sync_newest')")
+        return fetched + len(rows)
+
+    def sync_once(self, lastfm):
+        if not self.synced:
+            self.sync(lastfm)
+
+    # the next sync_once syncs again, see expire_scrobble_sync
+    def expire(self):
+        self.synced = False
+
+    def count_plays(self, artist, track, start=None, end=None):
+        """
+        Counts scrobbles of a track with start <= timestamp < end.
+        :param start: Unix timestamp lower bound (inclusive), None for no bound
+        :param end: Unix timestamp upper bound (exclusive), None for no bound
+        """
+        query = "SELECT COUNT(*) FROM scrobbles WHERE artist = ? AND track = ?"
+        args = [normalize_name(artist), normalize_name(track)]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            args.append(int(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            args.append(int(end))
+        with self.lock:
+            return self.conn.execute(query, args).fetchone()[0]
+
+    def has_plays(self, artist, track):
+        query = "SELECT EXISTS (SELECT 1 FROM scrobbles WHERE artist = ? AND track = ?)"
+        with self.lock:
+            return bool(self.conn.execute(query, (normalize_name(artist), normalize_name(track))).fetchone()[0])
+
+    def get_timestamps(self, artist, track):
+        """
+        All of a track's scrobble times, sorted (see helpers.date.as_timestamp_array),
+        for counting plays in many windows without going back to the database.
+        """
+        query = "SELECT timestamp FROM scrobbles WHERE artist = ? AND track = ? ORDER BY timestamp"
+        with self.lock:
+            rows = self.conn.execute(query, (normalize_name(artist), normalize_name(track))).fetchall()
+        return as_timestamp_array((row[0] for row in rows), presorted=True)
+
+    def close(self):
+        self.conn.close()
+
+# one store per database file per process, so repeated lookups in a run only sync once
+stores = {}
+stores_lock = threading.Lock()
+
+def get_scrobble_db_path(config):
+    filename = config.get("SCROBBLE_DB_FILENAME", DEFAULT_SCROBBLE_DB_FILENAME)
+    if filename == "":
+        return None
+    return get_absolute_rolling_songs_dir() + config["DATA_DIR"] + filename
+
+def get_scrobble_store(config):
+    path = get_scrobble_db_path(config)
+    if path is None:
+        return None
+
+    with stores_lock:
+        if path not in stores:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            stores[path] = ScrobbleStore(path)
+        return stores[path]
+
+# processes that stay up for many runs (daemon.py, watch.py) keep their stores
+# open between them, so each run calls this first to have its first lookup
+# pull whatever was scrobbled since the last run's
+def expire_scrobble_sync(config):
+    path = get_scrobble_db_path(config)
+    with stores_lock:
+        store = stores.get(path)
+    if store is not None:
+        store.expire()
+
+# the store, synced, and the last.fm names of each track, or (None, None) with the store off
+def get_store_identities(config, lastfm, tracks):
+    store = get_scrobble_store(config)
+    if store is None:
+        return None, None
+    store.sync_once(lastfm)
+    return store, resolve_tracks(config, lastfm, tracks, has_plays=store.has_plays)
+
+# each track's scrobble times straight from last.fm, in no particular order
+def fetch_track_timestamps(config, lastfm, tracks):
+    identities = resolve_tracks(config, lastfm, tracks)
+    scrobbles = get_scrobbles_for_tracks(lastfm, [ { "artists": [ artist ], "name": title } for artist, title in identities ],
+                                         get_lookup_concurrency(config))
+    return [ [ int(s.timestamp) for s in scrobs ] for scrobs in scrobbles ]
+
+def get_track_timestamps(config, lastfm, tracks):
+    """
+    Gets the sorted scrobble times of each track, under the names last.fm knows it
+    by (see helpers.identity). Served from the local scrobble store when enabled,
+    otherwise straight from last.fm.
+    :return: List of timestamp arrays, in the same order as tracks
+    """
+    tracks = list(tracks)
+    if len(tracks) == 0:
+        return []
+
+    store, identities = get_store_identities(config, lastfm, tracks)
+    if store is not None:
+        return [ store.get_timestamps(artist, title) for artist, title in identities ]
+    return [ as_timestamp_array(timestamps) for timestamps in fetch_track_timestamps(config, lastfm, tracks) ]
+
+def get_window_playcounts(config, lastfm, tracks, windows):
+    """
+    Gets each track's playcount in each of many time windows, e.g. every month
+    of a year (see helpers.date.month_windows), with one lookup per track.
+    :param windows: List of (t0, t1) unix timestamp pairs, counting t0 <= played < t1.
+                    Either end can be None for no bound. Can also be a list holding
+                    a separate list of windows for each track
+    :return: One list of counts per track (in the same order as tracks), one count per window
+    """
+    tracks = list(tracks)
+    per_track = windows if len(windows) > 0 and isinstance(windows[0], list) else [ windows ] * len(tracks)
+    return [ count_in_windows(timestamps, track_windows)
+             for timestamps, track_windows in zip(get_track_timestamps(config, lastfm, tracks), per_track) ]
+
+def get_playcounts(config, lastfm, tracks, before=None):
+    """
+    Gets the playcount of each track, optionally only counting plays before a time.
+    One window per track needs no timestamps, the store counts it with an index range scan.
+    :param before: Unix timestamp, only plays strictly before this are counted.
+                   Can also be a list holding a separate cutoff for each track
+    :return: List of playcounts, in the same order as tracks
+    """
+    tracks = list(tracks)
+    if len(tracks) == 0:
+        return []
+
+    cutoffs = before if isinstance(before, list) else [ before ] * len(tracks)
+    store, identities = get_store_identities(config, lastfm, tracks)
+    if store is not None:
+        return [ store.count_plays(artist, title, end=cutoff) for (artist, title), cutoff in zip(identities, cutoffs) ]
+    return [ sum(1 for timestamp in timestamps if cutoff is None or timestamp < cutoff)
+             for timestamps, cutoff in zip(fetch_track_timestamps(config, lastfm, tracks), cutoffs) ]
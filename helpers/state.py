@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from helpers.files import atomic_write
+
+# how the json state files (current tracklist, playlist state, finalize output)
+# are written, set with the optional STATE_ENCODING field in config.json:
+#   "pretty" (default): indented json, easy to read and hand-edit
+#   "compact": json with no whitespace, a fraction of the size
+#   "gzip": compact json, gzipped, for big histories
+# reading doesn't care which one a file was written with, so switching is safe
+PRETTY = "pretty"
+COMPACT = "compact"
+GZIP = "gzip"
+ENCODINGS = (PRETTY, COMPACT, GZIP)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+def get_state_encoding(config):
+    encoding = config.get("STATE_ENCODING", PRETTY)
+    if encoding not in ENCODINGS:
+        print(f"ERROR: STATE_ENCODING must be one of {', '.join(ENCODINGS)}, not {encoding}")
+        exit(1)
+    return encoding
+
+def encode_state(data, encoding=PRETTY):
+    if encoding == PRETTY:
+        return json.dumps(data, indent=4).encode("utf-8")
+    compact = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if encoding == GZIP:
+        # mtime=0 so the same data always gzips to the same bytes, or the dirty check never matches
+        return gzip.compress(compact, mtime=0)
+    return compact
+
+def decode_state(raw):
+    if raw.startswith(GZIP_MAGIC):
+        raw = gzip.decompress(raw)
+    return json.loads(raw.decode("utf-8"))
+
+def read_state(path):
+    """
+    Reads a state file written in any of the ENCODINGS (or by hand).
+    :param path: Absolute path of the file, which must exist
+    """
+    with open(path, "rb") as statefile:
+        raw = statefile.read()
+    remember(path, raw)
+    return decode_state(raw)
+
+# digest of what's on disk at each path as of our last read or write,
+# keyed on the file's size and mtime so an outside edit is never missed
+digests = {}
+digests_lock = threading.Lock()
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def remember(path, raw):
+    with digests_lock:
+        digests[path] = (file_signature(path), hashlib.sha256(raw).digest())
+
+def on_disk_digest(path):
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    with digests_lock:
+        known = digests.get(path)
+    if known is not None and known[0] == signature:
+        return known[1]
+    with open(path, "rb") as statefile:
+        return hashlib.sha256(statefile.read()).digest()
+
+def write_state(path, data, encoding=PRETTY):
+    """
+    Writes data to path as json (see ENCODINGS) through a temp file and a rename,
+    skipping the write entirely if the file already holds exactly those bytes.
+    :return: True if the file was written, False if it was already up to date
+    """
+    raw = encode_state(data, encoding)
+    if on_disk_digest(path) == hashlib.sha256(raw).digest():
+        return False
+    atomic_write(path, raw)
+    remember(path, raw)
+    return True
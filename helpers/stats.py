@@ -0,0 +1,190 @@
+import datetime
+from collections import defaultdict
+
+from helpers.date import day_start_timestamp, month_windows
+from helpers.diff import get_track_id
+from helpers.timeline import month_bounds, parse_date, season_bounds, season_of
+
+# how many tracks each precomputed ranking keeps
+TOP_COUNT = 10
+
+def month_key(year, month):
+    return f"{year:04d}-{month:02d}"
+
+def season_key(year, season):
+    return f"{year:04d}-{season}"
+
+# "YYYY-season" keys sort by when the season starts, not alphabetically
+def season_start(key):
+    year, season = key.split("-", 1)
+    return season_bounds(int(year), season)[0]
+
+# splits the days of a stay [start, end) up by calendar month
+def days_by_month(start, end):
+    year, month = start.year, start.month
+    while True:
+        month_start, month_end = month_bounds(year, month)
+        if month_start >= end:
+            return
+        overlap = (min(month_end, end) - max(month_start, start)).days
+        if overlap > 0:
+            yield year, month, overlap
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+class StatsAccumulator:
+    """
+    Builds year-end stats from the log one event at a time, so they can be
+    computed in the same pass that writes the finalized log out.
+    Memory grows with the number of distinct tracks, months and stays.
+
+    The log only has a playcount per stay on the playlist (the "out" playcount).
+    Given a way to count scrobbles in time windows, month and season play rankings
+    count each month of each stay exactly; without one they spread each stay's plays
+    evenly over its days.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.open_stays = {}
+        self.stays = []
+        self.tracks = {}
+        self.totals = defaultdict(lambda: { "plays": 0, "days": 0, "stays": 0 })
+        self.month_days = defaultdict(lambda: defaultdict(float))
+        self.month_plays = defaultdict(lambda: defaultdict(float))
+        self.season_days = defaultdict(lambda: defaultdict(float))
+        self.season_plays = defaultdict(lambda: defaultdict(float))
+
+    def add(self, event):
+        date = parse_date(event["date"])
+        if self.start is None:
+            self.start = date
+        self.end = max(self.end or date, date)
+
+        if "starting_tracks" in event:
+            for track in event["starting_tracks"]:
+                self.open_stay(track, date)
+            return
+
+        for track in event.get("out", []):
+            self.close_stay(track, date)
+        for track in event.get("in", []):
+            self.open_stay(track, date)
+
+    def open_stay(self, track, date):
+        track_id = get_track_id(track)
+        self.tracks[track_id] = track
+        self.open_stays[track_id] = date
+
+    def close_stay(self, track, date):
+        track_id = get_track_id(track)
+        # a track going out that never came in is from a log written before tracks
+        # back for another stay were logged coming in. its days are lost, but its
+        # plays still count, as a stay that started the day it ended
+        start = self.open_stays.pop(track_id, date)
+        self.tracks.setdefault(track_id, track)
+
+        days = (date - start).days
+        plays = track.get("playcount") or 0
+        totals = self.totals[track_id]
+        totals["plays"] += plays
+        totals["days"] += days
+        totals["stays"] += 1
+
+        self.stays.append((track_id, start, date, plays))
+        for year, month, overlap in days_by_month(start, date):
+            self.month_days[month_key(year, month)][track_id] += overlap
+            self.season_days[season_key(*season_of(year, month))][track_id] += overlap
+
+    def add_plays(self, track_id, year, month, plays):
+        self.month_plays[month_key(year, month)][track_id] += plays
+        self.season_plays[season_key(*season_of(year, month))][track_id] += plays
+
+    # estimates each month's plays by spreading each stay's plays evenly over its days
+    def spread_plays(self):
+        for track_id, start, end, plays in self.stays:
+            days = (end - start).days
+            if days == 0:
+                # in and out the same day, all of it belongs to that month
+                self.add_plays(track_id, start.year, start.month, plays)
+                continue
+            for year, month, overlap in days_by_month(start, end):
+                self.add_plays(track_id, year, month, plays * overlap / days)
+
+    # counts each month's plays exactly, from the scrobbles in each month of each stay.
+    # every stay of a track goes in one window_plays lookup
+    def count_plays(self, window_plays, tz):
+        years = {}
+        windows = defaultdict(list)
+        months = defaultdict(list)
+        for track_id, start, end, plays in self.stays:
+            if plays == 0:
+                continue
+            if start == end:
+                # only a stay logged going out without coming in, there's no window to count in
+                self.add_plays(track_id, start.year, start.month, plays)
+                continue
+            stay_start, stay_end = day_start_timestamp(start, tz), day_start_timestamp(end, tz)
+            for year, month, _ in days_by_month(start, end):
+                if year not in years:
+                    years[year] = month_windows(year, tz)
+                month_start, month_end = years[year][month - 1]
+                windows[track_id].append((max(month_start, stay_start), min(month_end, stay_end)))
+                months[track_id].append((year, month))
+
+        track_ids = list(windows)
+        counts = window_plays([ self.tracks[track_id] for track_id in track_ids ], [ windows[track_id] for track_id in track_ids ])
+        for track_id, track_counts in zip(track_ids, counts):
+            for (year, month), plays in zip(months[track_id], track_counts):
+                self.add_plays(track_id, year, month, plays)
+
+    def ranked(self, values, count):
+        ranked = sorted(values.items(), key=lambda item: (-item[1], self.tracks[item[0]]["name"]))
+        return [ dict(self.describe(track_id), value=round(value, 1)) for track_id, value in ranked[:count] ]
+
+    def describe(self, track_id):
+        track = self.tracks[track_id]
+        return {
+            "name": track["name"],
+            "artists": track["artists"],
+            "album": track["album"],
+            "uri": track.get("uri"),
+        }
+
+    def rankings(self, days, plays, count, order=None):
+        return {
+            key: {
+                "by_days": self.ranked(days.get(key, {}), count),
+                "by_plays": self.ranked(plays.get(key, {}), count),
+            }
+            for key in sorted(set(days) | set(plays), key=order)
+        }
+
+    def finish(self, as_of=None, count=TOP_COUNT, window_plays=None, tz=None):
+        """
+        Closes any stays still open (as of the last event, or as_of) and
+        returns the stats as a json-ready dict.
+        :param window_plays: Counts scrobbles in time windows, called as window_plays(tracks, windows)
+                             with one list of (t0, t1) windows per track, like helpers.scrobbles.get_window_playcounts.
+                             None spreads each stay's plays evenly over its months instead
+        :param tz: The timezone months start in for window_plays, None for the machine's local timezone
+        """
+        as_of = parse_date(as_of) if as_of is not None else self.end
+        for track_id in list(self.open_stays):
+            self.close_stay(self.tracks[track_id], as_of)
+        if window_plays is not None:
+            self.count_plays(window_plays, tz)
+        else:
+            self.spread_plays()
+
+        tracks = [ dict(self.describe(track_id), **totals) for track_id, totals in self.totals.items() ]
+        return {
+            "generated": datetime.date.today().isoformat(),
+            "start": self.start.isoformat() if self.start else None,
+            "end": as_of.isoformat() if as_of else None,
+            "top_by_plays": sorted(tracks, key=lambda t: (-t["plays"], t["name"]))[:count],
+            "top_by_tenure": sorted(tracks, key=lambda t: (-t["days"], t["name"]))[:count],
+            "months": self.rankings(self.month_days, self.month_plays, count),
+            "seasons": self.rankings(self.season_days, self.season_plays, count, order=season_start),
+            "tracks": sorted(tracks, key=lambda t: (-t["plays"], -t["days"], t["name"])),
+        }
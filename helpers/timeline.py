@@ -0,0 +1,443 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+from helpers.date import DATE_FORMAT
+from helpers.diff import get_track_id
+from helpers.log import get_log_path, is_unmigrated, read_log
+from helpers.state import read_state
+
+# how many substitution events between saved playlist states. a contents_on
+# query replays at most this many events on top of the nearest checkpoint
+CHECKPOINT_INTERVAL = 16
+
+# the index of the log kept next to it, e.g. rolling-log.jsonl.timeline.sqlite3.
+# it remembers how far into the log it has read, so each query only indexes
+# the events appended since the last one. deleting it is always safe
+INDEX_SUFFIX = ".timeline.sqlite3"
+
+# bump when the schema or what's stored changes, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    track TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS intervals (
+    id INTEGER PRIMARY KEY,
+    track_id TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT,
+    playcount INTEGER
+);
+CREATE INDEX IF NOT EXISTS intervals_by_track ON intervals (track_id);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_by_date ON changes (date);
+CREATE TABLE IF NOT EXISTS moves (
+    seq INTEGER NOT NULL,
+    incoming INTEGER NOT NULL,
+    track_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS moves_by_seq ON moves (seq, incoming);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    n INTEGER PRIMARY KEY,
+    state TEXT NOT NULL
+);
+"""
+
+def parse_date(date):
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.datetime.strptime(date, DATE_FORMAT).date()
+
+def month_bounds(year, month):
+    start = datetime.date(year, month, 1)
+    if month == 12:
+        return start, datetime.date(year + 1, 1, 1)
+    return start, datetime.date(year, month + 1, 1)
+
+# meteorological seasons. december counts towards the next year's winter
+# so each winter stays in one piece
+SEASONS = [ ("winter", 12), ("spring", 3), ("summer", 6), ("fall", 9) ]
+
+def season_bounds(year, season):
+    month = dict(SEASONS)[season]
+    start_year = year - 1 if season == "winter" else year
+    start = datetime.date(start_year, month, 1)
+    end_month = month + 3
+    end = datetime.date(start_year + (end_month - 1) // 12, (end_month - 1) % 12 + 1, 1)
+    return start, end
+
+def season_of(year, month):
+    if month == 12:
+        return year + 1, "winter"
+    for season, first_month in reversed(SEASONS):
+        if month >= first_month:
+            return year, season
+    return year, "winter"
+
+def first_date(line):
+    return json.loads(line)["date"]
+
+# intervals are stored with iso dates, which parse a lot faster than DATE_FORMAT
+def make_interval(start, end, playcount):
+    return [ datetime.date.fromisoformat(start), datetime.date.fromisoformat(end) if end else None, playcount ]
+
+class Timeline:
+    """
+    Queryable history of the rolling playlist, built from the log's events
+    (the starting tracks followed by in/out substitutions) into SQLite.
+    Keeps a per-track list of [start, end, playcount] intervals on the playlist
+    and a snapshot of the playlist every CHECKPOINT_INTERVAL events, so a query
+    reads a checkpoint and the few events after it rather than the whole history.
+    from_log keeps the index on disk next to the log and extends it as the log grows,
+    Timeline(events) builds one in memory.
+    Queries taking an as_of (the end date for stays still running) default
+    to today while the log is live, and to its last day once it's finalized
+    (every track taken off, as finalize.py does).
+    """
+
+    def __init__(self, events, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.connect(":memory:", checkpoint_interval)
+        events = iter(events)
+        self.begin()
+        self.start_from(next(events, None))
+        self.extend(sorted(events, key=lambda change: parse_date(change["date"])))
+        self.commit()
+
+    @classmethod
+    def from_log(cls, config):
+        # an old log that hasn't been converted yet gets no index, it's read into memory
+        if is_unmigrated(config):
+            return cls(read_log(config))
+        return cls.from_path(get_log_path(config))
+
+    @classmethod
+    def from_path(cls, log_path, index_path=None, checkpoint_interval=CHECKPOINT_INTERVAL):
+        """
+        Opens the on-disk index of a changelog (see helpers/log.py),
+        first indexing whatever has been appended to the log since it was last opened.
+        :param index_path: Defaults to the log's path plus INDEX_SUFFIX
+        """
+        timeline = cls.__new__(cls)
+        timeline.connect(index_path or log_path + INDEX_SUFFIX, checkpoint_interval)
+        timeline.begin()
+        try:
+            timeline.catch_up(log_path)
+        except BaseException:
+            timeline.conn.rollback()
+            raise
+        timeline.commit()
+        return timeline
+
+    # finalized logs (and old style logs) are a single json list
+    @classmethod
+    def from_file(cls, filename):
+        return cls(read_state(filename))
+
+    def connect(self, path, checkpoint_interval):
+        self.checkpoint_interval = checkpoint_interval
+        # transactions are begun by hand, so a query that's catching up on
+        # the log holds the index until it's done
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def begin(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self.conn.execute("COMMIT")
+        self.load()
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_meta(self, **values):
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              [ (key, json.dumps(value)) for key, value in values.items() ])
+
+    def load(self):
+        self.start = parse_date(self.get_meta("start"))
+        self.end = parse_date(self.get_meta("end"))
+        self.count = self.get_meta("count")
+        self.state = set(self.get_meta("state"))
+        self.live = len(self.state) > 0
+
+    # indexes the log's lines past the offset it was last read to, or the whole log
+    # again if it isn't the same log any more (a new first line, or shorter than
+    # that offset) or an event was appended out of date order
+    def catch_up(self, log_path):
+        with open(log_path, "rb") as logfile:
+            first = logfile.readline()
+            if not first.endswith(b"\n"):
+                raise ValueError("the log is empty, it needs at least its starting tracks")
+            digest = hashlib.sha256(first).hexdigest()
+            size = logfile.seek(0, os.SEEK_END)
+
+            offset = self.get_meta("offset")
+            same = (self.get_meta("version") == INDEX_VERSION and self.get_meta("header") == digest and
+                    self.get_meta("checkpoint_interval") == self.checkpoint_interval and
+                    offset is not None and offset <= size)
+            if not same:
+                offset = len(first)
+            logfile.seek(offset)
+
+            events = []
+            for line in logfile:
+                # a torn last line (crash mid-append) is left for next time
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    events.append(json.loads(line))
+
+        dates = [ parse_date(event["date"]) for event in events ]
+        in_order = all(a <= b for a, b in zip([ parse_date(self.get_meta("end") or first_date(first)) ] + dates, dates))
+        if same and in_order:
+            self.extend(events)
+        else:
+            if same:
+                events = list(self.read_all(log_path))
+            self.start_from(json.loads(first))
+            self.extend(sorted(events, key=lambda change: parse_date(change["date"])))
+        self.set_meta(version=INDEX_VERSION, header=digest, offset=offset,
+                      checkpoint_interval=self.checkpoint_interval)
+
+    @staticmethod
+    def read_all(log_path):
+        with open(log_path, "rb") as logfile:
+            logfile.readline()
+            for line in logfile:
+                if not line.endswith(b"\n"):
+                    return
+                if line.strip():
+                    yield json.loads(line)
+
+    # clears the index and starts it over from the log's first line
+    def start_from(self, header):
+        if header is None or "starting_tracks" not in header:
+            raise ValueError("the log is empty, it needs at least its starting tracks")
+        for table in ("meta", "tracks", "intervals", "changes", "moves", "checkpoints"):
+            self.conn.execute(f"DELETE FROM {table}")
+
+        start = parse_date(header["date"])
+        state = set()
+        for track in header["starting_tracks"]:
+            self.add_track(state, track, start)
+        # checkpoint c is the playlist after the first c * checkpoint_interval changes
+        self.conn.execute("INSERT INTO checkpoints VALUES (0, ?)", (json.dumps(sorted(state)),))
+        self.set_meta(start=start.isoformat(), end=start.isoformat(), count=0, state=sorted(state))
+
+    # records changes that come after every change indexed so far
+    def extend(self, changes):
+        count = self.get_meta("count")
+        end = self.get_meta("end")
+        state = set(self.get_meta("state"))
+        for change in changes:
+            date = parse_date(change["date"])
+            ins, outs = self.apply_change(state, change, date, record=True)
+            self.conn.execute("INSERT INTO changes VALUES (?, ?)", (count, date.isoformat()))
+            self.conn.executemany("INSERT INTO moves VALUES (?, ?, ?)",
+                                  [ (count, 0, track_id) for track_id in outs ] + [ (count, 1, track_id) for track_id in ins ])
+            count += 1
+            end = date.isoformat()
+            if count % self.checkpoint_interval == 0:
+                self.conn.execute("INSERT INTO checkpoints VALUES (?, ?)", (count, json.dumps(sorted(state))))
+        self.set_meta(end=end, count=count, state=sorted(state))
+
+    def get_as_of(self, as_of=None):
+        if as_of is not None:
+            return parse_date(as_of)
+        return datetime.date.today() if self.live else self.end
+
+    def add_track(self, state, track, date):
+        track_id = get_track_id(track)
+        self.conn.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?)",
+                          (track_id, track["name"].casefold(), json.dumps(track)))
+        self.conn.execute("INSERT INTO intervals (track_id, start) VALUES (?, ?)", (track_id, date.isoformat()))
+        state.add(track_id)
+
+    def close_interval(self, track, date):
+        track_id = get_track_id(track)
+        # close the oldest interval that's still open
+        row = self.conn.execute("SELECT id FROM intervals WHERE track_id = ? AND end IS NULL ORDER BY id LIMIT 1",
+                                (track_id,)).fetchone()
+        if row is not None:
+            self.conn.execute("UPDATE intervals SET end = ?, playcount = ? WHERE id = ?",
+                              (date.isoformat(), track.get("playcount"), row[0]))
+            return
+
+        # logs from before tracks back for another stay were logged
+        # coming in only have them going out. the days are lost,
+        # but the stay and its plays are still counted
+        self.conn.execute("INSERT OR IGNORE INTO tracks VALUES (?, ?, ?)",
+                          (track_id, track["name"].casefold(), json.dumps(track)))
+        self.conn.execute("INSERT INTO intervals (track_id, start, end, playcount) VALUES (?, ?, ?, ?)",
+                          (track_id, date.isoformat(), date.isoformat(), track.get("playcount")))
+
+    # applies a change to state, recording the intervals it opens and closes if asked.
+    # returns the ids that came in and went out
+    def apply_change(self, state, change, date, record=False):
+        outs = []
+        for track in change.get("out", []):
+            track_id = get_track_id(track)
+            outs.append(track_id)
+            state.discard(track_id)
+            if record:
+                self.close_interval(track, date)
+        ins = []
+        for track in change.get("in", []):
+            ins.append(get_track_id(track))
+            if record:
+                self.add_track(state, track, date)
+            else:
+                state.add(ins[-1])
+        return ins, outs
+
+    # how many changes are dated before date (or on it, if inclusive)
+    def changes_before(self, date, inclusive=False):
+        comparison = ">" if inclusive else ">="
+        row = self.conn.execute(f"SELECT seq FROM changes WHERE date {comparison} ? ORDER BY date, seq LIMIT 1",
+                                (date.isoformat(),)).fetchone()
+        return row[0] if row is not None else self.count
+
+    # (incoming, track id) for each track in or out in changes [first, last), in order
+    def get_moves(self, first, last):
+        return self.conn.execute("SELECT incoming, track_id FROM moves WHERE seq >= ? AND seq < ? ORDER BY seq, incoming",
+                                 (first, last)).fetchall()
+
+    # state of the playlist after the first n changes have been applied
+    def state_after(self, n):
+        checkpoint, state = self.conn.execute("SELECT n, state FROM checkpoints WHERE n <= ? ORDER BY n DESC LIMIT 1",
+                                              (n,)).fetchone()
+        state = set(json.loads(state))
+        for incoming, track_id in self.get_moves(checkpoint, n):
+            if incoming:
+                state.add(track_id)
+            else:
+                state.discard(track_id)
+        return state
+
+    # rows of a query ending in "IN ({})" over many ids, a chunk at a time
+    # to stay under sqlite's limit on query parameters
+    def select_in(self, query, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            yield from self.conn.execute(query.format(", ".join("?" * len(chunk))), chunk)
+
+    def get_tracks(self, track_ids):
+        return { track_id: json.loads(track)
+                 for track_id, track in self.select_in("SELECT id, track FROM tracks WHERE id IN ({})", track_ids) }
+
+    def find_tracks(self, name):
+        """
+        The tracks ever on the playlist whose name contains the given text, ignoring case.
+        """
+        rows = self.conn.execute("SELECT track FROM tracks WHERE instr(name, ?) > 0 ORDER BY name", (name.casefold(),))
+        return [ json.loads(track) for track, in rows ]
+
+    def contents_on(self, date):
+        """
+        Returns the tracks on the playlist at the end of the given day.
+        :param date: A datetime.date or "YYYY-MM-DD" string
+        """
+        date = parse_date(date)
+        if date < self.start:
+            return []
+        state = self.state_after(self.changes_before(date, inclusive=True))
+        return list(self.get_tracks(state).values())
+
+    def find_intervals(self, track):
+        return self.get_intervals(get_track_id(track))
+
+    def get_intervals(self, track_id):
+        rows = self.conn.execute("SELECT start, end, playcount FROM intervals WHERE track_id = ? ORDER BY id", (track_id,))
+        return [ make_interval(start, end, playcount) for start, end, playcount in rows ]
+
+    def tenure(self, track, as_of=None):
+        """
+        Total days a track has spent on the playlist.
+        :param as_of: End date for a still-running stay, see get_as_of
+        """
+        as_of = self.get_as_of(as_of)
+        return sum(((end or as_of) - start).days for start, end, _ in self.find_intervals(track))
+
+    def days_on_list(self, start, end, as_of=None):
+        """
+        Days each track spent on the playlist within [start, end).
+        Only looks at the tracks present at start and the changes inside the window.
+        :return: dict of track id -> days, leaving out tracks with no days in the window
+        """
+        start = parse_date(start)
+        end = parse_date(end)
+        as_of = self.get_as_of(as_of)
+
+        first = self.changes_before(start)
+        last = self.changes_before(end)
+        candidates = self.state_after(first)
+        candidates.update(track_id for incoming, track_id in self.get_moves(first, last) if incoming)
+
+        days = {}
+        intervals = self.select_in("SELECT track_id, start, end, playcount FROM intervals WHERE track_id IN ({})", candidates)
+        for track_id, *interval in intervals:
+            interval_start, interval_end, _ = make_interval(*interval)
+            overlap = (min(interval_end or as_of, end) - max(interval_start, start)).days
+            if overlap > 0:
+                days[track_id] = days.get(track_id, 0) + overlap
+        return days
+
+    def top_tracks_by_days(self, start, end, count=10, as_of=None):
+        """
+        The tracks that spent the most days on the playlist within [start, end).
+        :return: list of (track, days), longest first
+        """
+        days = self.days_on_list(start, end, as_of)
+        tracks = self.get_tracks(days)
+        ranked = sorted(days.items(), key=lambda item: (-item[1], tracks[item[0]]["name"]))
+        return [ (tracks[track_id], track_days) for track_id, track_days in ranked[:count] ]
+
+    def months(self, as_of=None):
+        as_of = self.get_as_of(as_of)
+        year, month = self.start.year, self.start.month
+        while (year, month) <= (as_of.year, as_of.month):
+            yield year, month
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    def monthly_top_tracks(self, count=10, as_of=None):
+        """
+        :return: dict of "YYYY-MM" -> top_tracks_by_days for that month
+        """
+        top = {}
+        for year, month in self.months(as_of):
+            start, end = month_bounds(year, month)
+            top[f"{year:04d}-{month:02d}"] = self.top_tracks_by_days(start, end, count, as_of)
+        return top
+
+    def seasonal_top_tracks(self, count=10, as_of=None):
+        """
+        :return: dict of "YYYY-season" -> top_tracks_by_days for that season
+        """
+        top = {}
+        for year, month in self.months(as_of):
+            season_year, season = season_of(year, month)
+            key = f"{season_year:04d}-{season}"
+            if key not in top:
+                start, end = season_bounds(season_year, season)
+                top[key] = self.top_tracks_by_days(start, end, count, as_of)
+        return top
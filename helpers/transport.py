@@ -0,0 +1,320 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from helpers import instrument
+from helpers.ratelimit import TokenBucket
+
+# every http request this program makes, spotify's (requests, under spotipy) and
+# last.fm's (httpx, under pylast), goes through one Transport per process, which
+#   - keeps connections alive and pooled, shared across users in daemon.py
+#   - caps the requests in flight to any one host at once, and the requests sent
+#     per second to hosts that ask for it (last.fm), retries and every page included
+#   - retries 429/503 after the server's Retry-After, and other 5xx and dropped
+#     connections with jittered exponential backoff. requests that change
+#     something (adding to a playlist) are only resent when they can't have gone
+#     through: the connection was never made, or the server answered 429/503
+#   - lets identical read requests that are in flight at the same time share one response
+# and counts all of that, see Transport.snapshot and the --profile report
+DEFAULT_MAX_PER_HOST = 8
+MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 60
+
+# a Retry-After longer than this isn't waited out, the response goes back to the caller
+MAX_RETRY_AFTER_SECONDS = 300
+
+RETRY_STATUSES = { 429, 500, 502, 503, 504 }
+RETRY_AFTER_STATUSES = { 429, 503 }
+
+# http methods that are safe to send twice
+IDEMPOTENT_METHODS = { "GET", "HEAD", "OPTIONS", "PUT", "DELETE" }
+
+def backoff(attempt):
+    delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+def parse_retry_after(value):
+    """
+    Seconds to wait according to a Retry-After header, which is either
+    a number of seconds or an http date. None if missing or unreadable.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+class Transport:
+    """
+    Retry, backoff, per-host limits and request coalescing around any http client.
+    Clients plug in with a function making one attempt at a request, see
+    get_requests_session and install_httpx.
+    :param max_per_host: Max requests in flight to one host at once
+    :param max_retries: Retries per request before the last response (or error) is handed back
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, max_retries=MAX_RETRIES, sleep=time.sleep):
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.buckets = {}
+        self.in_flight = {}
+        self.metrics = {
+            "requests": 0,
+            "attempts": 0,
+            "retries": 0,
+            "retry_wait": 0.0,
+            "queue_wait": 0.0,
+            "coalesced": 0,
+        }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.metrics[key] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.metrics)
+
+    def get_limit(self, host):
+        with self.lock:
+            if host not in self.limits:
+                self.limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.limits[host]
+
+    def throttle(self, host, rate):
+        """
+        Caps the requests sent to a host per second, across every client and user
+        in the process. The strictest rate asked for wins.
+        :param rate: Requests per second
+        """
+        with self.lock:
+            if host not in self.buckets or rate < self.buckets[host].rate:
+                self.buckets[host] = TokenBucket(rate)
+
+    def request(self, host, key, attempt, connection_errors=(), idempotent=True):
+        """
+        Makes a request, retrying as needed.
+        :param host: Host the request goes to, for the per-host limit
+        :param key: Hashable identity of the request if it's safe to share its
+                    response with an identical request already in flight, else None
+        :param attempt: Callable making one attempt and returning a response with
+                        status_code, headers and (already read) content
+        :param connection_errors: Exception types worth retrying. For a request that
+                                  isn't idempotent, only ones raised before it was sent
+        :param idempotent: False if sending the request twice could do something twice.
+                           Then only 429s and 503s are retried, which say nothing was done
+        :return: The first response that isn't worth retrying, or the last one
+        """
+        self.count("requests")
+        statuses = RETRY_STATUSES if idempotent else RETRY_AFTER_STATUSES
+        if key is None:
+            return self.send(host, attempt, connection_errors, statuses)
+
+        with self.lock:
+            shared = self.in_flight.get(key)
+            leader = shared is None
+            if leader:
+                shared = self.in_flight[key] = InFlight()
+
+        if not leader:
+            shared.done.wait()
+            self.count("coalesced")
+            instrument.record_transport(coalesced=1)
+            if shared.error is not None:
+                raise shared.error
+            return shared.response
+
+        try:
+            shared.response = self.send(host, attempt, connection_errors, statuses)
+            return shared.response
+        except BaseException as e:
+            shared.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            shared.done.set()
+
+    def send(self, host, attempt, connection_errors, statuses=RETRY_STATUSES):
+        limit = self.get_limit(host)
+        for tries in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            with self.lock:
+                bucket = self.buckets.get(host)
+            if bucket is not None:
+                bucket.acquire()
+            with limit:
+                waited = time.perf_counter() - queued
+                self.count("queue_wait", waited)
+                self.count("attempts")
+                instrument.record_transport(queue_wait=waited)
+                try:
+                    response = attempt()
+                except connection_errors:
+                    if tries == self.max_retries:
+                        raise
+                    response = None
+
+            if response is not None:
+                instrument.record_http(len(response.content or b""), response.status_code)
+                if response.status_code not in statuses or tries == self.max_retries:
+                    return response
+
+            delay = None
+            if response is not None and response.status_code in RETRY_AFTER_STATUSES:
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                if delay is not None and delay > MAX_RETRY_AFTER_SECONDS:
+                    return response
+            if delay is None:
+                delay = backoff(tries)
+            else:
+                # a little jitter so everyone told to come back in 5s doesn't all at once
+                delay += random.uniform(0, min(1.0, delay * 0.1))
+
+            self.count("retries")
+            self.count("retry_wait", delay)
+            instrument.record_transport(retries=1, retry_wait=delay)
+            self.sleep(delay)
+
+# one transport (and so one set of pools and limits) per process
+transport = None
+transport_lock = threading.Lock()
+
+def get_transport():
+    global transport
+    with transport_lock:
+        if transport is None:
+            transport = Transport()
+        return transport
+
+session = None
+
+def get_requests_session():
+    """
+    The process-wide requests.Session for spotipy (both the api client and its
+    oauth manager), sending through the shared Transport over pooled connections.
+    spotipy puts auth headers on each request rather than the session, so one
+    session is safe to share between users.
+    """
+    global session
+    with transport_lock:
+        if session is not None:
+            return session
+
+    pooled = make_requests_session(get_transport())
+    with transport_lock:
+        if session is None:
+            session = pooled
+        return session
+
+def make_requests_session(shared):
+    """
+    A requests.Session sending through the given Transport, see get_requests_session.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class PooledSession(requests.Session):
+        def send(self, request, **kwargs):
+            key = None
+            if request.method == "GET" and not kwargs.get("stream"):
+                key = ("GET", request.url, request.headers.get("Authorization"))
+
+            # a read timeout or dropped connection on, say, adding tracks to a
+            # playlist may come after spotify already added them
+            idempotent = request.method in IDEMPOTENT_METHODS
+            errors = (requests.ConnectionError, requests.Timeout) if idempotent else (requests.ConnectTimeout,)
+            return shared.request(urlsplit(request.url).netloc, key,
+                                  lambda: requests.Session.send(self, request, **kwargs),
+                                  errors, idempotent)
+
+    pooled = PooledSession()
+    # retries are the Transport's job, the adapter just pools connections
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=shared.max_per_host, max_retries=0)
+    pooled.mount("http://", adapter)
+    pooled.mount("https://", adapter)
+    return pooled
+
+# the last.fm methods this program calls that only read, and so can be coalesced
+# and retried freely. pylast POSTs everything, and the rest (logging in) aren't
+LASTFM_READ_METHODS = {
+    "user.getRecentTracks",
+    "user.getTrackScrobbles",
+    "track.getInfo",
+    "track.getCorrection",
+    "artist.getCorrection",
+    "track.search",
+}
+
+def get_lastfm_method(request):
+    from urllib.parse import parse_qs
+    body = request.content.decode("utf-8", errors="replace") if request.content else ""
+    params = parse_qs(body) or parse_qs(request.url.query.decode("utf-8", errors="replace"))
+    return (params.get("method") or [""])[0]
+
+def is_lastfm_read(request):
+    return get_lastfm_method(request) in LASTFM_READ_METHODS
+
+# the httpx module pylast sends with: httpx, or its fork httpx2 from pylast 7 on
+def get_pylast_httpx():
+    try:
+        import pylast
+    except ImportError:
+        return None
+    return getattr(pylast, "httpx", None)
+
+def install_httpx():
+    """
+    Routes pylast through the shared Transport. pylast opens a new httpx.Client
+    (and connection) for every request, so httpx.Client.send is patched to hand
+    the request to one long-lived, pooled client instead.
+    Clients set up with proxies are left alone.
+    """
+    httpx = get_pylast_httpx()
+    if httpx is None:
+        return
+
+    send = httpx.Client.send
+    if getattr(send, "pooled", False):
+        return
+
+    shared = get_transport()
+    pool = httpx.Client(limits=httpx.Limits(max_connections=shared.max_per_host * 4,
+                                            max_keepalive_connections=shared.max_per_host))
+
+    def pooled_send(self, request, *args, **kwargs):
+        if getattr(self, "_mounts", None):
+            return send(self, request, *args, **kwargs)
+
+        def attempt():
+            response = send(pool, request, *args, **kwargs)
+            response.read()
+            return response
+
+        key = None
+        errors = (httpx.ConnectError, httpx.ConnectTimeout)
+        read = is_lastfm_read(request)
+        if read:
+            key = (request.method, str(request.url), request.content)
+            errors = (httpx.TransportError,)
+        return shared.request(request.url.host, key, attempt, errors, idempotent=read)
+
+    pooled_send.pooled = True
+    httpx.Client.send = pooled_send
@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+
+# sends whatever is waiting in the email outbox (see helpers/outbox.py).
+# rolling.py starts this in the background after a run that queued an email,
+# so the run itself never waits on smtp. can also be cron-jobbed on its own:
+#   python3 outbox.py [config files...]    (defaults to config/config.json)
+
+import sys
+
+from helpers.config import read_config
+from helpers.outbox import flush_outbox
+
+def main(config_paths):
+    for path in config_paths or [None]:
+        config = read_config(path)
+        sent, failed = flush_outbox(config)
+        if failed > 0:
+            print(f"{failed} email(s) failed to send and will be retried later")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,20 +2,26 @@
 # run "which python3" in your terminal and
 # replace "/usr/bin/python3" above with the output
 
-import sys
 import os
-import json
+import sys
+import copy
+import subprocess
+import argparse
+import contextlib
 from pathlib import Path
 
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-
-from helpers.cache import ConfigCacheHandler
-from helpers.date import get_date, is_ts_before_yesterday
+from helpers.diff import diff_tracklists
+from helpers.state import COMPACT, get_state_encoding, read_state, write_state
+from helpers.date import get_date, get_timezone, get_yesterday_timestamp, parse_spotify_timestamp
 from helpers.config import read_config, get_absolute_rolling_songs_dir
-from helpers.gmail import send_gmail
+from helpers.outbox import enqueue, has_pending
+from helpers import instrument
+from helpers.instrument import stage
 from helpers.lastfm import get_lastfm_network
-from helpers.log import append_to_log
+from helpers.journal import finish_journal, is_done, load_journal, mark_done, start_journal
+from helpers.log import append_event_once, create_log, log_exists, make_changelog
+from helpers.scrobbles import expire_scrobble_sync, get_playcounts
+from helpers.transport import get_requests_session
 
 # debug flag
 debug = False
@@ -31,47 +37,92 @@ def create_data_dir_if_dne(config):
     if not os.path.exists(data_dir_path):
         os.makedirs(data_dir_path)
 
-def authenticate_services(config):
-    oauth = SpotifyOAuth(client_id=config["SPOTIFY_CLIENT_ID"], client_secret=config["SPOTIFY_CLIENT_SECRET"], redirect_uri=config["SPOTIFY_REDIRECT_URI"], cache_handler=ConfigCacheHandler())
-    spotify = spotipy.Spotify(oauth_manager=oauth)
-
+# spotipy (and requests under it) are imported here rather than up top,
+# so commands that never talk to spotify don't pay to load them
+def authenticate_spotify(config, config_path=None):
+    import spotipy
+    from spotipy.oauth2 import SpotifyOAuth
+    from helpers.cache import ConfigCacheHandler
+
+    # everything goes through the shared session, which pools connections and
+    # handles rate limits and retries for spotify (see helpers/transport.py)
+    session = get_requests_session()
+    oauth = SpotifyOAuth(client_id=config["SPOTIFY_CLIENT_ID"], client_secret=config["SPOTIFY_CLIENT_SECRET"], redirect_uri=config["SPOTIFY_REDIRECT_URI"], cache_handler=ConfigCacheHandler(config_path), requests_session=session)
+    return spotipy.Spotify(oauth_manager=oauth, requests_session=session)
+
+# logging in to last.fm is a network call, so this is held off
+# until we know the rolling playlist actually changed
+def authenticate_lastfm(config):
     network = get_lastfm_network(config)
-    
-    return spotify, network.get_authenticated_user()
+    return network.get_authenticated_user()
+
+# only the fields fetch_full_tracklist reads, so spotify doesn't send us whole track objects
+TRACKLIST_FIELDS = "items(added_at,track(name,uri,artists(name),album(name))),next"
+PLAYLIST_METADATA_FIELDS = "id,uri,name,snapshot_id,owner(id)"
+PLAYLIST_STATE_FILENAME = "playlist-state.json"
+SPOTIFY_ADD_LIMIT = 100
 
-# given a playlist, returns the full tracklist as a dict of uri->{name artists album}
+# given a playlist, returns the full tracklist as a dict of uri->{name artists album},
+# plus added_at, the time the track was added, for playlists spotify knows that for
 def fetch_full_tracklist(spotify, playlist):
     tracklist = {}
-    results = spotify.playlist(playlist['id'], fields="tracks,next")
-    spotify_tracks = results['tracks']
+    spotify_tracks = spotify.playlist_items(playlist['id'], fields=TRACKLIST_FIELDS, additional_types=("track",))
     while spotify_tracks:
-        # not quite sure why the for loop is needed here
         for item in spotify_tracks['items']:
             spotify_track = item['track']
+
+            # local files and removed tracks come back without a track object
+            if spotify_track is None:
+                continue
+
             tracklist[spotify_track['uri']] = {
                 "name": spotify_track['name'],
                 "artists": [ artist['name'] for artist in spotify_track['artists'] ],
                 "album": spotify_track['album']['name'],
                 "uri": spotify_track['uri'],
             }
+            if item.get('added_at'):
+                tracklist[spotify_track['uri']]["added_at"] = item['added_at']
             
         spotify_tracks = spotify.next(spotify_tracks)
         
     return tracklist
 
-# returns list of { "name": trackname, "artists": [artists], "album": album }
-# containing each song in the spotify playlist provided
-# also returns the tracklist from the log playlist and its playlist id
-def get_rolling_tracklist(config, spotify):
+# the playlist state file remembers the resolved ids of the rolling and log
+# playlists and the snapshot_id of the rolling playlist as of the last full run
+def load_playlist_state(config):
+    state_filename = get_absolute_rolling_songs_dir() + config["DATA_DIR"] + PLAYLIST_STATE_FILENAME
+    if not file_exists(state_filename):
+        return {}
+
+    return read_state(state_filename)
+
+def write_playlist_state(config, state):
+    write_state(get_absolute_rolling_songs_dir() + config["DATA_DIR"] + PLAYLIST_STATE_FILENAME,
+                state, get_state_encoding(config))
+
+def playlist_state_entry(playlist):
+    return {
+        "name": playlist['name'],
+        "id": playlist['id'],
+        "uri": playlist['uri'],
+        "snapshot_id": playlist['snapshot_id'],
+    }
+
+# pages through the user's playlists looking for the rolling and log playlists.
+# returns a dict of "rolling"/"log" -> state entry for the ones that were found
+def find_playlists(config, spotify):
     spotify_username = config["SPOTIFY_USERNAME"]
-    playlists = {"items":["sentinel"]}
-    tracklist = {}
-    log_tracklist = {}
-    log_playlist_id = ""
-    rolling_found = False
+    wanted = { "rolling": config["SPOTIFY_PLAYLIST"] }
+    if config["SPOTIFY_LOG_PLAYLIST"] != "":
+        wanted["log"] = config["SPOTIFY_LOG_PLAYLIST"]
+
+    found = {}
     offset = 0
-    while len(playlists['items']) > 0:
+    while len(found) < len(wanted):
         playlists = spotify.user_playlists(spotify_username, limit=50, offset=offset)
+        if len(playlists['items']) == 0:
+            break
         offset += 50
         for playlist in playlists['items']:
 
@@ -80,30 +131,100 @@ def get_rolling_tracklist(config, spotify):
             if playlist['owner']['id'] != spotify_username:
                 continue
 
-            # only want to request the playlists once, so need to check
-            # for the log playlist and the rolling playlist here and remember
-            # the log playlist id
-            if playlist['name'] == config["SPOTIFY_LOG_PLAYLIST"]:
-                log_playlist_id = playlist['uri']
-                log_tracklist = fetch_full_tracklist(spotify, playlist)
-                
-                # break if we've found both now
-                if rolling_found:
-                    return tracklist, log_tracklist, log_playlist_id
-
-            if playlist['name'] == config["SPOTIFY_PLAYLIST"]:
-                # actually get the songs
-                tracklist = fetch_full_tracklist(spotify, playlist)
-            
-                # break if we've found both now
-                if log_playlist_id != "":
-                    return tracklist, log_tracklist, log_playlist_id
-            
-                # now as soon as we find the rolling playlist, we can break
-                rolling_found = True
+            for role, name in wanted.items():
+                if playlist['name'] == name and role not in found:
+                    found[role] = playlist_state_entry(playlist)
+
+    return found
+
+# fetches the current metadata of a playlist we've resolved before, or None
+# if it's gone or has been renamed away from what the config asks for
+def get_known_playlist(spotify, entry, name):
+    import spotipy
+    if entry is None or entry['name'] != name:
+        return None
+    try:
+        playlist = spotify.playlist(entry['id'], fields=PLAYLIST_METADATA_FIELDS)
+    except spotipy.SpotifyException:
+        return None
+    if playlist['name'] != name:
+        return None
+    return playlist_state_entry(playlist)
+
+# the log playlist only ever grows, so rather than downloading all of it every
+# run we keep its set of uris in DATA_DIR, tagged with the snapshot_id it matches
+LOG_MIRROR_FILENAME = "log-playlist-uris.json"
+URI_FIELDS = "items(track(uri)),next"
+
+def get_log_mirror_filename(config):
+    return get_absolute_rolling_songs_dir() + config["DATA_DIR"] + LOG_MIRROR_FILENAME
+
+def write_log_mirror(config, playlist_uri, snapshot_id, uris):
+    create_data_dir_if_dne(config)
+    mirror = {
+        "playlist": playlist_uri,
+        "snapshot_id": snapshot_id,
+        "uris": sorted(uris),
+    }
+    write_state(get_log_mirror_filename(config), mirror, COMPACT)
+
+def fetch_playlist_uris(spotify, playlist):
+    uris = set()
+    spotify_tracks = spotify.playlist_items(playlist['id'], fields=URI_FIELDS, additional_types=("track",))
+    while spotify_tracks:
+        for item in spotify_tracks['items']:
+            if item['track'] is not None:
+                uris.add(item['track']['uri'])
+        spotify_tracks = spotify.next(spotify_tracks)
+    return uris
+
+# returns the set of uris on the log playlist, from the local mirror if it's
+# still at the playlist's current snapshot, otherwise rebuilt from spotify
+def load_log_uris(config, spotify, log):
+    mirror_filename = get_log_mirror_filename(config)
+    if file_exists(mirror_filename):
+        mirror = read_state(mirror_filename)
+        if mirror["playlist"] == log['uri'] and mirror["snapshot_id"] == log['snapshot_id']:
+            return set(mirror["uris"])
+
+    debug_print("log playlist changed outside this program, re-fetching its tracks")
+    uris = fetch_playlist_uris(spotify, log)
+    write_log_mirror(config, log['uri'], log['snapshot_id'], uris)
+    return uris
 
-    print("rolling playlist not found")
-    exit(1)
+# returns list of { "name": trackname, "artists": [artists], "album": album }
+# containing each song in the spotify playlist provided
+# also returns the set of uris on the log playlist and its playlist id.
+# returns None if the rolling playlist's snapshot_id matches the one in
+# playlist_state, i.e. nothing has changed since the last full run.
+# playlist_state is updated in place, the caller writes it once the run succeeds
+def get_rolling_tracklist(config, spotify, playlist_state):
+    # one cheap metadata request for the common case where nothing changed
+    rolling = get_known_playlist(spotify, playlist_state.get("rolling"), config["SPOTIFY_PLAYLIST"])
+    if rolling is not None and rolling['snapshot_id'] == playlist_state["rolling"].get("snapshot_id"):
+        return None
+
+    # otherwise re-resolve whatever we don't have a valid id for
+    log = get_known_playlist(spotify, playlist_state.get("log"), config["SPOTIFY_LOG_PLAYLIST"])
+    if rolling is None or (log is None and config["SPOTIFY_LOG_PLAYLIST"] != ""):
+        found = find_playlists(config, spotify)
+        rolling = rolling or found.get("rolling")
+        log = log or found.get("log")
+
+    if rolling is None:
+        print("rolling playlist not found")
+        exit(1)
+
+    tracklist = fetch_full_tracklist(spotify, rolling)
+    log_uris = set()
+    log_playlist_id = ""
+    if log is not None:
+        log_uris = load_log_uris(config, spotify, log)
+        log_playlist_id = log['uri']
+        playlist_state["log"] = log
+    playlist_state["rolling"] = rolling
+
+    return tracklist, log_uris, log_playlist_id
 
 def file_exists(filename):
     return Path(filename).exists()
@@ -115,152 +236,247 @@ def load_previous_tracklist(config):
         debug_print("first time running this program, previous tracklist not stored yet")
         return {}
 
-    with open(tracklist_filename, "r") as trackfile:
-        return json.load(trackfile)
+    return read_state(tracklist_filename)
 
-def are_tracks_same(new, old):
-    # new have "name", "artists", and "album" fields
-    # old have "name", "artists", "album", and "playcount" fields
-    if new["name"] != old["name"]:
-        return False
-    if new["artists"] != old["artists"]:
-        return False
-    if new["album"] != old["album"]:
-        return False
-
-    return True
-
-# linear, who cares. returns track or None if not found
-def get_corresponding_track(tracklist, track):
-    for corresponding_track in tracklist:
-        if are_tracks_same(corresponding_track, track):
-            return corresponding_track
-    return None
-
-# adds the tracks passed to the log playlist on the users' spotify account
-def add_tracks_to_log_playlist(config, spotify, log_playlist_id, new_tracks):
-    if len(new_tracks) == 0:
+# adds the tracks passed to the log playlist on the users' spotify account,
+# in batches of up to 100 (the most spotify takes per request), then adds
+# them to the local mirror of the log playlist's uris as well
+def add_tracks_to_log_playlist(config, spotify, log_playlist_id, new_tracks, log_uris):
+    if len(new_tracks) == 0 or log_playlist_id == "":
         return
     
     track_uris = [ track['uri'] for track in new_tracks ]
-    spotify.user_playlist_add_tracks(config["SPOTIFY_USERNAME"], playlist_id=log_playlist_id, tracks=track_uris)
-
-# for each new track, get number of plays at present and store.
-# for each track which was removed from tracklist, get number of plays
-# at present and deduct plays when added to get plays since added.
-# returns updated tracklist, removed tracks as a pair
-def update_tracklist(new_tracklist, tracklist, lastfm):
-    # separate new tracks and kept tracks
-    news = []
-    kept = []
-    for new_track in new_tracklist.values():
-        existing_track = get_corresponding_track(tracklist, new_track)
-        if existing_track is None:
-            news.append(new_track)
-        else:
-            kept.append(existing_track)
-
-    # now repeat in reverse to find removed tracks
-    removed = []
-    for existing_track in tracklist:
-        if get_corresponding_track(new_tracklist.values(), existing_track) is None:
-            # this track must have been removed since we last checked
-            removed.append(existing_track)
+    for i in range(0, len(track_uris), SPOTIFY_ADD_LIMIT):
+        result = spotify.user_playlist_add_tracks(config["SPOTIFY_USERNAME"], playlist_id=log_playlist_id, tracks=track_uris[i:i + SPOTIFY_ADD_LIMIT])
+
+    # the last add's snapshot_id is the playlist as it stands now
+    log_uris.update(track_uris)
+    write_log_mirror(config, log_playlist_id, result['snapshot_id'], log_uris)
+
+# works out which tracks are new, kept and removed, everything a run needs
+# besides playcounts. new tracks only count plays from before they were added,
+# tracks without an added_at fall back to before this time yesterday (plays on
+# day the track was added count towards pc). the cutoffs are worked out here so
+# a resumed run uses the same ones
+def diff_tracklist(config, new_tracklist, tracklist):
+    news, kept, removed = diff_tracklists(new_tracklist.values(), tracklist)
+    yesterday = get_yesterday_timestamp(get_timezone(config))
+    return {
+        "news": news,
+        "kept": kept,
+        "removed": removed,
+        "added_at": [ parse_spotify_timestamp(track["added_at"]) if "added_at" in track else yesterday for track in news ],
+    }
+
+# for each new track, get number of plays at present (before it was added).
+# for each track which was removed from tracklist, get number of plays at present
+def lookup_playcounts(config, lastfm, changes):
+    return {
+        "removed": get_playcounts(config, lastfm, changes["removed"]),
+        "news": get_playcounts(config, lastfm, changes["news"], before=changes["added_at"]),
+    }
+
+# removed tracks get the plays since they were added (present plays minus the
+# plays when added), new tracks get their plays so far.
+# returns updated tracklist, removed tracks, new tracks and a message for the user
+def update_tracklist(changes, playcounts):
+    changes = copy.deepcopy(changes)
+    kept, removed, news = changes["kept"], changes["removed"], changes["news"]
 
     # prepare simple log message to email user
     message = ""
 
     # go through olds, update playcounts and timestamp out
-    for track in removed:
-        scrobs = lastfm.get_track_scrobbles(track["artists"][0], track["name"])
-        track["playcount"] = len(scrobs) - track["playcount"]
+    for track, playcount in zip(removed, playcounts["removed"]):
+        track["playcount"] = playcount - track["playcount"]
         message += "[-] " + track["name"] + " by " + str(track["artists"]) + ", " + str(track["playcount"]) + " plays since added\n"
 
     # go through news, set playcounts and timestamp in, and append to kept
-    for track in news:
-        scrobs = lastfm.get_track_scrobbles(track["artists"][0], track["name"])
-
-        # only track plays before yesterday (plays on day the track was added count towards pc)
-        track["playcount"] = len([s for s in scrobs if is_ts_before_yesterday(int(s.timestamp)) ])
+    for track, playcount in zip(news, playcounts["news"]):
+        track["playcount"] = playcount
         kept.append(track)
         message += "[+] " + track["name"] + " by " + str(track["artists"]) + '\n'
 
     # kept is now the updated current tracklist
     return kept, removed, news, message
 
-# if poss_dupes entry (list of uris) exists in dic, 
+# if poss_dupes entry's uri exists in uris,
 # do not add to the final list 
-def prune_duplicates(poss_dupes, dic):
+def prune_duplicates(poss_dupes, uris):
     out = []
     for elt in poss_dupes:
-        if elt['uri'] not in dic.keys():
+        if elt['uri'] not in uris:
             out.append(elt)
             
     return out
     
 # if it does not already exist, create logfile
 def create_logfile(config, tracklist):
-    logfilename = get_absolute_rolling_songs_dir() + config["DATA_DIR"] + config["LOG_FILENAME"]
-    if file_exists(logfilename):
+    if log_exists(config):
         return
 
-    # create logfile and store current 25 tracks in it
-    with open(logfilename, "w") as logfile:
-        # playcount is redundant in logfile
-        for track in tracklist:
-            track.pop("playcount")
-
-        # init must be a list so changelog can be appended to it later
-        init = [{
-            "date": get_date(),
-            "starting_tracks": tracklist
-        }]
+    # playcount is redundant in logfile
+    for track in tracklist:
+        track.pop("playcount")
 
-        logfile.write(json.dumps(init, indent=4))
+    # create logfile and store current 25 tracks in it
+    create_log(config, tracklist)
 
+# skipped if the file already holds this exact tracklist
 def write_tracklist_file(config, tracklist):
-    with open(get_absolute_rolling_songs_dir() + config["DATA_DIR"] + config["STORAGE_FILENAME"], "w") as tfile:
-        json.dump(tracklist, tfile, indent=4)
+    write_state(get_absolute_rolling_songs_dir() + config["DATA_DIR"] + config["STORAGE_FILENAME"],
+                tracklist, get_state_encoding(config))
     
+# queues the email rather than sending it, see helpers/outbox.py
 def debug_print_and_email_message(config, subject, content):
     if content != "":
-        send_gmail(config["SENDER_EMAIL"], config["SENDER_PASSWORD"], config["RECEIVER_EMAIL"], subject, content)
+        enqueue(config, subject, content)
         debug_print(content)
 
-def main():
-    config = read_config()
-    spotify, lastfm = authenticate_services(config)
-
-    # get current tracks and compare to previously stored tracks
-    tracklist, log_tracklist, log_playlist_id = get_rolling_tracklist(config, spotify)
+# sends anything in the outbox from a separate, detached process
+# so this run can exit without waiting on smtp
+def start_outbox_sender(config_path=None):
+    command = [ sys.executable, get_absolute_rolling_songs_dir() + "outbox.py" ]
+    if config_path is not None:
+        command.append(config_path)
+    subprocess.Popen(command, start_new_session=True, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# used when nothing else is sharing the services with this run
+def no_limit(service):
+    return contextlib.nullcontext()
+
+def run(config, spotify, get_lastfm, limit=no_limit):
+    """
+    Checks the rolling playlist once and records whatever changed.
+    :param config: The user's parsed config
+    :param spotify: An authenticated spotipy.Spotify
+    :param get_lastfm: Callable returning the authenticated pylast user,
+                       only called if the playlist actually changed
+    :param limit: Callable taking "spotify" or "lastfm" and returning a context
+                  manager held around that service's calls (the daemon's concurrency caps)
+    :return: True if the playlist had changed and the run went all the way through
+    """
+    # playcounts come from scrobbles as of this run, not the last one in this process
+    expire_scrobble_sync(config)
+
+    # finish whatever a previous run that died partway through left undone first,
+    # so the changes it found aren't lost or fetched all over again
+    journal = load_journal(config)
+    if journal is not None:
+        debug_print("finishing an interrupted run from its journal")
+        with stage("resume_journal"):
+            finish_run(config, spotify, get_lastfm, journal, limit)
+
+    # get current tracks and compare to previously stored tracks,
+    # stopping right here if the rolling playlist hasn't changed since last time
+    playlist_state = load_playlist_state(config)
+    with limit("spotify"), stage("get_rolling_tracklist"):
+        rolling = get_rolling_tracklist(config, spotify, playlist_state)
+    if rolling is None:
+        debug_print("rolling playlist unchanged since last run")
+        return False
+    tracklist, log_uris, log_playlist_id = rolling
 
-    # read previous tracklist from storage file
+    # read previous tracklist from storage file, and save what changed before
+    # looking anything up, so a run that dies from here on doesn't fetch it again
     previous_tracklist = load_previous_tracklist(config)
+    journal = start_journal(
+        config,
+        playlist_state=playlist_state,
+        log_playlist_id=log_playlist_id,
+        changes=diff_tracklist(config, tracklist, previous_tracklist),
+        date=get_date(),
+    )
+    finish_run(config, spotify, get_lastfm, journal, limit, log_uris)
+    return True
 
-    # get diff and update playcounts for new and removed songs
-    tracklist, removed, added, message = update_tracklist(tracklist, previous_tracklist, lastfm)
-
-    # if a song makes it on the rolling playlist more than once, do not add it after the first time
-    # in other words, do not add songs to the log playlist that are already on it
-    added = prune_duplicates(added, log_tracklist)
-
-    # update the spotify log playlist with the songs that were added
-    add_tracks_to_log_playlist(config, spotify, log_playlist_id, added)
-    
-    # write the tracklist file to be checked next time,
-    # creating the data dir if it does not yet exist
-    create_data_dir_if_dne(config)
-    write_tracklist_file(config, tracklist)
-
-    # ...and update logfile, creating it if dne
-    create_logfile(config, tracklist)
-    append_to_log(config, removed, added)
+# the rest of a run, once the changes are known. each step is checked off in the
+# journal as it completes, and is safe to redo if the run dies before that
+def finish_run(config, spotify, get_lastfm, journal, limit=no_limit, log_uris=None):
+    # update playcounts for new and removed songs, saving them as soon as
+    # they're all in so a run that dies after this doesn't look them up again
+    if not is_done(journal, "playcounts"):
+        with limit("lastfm"):
+            with stage("authenticate_lastfm"):
+                lastfm = get_lastfm()
+            with stage("update_tracklist"):
+                playcounts = lookup_playcounts(config, lastfm, journal["changes"])
+        mark_done(config, journal, "playcounts", playcounts=playcounts)
+    tracklist, removed, added, message = update_tracklist(journal["changes"], journal["playcounts"])
+
+    # the log event is made under the day the changes were found, so a resumed run
+    # logs it under the day it happened. every new track goes in it, including ones
+    # back for another stay, or that stay's days and plays are lost when it leaves.
+    # on the first run there's nothing to compare to, the log starts out with the tracklist
+    first_run = len(journal["changes"]["kept"]) == 0 and len(removed) == 0
+    event = None
+    if not first_run and (len(removed) > 0 or len(added) > 0):
+        event = make_changelog(copy.deepcopy(removed), copy.deepcopy(added), journal["date"])
+
+    # update the spotify log playlist with the songs that were added.
+    # if a song makes it on the rolling playlist more than once, do not add it after
+    # the first time. in other words, do not add songs to the log playlist that are
+    # already on it (say, from an earlier stay, or an add that went through right
+    # before a crash), so this can't add a song twice
+    if not is_done(journal, "log_playlist"):
+        with limit("spotify"), stage("add_tracks_to_log_playlist"):
+            log_playlist_id = journal["log_playlist_id"]
+            if log_uris is None:
+                log_playlist_id, log_uris = get_current_log_uris(config, spotify, journal["playlist_state"])
+            add_tracks_to_log_playlist(config, spotify, log_playlist_id, prune_duplicates(added, log_uris), log_uris)
+        mark_done(config, journal, "log_playlist")
+
+    with stage("write_files"):
+        # write the tracklist file to be checked next time,
+        # creating the data dir if it does not yet exist
+        if not is_done(journal, "tracklist"):
+            create_data_dir_if_dne(config)
+            write_tracklist_file(config, tracklist)
+            mark_done(config, journal, "tracklist")
+
+        # ...and update logfile, creating it if dne
+        if not is_done(journal, "log"):
+            create_logfile(config, copy.deepcopy(tracklist))
+            if event is not None:
+                append_event_once(config, event)
+            mark_done(config, journal, "log")
+
+        # only remember the snapshot once everything above went through,
+        # so a failed run gets redone next time instead of skipped
+        if not is_done(journal, "playlist_state"):
+            write_playlist_state(config, journal["playlist_state"])
+            mark_done(config, journal, "playlist_state")
+
+    # finally, log the message and queue it up to email to the user
+    # (emails are off unless EMAIL_UPDATES is set, see helpers/outbox.py)
+    if not is_done(journal, "email"):
+        debug_print_and_email_message(config, "your rolling playlist was updated!", message)
+        mark_done(config, journal, "email")
+    finish_journal(config)
+
+# the log playlist's id and its current set of uris, for a resumed run
+# that doesn't have them from fetching the rolling playlist
+def get_current_log_uris(config, spotify, playlist_state):
+    log = get_known_playlist(spotify, playlist_state.get("log"), config["SPOTIFY_LOG_PLAYLIST"])
+    if log is None:
+        return "", set()
+    return log['uri'], load_log_uris(config, spotify, log)
 
-    # finally, log the message and email it to the user (disabled 10/5/22 mjj)
-    # debug_print_and_email_message(config, "your rolling playlist was updated!", message)
+def main():
+    config = read_config()
+    with stage("authenticate_spotify"):
+        spotify = authenticate_spotify(config)
+    run(config, spotify, lambda: authenticate_lastfm(config))
+    if has_pending(config):
+        start_outbox_sender()
     
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="check the rolling playlist and record any changes")
+    instrument.add_profile_arguments(parser)
+    args, rest = parser.parse_known_args()
+
     # debug printing on for any invocation with more than the required args
-    if len(sys.argv) > 1:
+    if len(rest) > 0:
         debug = True
-    main()
+    instrument.run_profiled(main, args.profile, args.cprofile)
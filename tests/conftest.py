@@ -0,0 +1,98 @@
+# fixtures for running the real rolling.run/finalize code against the fake
+# spotify and last.fm in benchmarks/fake_services.py, one throwaway DATA_DIR per test.
+# run with: python3 -m pytest tests/
+
+import os
+import sys
+import time
+from os.path import dirname, abspath
+
+import pytest
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_services import FakeServer, World, make_spotify_track, redirect_lastfm
+
+@pytest.fixture
+def world():
+    return World()
+
+@pytest.fixture
+def server(world):
+    with FakeServer(world) as server:
+        undo = redirect_lastfm(server.url)
+        try:
+            yield server
+        finally:
+            undo()
+
+class User:
+    """
+    One user of the fake services, with a rolling playlist, an empty log
+    playlist and the config, spotify and last.fm clients rolling.run takes.
+    """
+
+    def __init__(self, world, server, data_dir, tracks):
+        import spotipy
+        from helpers.transport import get_requests_session
+
+        self.world = world
+        self.config = {
+            "SPOTIFY_USERNAME": "spotify-user",
+            "SPOTIFY_PLAYLIST": "rolling",
+            "SPOTIFY_LOG_PLAYLIST": "rolling log",
+            "SPOTIFY_CLIENT_ID": "fake",
+            "SPOTIFY_CLIENT_SECRET": "fake",
+            "SPOTIFY_REDIRECT_URI": "http://localhost:8888/callback",
+            "LASTFM_USERNAME": "lastfm-user",
+            "LASTFM_PASSWORD": "fake",
+            "LASTFM_API_KEY": "fake",
+            "LASTFM_SECRET": "fake",
+            "LASTFM_REQUESTS_PER_SECOND": 1000,
+            "DATA_DIR": os.path.relpath(data_dir, ROOT) + "/",
+            "STORAGE_FILENAME": "current-tracklist.json",
+            "LOG_FILENAME": "rolling-log.json",
+            "SENDER_EMAIL": "sender@example.com",
+            "SENDER_PASSWORD": "fake",
+            "RECEIVER_EMAIL": "user@example.com",
+        }
+        world.add_playlist("spotify-user", "rolling", "rolling", tracks)
+        world.add_playlist("spotify-user", "log", "rolling log", [])
+        self.spotify = spotipy.Spotify(auth="fake-token", requests_session=get_requests_session())
+        self.spotify.prefix = server.url + "/v1/"
+        self.lastfm = None
+
+    def get_lastfm(self):
+        from helpers.lastfm import get_lastfm_network
+        if self.lastfm is None:
+            network = get_lastfm_network(self.config)
+            network.disable_rate_limit()
+            self.lastfm = network.get_authenticated_user()
+        return self.lastfm
+
+    def set_tracks(self, tracks):
+        self.world.set_tracks("rolling", tracks)
+
+    def scrobble(self, track, timestamp=None):
+        self.world.add_scrobbles("lastfm-user", [(
+            track["artists"][0]["name"], track["name"], track["album"]["name"],
+            int(timestamp if timestamp is not None else time.time()),
+        )])
+
+    def log_playlist_uris(self):
+        return [ track["uri"] for track in self.world.playlists["log"]["tracks"] ]
+
+    def data_path(self, filename):
+        return os.path.join(ROOT, self.config["DATA_DIR"], filename)
+
+@pytest.fixture
+def make_user(world, server, tmp_path):
+    def make(tracks):
+        return User(world, server, tmp_path, tracks)
+    return make
+
+@pytest.fixture
+def tracks():
+    return [ make_spotify_track(i) for i in range(10) ]
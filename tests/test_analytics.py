@@ -0,0 +1,30 @@
+import json
+
+from helpers import analytics
+from helpers.state import GZIP, write_state
+
+TRACK = { "name": "Song 0", "artists": [ "Artist 0" ], "album": "Album 0", "uri": "spotify:track:0" }
+
+def finalized_log(year):
+    return [
+        { "date": f"{year}-01-01", "starting_tracks": [ TRACK ] },
+        { "date": f"{year}-12-31", "in": [], "out": [ dict(TRACK, playcount=3) ] },
+    ]
+
+def test_folders_are_searched_by_contents(tmp_path):
+    write_state(str(tmp_path / "2022-final"), finalized_log(2022))
+    write_state(str(tmp_path / "2023.json.gz"), finalized_log(2023), GZIP)
+    (tmp_path / "notes.json").write_text("not json {")
+    (tmp_path / "rolling-log.jsonl").write_text(json.dumps({ "date": "2024-01-01", "starting_tracks": [] }) + "\n")
+
+    logs = analytics.find_logs([ str(tmp_path) ])
+    assert sorted(logs) == [ str(tmp_path / "2022-final"), str(tmp_path / "2023.json.gz") ]
+
+def test_unreadable_logs_are_skipped(tmp_path):
+    write_state(str(tmp_path / "2022.json"), finalized_log(2022))
+    (tmp_path / "notes.json").write_text("[ not json")
+
+    summaries, _ = analytics.summarize_logs([ str(tmp_path / "2022.json"), str(tmp_path / "notes.json") ],
+                                            str(tmp_path / "cache") + "/", workers=1)
+    assert [ path for path, _ in summaries ] == [ str(tmp_path / "2022.json") ]
+    assert summaries[0][1]["tracks"][0]["plays"] == 3
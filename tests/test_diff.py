@@ -0,0 +1,28 @@
+from helpers.diff import diff_tracklists
+
+def track(uri, name="Song", playcount=None):
+    track = { "name": name, "artists": [ "Artist" ], "album": "Album", "uri": uri }
+    if playcount is not None:
+        track["playcount"] = playcount
+    return track
+
+def test_exact_uri_match_wins_over_an_earlier_key_match():
+    old = [ track("u1", playcount=7) ]
+    # u2 is a relinked copy of the same song, ahead of u1 on the playlist
+    added, kept, removed = diff_tracklists([ track("u2"), track("u1") ], old)
+    assert [ t["uri"] for t in added ] == [ "u2" ]
+    assert kept == old
+    assert removed == []
+
+def test_relinked_track_is_kept_by_name():
+    old = [ track("u1", playcount=7), track("u3", name="Other", playcount=1) ]
+    added, kept, removed = diff_tracklists([ track("u2") ], old)
+    assert added == []
+    assert kept == old[:1]
+    assert removed == old[1:]
+
+def test_duplicates_are_matched_one_to_one():
+    old = [ track("u1", playcount=1), track("u1", playcount=2) ]
+    added, kept, removed = diff_tracklists([ track("u1"), track("u1"), track("u1") ], old)
+    assert [ t["playcount"] for t in kept ] == [ 1, 2 ]
+    assert len(added) == 1 and removed == []
@@ -0,0 +1,45 @@
+import pytest
+
+from helpers.identity import FOUND_TTL_SECONDS, NOT_FOUND_TTL_SECONDS, IdentityCache, clean_name
+
+@pytest.mark.parametrize("name, artists, cleaned", [
+    ("Song (feat. Someone)", [ "Artist" ], "Song"),
+    ("Song [ft. Someone]", [ "Artist" ], "Song"),
+    ("Song (Featuring Someone Else)", [ "Artist" ], "Song"),
+    ("Help! - Remastered 2009", [ "The Beatles" ], "Help!"),
+    ("Song (2015 Remaster)", [ "Artist" ], "Song"),
+    ("Song - 2009 Mono Version", [ "Artist" ], "Song"),
+    ("Song (with Someone & Another)", [ "Artist", "Someone", "Another" ], "Song"),
+    ("Song (With Love)", [ "Artist" ], "Song (With Love)"),
+    ("Song [With You]", [ "Artist", "Someone" ], "Song [With You]"),
+    ("Song - Live", [ "Artist" ], "Song - Live"),
+    ("Song (Remix)", [ "Artist" ], "Song (Remix)"),
+    ("(feat. Someone)", [ "Artist" ], "(feat. Someone)"),
+])
+def test_clean_name(name, artists, cleaned):
+    assert clean_name(name, artists) == cleaned
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = IdentityCache(str(tmp_path / "identities.sqlite3"), max_entries=2)
+    yield cache
+    cache.close()
+
+def test_entries_expire_after_their_ttl(cache):
+    cache.put_many([ ("found", "Artist", "Song", True), ("missing", "Artist", "Other", False) ], now=0)
+
+    assert cache.get_many([ "found", "missing" ], now=NOT_FOUND_TTL_SECONDS - 1) == {
+        "found": ("Artist", "Song"),
+        "missing": ("Artist", "Other"),
+    }
+    assert cache.get_many([ "found", "missing" ], now=NOT_FOUND_TTL_SECONDS) == { "found": ("Artist", "Song") }
+    assert cache.get_many([ "found", "missing" ], now=FOUND_TTL_SECONDS) == {}
+
+def test_least_recently_used_entry_is_dropped(cache):
+    cache.put_many([ ("a", "Artist", "A", True) ], now=1)
+    cache.put_many([ ("b", "Artist", "B", True) ], now=2)
+    # reading a makes b the least recently used
+    assert cache.get_many([ "a" ], now=3) == { "a": ("Artist", "A") }
+    cache.put_many([ ("c", "Artist", "C", True) ], now=4)
+
+    assert set(cache.get_many([ "a", "b", "c" ], now=5)) == { "a", "c" }
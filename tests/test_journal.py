@@ -0,0 +1,66 @@
+import pytest
+
+import rolling
+from helpers.journal import load_journal
+from helpers.log import read_log
+
+class Crash(Exception):
+    pass
+
+# where a run can die: during the playcount lookups, right after adding to
+# the log playlist (before the local mirror of it is updated), and after each
+# step the journal checks off
+CRASHES = [ "lookups", "log_playlist_add", "playcounts", "log_playlist", "tracklist", "log", "playlist_state", "email" ]
+
+def crash_at(monkeypatch, where):
+    if where == "lookups":
+        def lookup_playcounts(*args, **kwargs):
+            raise Crash()
+        monkeypatch.setattr(rolling, "lookup_playcounts", lookup_playcounts)
+    elif where == "log_playlist_add":
+        def write_log_mirror(*args, **kwargs):
+            raise Crash()
+        monkeypatch.setattr(rolling, "write_log_mirror", write_log_mirror)
+    else:
+        mark_done = rolling.mark_done
+        def crashing_mark_done(config, journal, step, **results):
+            mark_done(config, journal, step, **results)
+            if step == where:
+                raise Crash()
+        monkeypatch.setattr(rolling, "mark_done", crashing_mark_done)
+
+def count_calls(monkeypatch, name):
+    calls = []
+    function = getattr(rolling, name)
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+    monkeypatch.setattr(rolling, name, counted)
+    return calls
+
+@pytest.mark.parametrize("where", CRASHES)
+def test_resumed_run_records_changes_once(make_user, tracks, monkeypatch, where):
+    user = make_user(tracks[:5])
+    assert rolling.run(user.config, user.spotify, user.get_lastfm)
+
+    user.set_tracks(tracks[1:6])
+    with monkeypatch.context() as crashing:
+        crash_at(crashing, where)
+        with pytest.raises(Crash):
+            rolling.run(user.config, user.spotify, user.get_lastfm)
+    assert load_journal(user.config) is not None
+
+    # the resumed run finishes from the journal, without fetching the playlist
+    # or looking up playcounts the crashed one already had
+    fetches = count_calls(monkeypatch, "fetch_full_tracklist")
+    lookups = count_calls(monkeypatch, "lookup_playcounts")
+    assert not rolling.run(user.config, user.spotify, user.get_lastfm)
+    assert load_journal(user.config) is None
+    assert len(fetches) == 0
+    assert len(lookups) == (1 if where == "lookups" else 0)
+
+    events = [ event for event in read_log(user.config) if "out" in event ]
+    assert len(events) == 1
+    assert [ track["uri"] for track in events[0]["out"] ] == [ tracks[0]["uri"] ]
+    assert [ track["uri"] for track in events[0]["in"] ] == [ tracks[5]["uri"] ]
+    assert sorted(user.log_playlist_uris()) == sorted(track["uri"] for track in tracks[:6])
@@ -0,0 +1,47 @@
+import json
+import os
+
+import rolling
+from helpers.log import log_exists, read_log, repair_torn_tail
+from helpers.timeline import INDEX_SUFFIX, Timeline
+
+def test_legacy_log_is_read_as_it_is_and_migrated_by_the_next_run(make_user, tracks):
+    user = make_user(tracks[:5])
+    assert rolling.run(user.config, user.spotify, user.get_lastfm)
+
+    # turn the new log back into the one big json array older versions kept
+    events = list(read_log(user.config))
+    legacy, path = user.data_path("rolling-log.json"), user.data_path("rolling-log.jsonl")
+    with open(legacy, "w") as f:
+        json.dump(events, f, indent=4)
+    os.remove(path)
+
+    # reading doesn't touch it
+    assert log_exists(user.config)
+    assert list(read_log(user.config)) == events
+    assert [ track["uri"] for track in Timeline.from_log(user.config).contents_on(events[0]["date"]) ] \
+        == [ track["uri"] for track in tracks[:5] ]
+    assert os.path.exists(legacy)
+    assert not os.path.exists(path) and not os.path.exists(path + INDEX_SUFFIX)
+
+    user.set_tracks(tracks[1:6])
+    assert rolling.run(user.config, user.spotify, user.get_lastfm)
+    assert not os.path.exists(legacy) and os.path.exists(legacy + ".migrated")
+    migrated = list(read_log(user.config))
+    assert migrated[:-1] == events
+    assert [ track["uri"] for track in migrated[-1]["out"] ] == [ tracks[0]["uri"] ]
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = tmp_path / "rolling-log.jsonl"
+    complete = '{"date":"2023-01-01","starting_tracks":[]}\n' + '{"date":"2023-01-02","in":[],"out":[]}\n' * 2000
+    path.write_text(complete + '{"date":"2023-01-03","in":[{"na')
+    repair_torn_tail(str(path))
+    assert path.read_text() == complete
+
+    # a file with no complete line at all ends up empty, and a whole one is left alone
+    path.write_text('{"date":"2023-01-01"')
+    repair_torn_tail(str(path))
+    assert path.read_text() == ""
+    path.write_text(complete)
+    repair_torn_tail(str(path))
+    assert path.read_text() == complete
@@ -0,0 +1,58 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import rolling
+from helpers.log import read_log
+from helpers.scrobbles import SYNC_BATCH_SIZE, ScrobbleStore
+
+def test_runs_in_one_process_see_new_scrobbles(make_user, tracks):
+    user = make_user(tracks[:5])
+    assert rolling.run(user.config, user.spotify, user.get_lastfm)
+
+    # played after it was added, then taken off the playlist before the next run
+    user.scrobble(tracks[0], time.time() + 60)
+    user.set_tracks(tracks[1:6])
+    assert rolling.run(user.config, user.spotify, user.get_lastfm)
+
+    last = list(read_log(user.config))[-1]
+    assert [ (track["uri"], track["playcount"]) for track in last["out"] ] == [ (tracks[0]["uri"], 1) ]
+
+class FakeRecentTracks:
+    """
+    Stands in for the pylast user in ScrobbleStore.sync: serves scrobbles newest
+    first like user.getRecentTracks, dying after fail_after of them if set.
+    """
+
+    def __init__(self, timestamps, fail_after=None):
+        self.timestamps = sorted(timestamps, reverse=True)
+        self.fail_after = fail_after
+        self.served = 0
+
+    def get_recent_tracks(self, limit=None, time_from=None, time_to=None, stream=False):
+        for timestamp in self.timestamps:
+            if (time_from is not None and timestamp < time_from) or (time_to is not None and timestamp > time_to):
+                continue
+            if self.fail_after is not None and self.served == self.fail_after:
+                raise TimeoutError("last.fm timed out")
+            self.served += 1
+            yield SimpleNamespace(timestamp=str(timestamp),
+                                  track=SimpleNamespace(title="Song", artist=SimpleNamespace(name="Artist")))
+
+def test_interrupted_sync_carries_on_where_it_stopped(tmp_path):
+    timestamps = range(1000, 1000 + 2 * SYNC_BATCH_SIZE + 50)
+    store = ScrobbleStore(str(tmp_path / "scrobbles.sqlite3"))
+
+    with pytest.raises(TimeoutError):
+        store.sync(FakeRecentTracks(timestamps, fail_after=SYNC_BATCH_SIZE + 10))
+    assert store.count_plays("Artist", "Song") == SYNC_BATCH_SIZE
+    assert store.get_synced_through() is None
+
+    # the rest, and what was scrobbled while it was down
+    resumed = FakeRecentTracks(list(timestamps) + [ 5000, 5001 ])
+    store.sync(resumed)
+    assert store.count_plays("Artist", "Song") == len(timestamps) + 2
+    assert store.get_synced_through() == 5001
+    assert resumed.served < len(timestamps)
+    store.close()
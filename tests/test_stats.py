@@ -0,0 +1,60 @@
+from helpers.date import day_start_timestamp
+from helpers.stats import StatsAccumulator
+
+TRACK = { "name": "Song 0", "artists": [ "Artist 0" ], "album": "Album 0", "uri": "spotify:track:0" }
+OTHER = { "name": "Song 1", "artists": [ "Artist 1" ], "album": "Album 1", "uri": "spotify:track:1" }
+
+def accumulate(events):
+    stats = StatsAccumulator()
+    for event in events:
+        stats.add(event)
+    return stats.finish()
+
+def totals(stats, track):
+    return next(t for t in stats["tracks"] if t["uri"] == track["uri"])
+
+def test_every_stay_of_a_track_back_on_the_playlist_counts():
+    stats = accumulate([
+        { "date": "2023-01-01", "starting_tracks": [ TRACK ] },
+        { "date": "2023-01-11", "in": [ OTHER ], "out": [ dict(TRACK, playcount=3) ] },
+        { "date": "2023-02-01", "in": [ TRACK ], "out": [ dict(OTHER, playcount=1) ] },
+        { "date": "2023-02-21", "in": [ OTHER ], "out": [ dict(TRACK, playcount=4) ] },
+    ])
+    track = totals(stats, TRACK)
+    assert (track["stays"], track["days"], track["plays"]) == (2, 30, 7)
+    assert stats["top_by_plays"][0]["uri"] == TRACK["uri"]
+    assert stats["months"]["2023-02"]["by_plays"][0]["value"] == 4
+
+def test_going_out_without_coming_in_keeps_the_plays():
+    # logged before tracks back for another stay were logged coming in
+    stats = accumulate([
+        { "date": "2023-01-01", "starting_tracks": [ TRACK ] },
+        { "date": "2023-01-11", "in": [], "out": [ dict(TRACK, playcount=3) ] },
+        { "date": "2023-02-21", "in": [], "out": [ dict(TRACK, playcount=4) ] },
+    ])
+    track = totals(stats, TRACK)
+    assert (track["stays"], track["days"], track["plays"]) == (2, 10, 7)
+
+def test_month_plays_come_from_the_scrobbles_in_each_month_of_a_stay():
+    scrobbles = { TRACK["uri"]: [ "2023-01-20", "2023-02-01", "2023-02-02", "2023-02-03", "2023-03-01" ] }
+    asked = []
+
+    def window_plays(tracks, windows):
+        asked.extend(track["uri"] for track in tracks)
+        return [ [ sum(1 for date in scrobbles[track["uri"]] if t0 <= day_start_timestamp(date) < t1) for t0, t1 in track_windows ]
+                 for track, track_windows in zip(tracks, windows) ]
+
+    stats = StatsAccumulator()
+    for event in [
+        { "date": "2023-01-11", "starting_tracks": [ TRACK, OTHER ] },
+        { "date": "2023-02-10", "in": [], "out": [ dict(TRACK, playcount=4), dict(OTHER, playcount=0) ] },
+    ]:
+        stats.add(event)
+    stats = stats.finish(window_plays=window_plays)
+
+    # spread evenly, january would have had 21 of the 30 days' worth of plays.
+    # the scrobble after the stay ended doesn't count, and neither does a stay with no plays
+    assert stats["months"]["2023-01"]["by_plays"][0]["value"] == 1
+    assert stats["months"]["2023-02"]["by_plays"][0]["value"] == 3
+    assert stats["seasons"]["2023-winter"]["by_plays"][0]["value"] == 4
+    assert asked == [ TRACK["uri"] ]
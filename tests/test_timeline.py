@@ -0,0 +1,87 @@
+import json
+import time
+
+from fake_services import make_spotify_track
+
+import rolling
+from helpers.log import read_log
+from helpers.timeline import Timeline
+
+def test_track_back_for_another_stay_is_logged_coming_in(make_user, tracks):
+    user = make_user(tracks[:5])
+    assert rolling.run(user.config, user.spotify, user.get_lastfm)
+
+    # out, back in, and out again
+    user.scrobble(tracks[0], time.time() + 60)
+    for playlist in (tracks[1:6], tracks[0:5], tracks[1:5] + tracks[6:7]):
+        user.set_tracks(playlist)
+        assert rolling.run(user.config, user.spotify, user.get_lastfm)
+
+    events = list(read_log(user.config))
+    assert [ track["uri"] for track in events[2]["in"] ] == [ tracks[0]["uri"] ]
+
+    intervals = Timeline(events).find_intervals(tracks[0])
+    assert len(intervals) == 2
+    assert all(end is not None for _, end, _ in intervals)
+    assert intervals[0][2] == 1
+
+    # the log playlist still only has it once
+    assert user.log_playlist_uris().count(tracks[0]["uri"]) == 1
+
+def test_going_out_without_coming_in_keeps_the_plays():
+    track = { "name": "Song 0", "artists": [ "Artist 0" ], "album": "Album 0", "uri": "spotify:track:0" }
+    timeline = Timeline([
+        { "date": "2023-01-01", "starting_tracks": [ track ] },
+        { "date": "2023-01-10", "in": [], "out": [ dict(track, playcount=3) ] },
+        # logged before tracks back for another stay were logged coming in
+        { "date": "2023-02-01", "in": [], "out": [ dict(track, playcount=2) ] },
+    ])
+    assert [ interval[2] for interval in timeline.find_intervals(track) ] == [ 3, 2 ]
+    assert timeline.tenure(track) == 9
+
+def write_lines(path, events, mode="a"):
+    with open(path, mode, encoding="utf-8") as logfile:
+        for event in events:
+            logfile.write(json.dumps(event) + "\n")
+
+def make_log(days):
+    tracks = [ make_spotify_track(i) for i in range(days + 3) ]
+    names = [ { "name": t["name"], "artists": [ t["artists"][0]["name"] ], "album": t["album"]["name"], "uri": t["uri"] }
+              for t in tracks ]
+    events = [ { "date": "2023-01-01", "starting_tracks": names[:3] } ]
+    for day in range(days):
+        events.append({ "date": f"2023-02-{day + 1:02d}", "in": [ names[day + 3] ], "out": [ dict(names[day], playcount=day) ] })
+    return names, events
+
+def test_index_on_disk_catches_up_with_the_log(tmp_path):
+    names, events = make_log(20)
+    path = str(tmp_path / "rolling-log.jsonl")
+    write_lines(path, events[:10])
+    Timeline.from_path(path, checkpoint_interval=4).close()
+
+    # appended since, plus a torn line from a crash mid-append
+    write_lines(path, events[10:])
+    with open(path, "a", encoding="utf-8") as logfile:
+        logfile.write('{"date": "2023-03')
+
+    timeline = Timeline.from_path(path, checkpoint_interval=4)
+    expected = Timeline(events, checkpoint_interval=4)
+    for date in ("2023-01-15", "2023-02-05", "2023-02-20"):
+        assert sorted(t["uri"] for t in timeline.contents_on(date)) == sorted(t["uri"] for t in expected.contents_on(date))
+    assert timeline.find_intervals(names[12]) == expected.find_intervals(names[12])
+    assert timeline.days_on_list("2023-02-01", "2023-03-01") == expected.days_on_list("2023-02-01", "2023-03-01")
+    assert [ t["uri"] for t in timeline.find_tracks("song 1") ] == [ names[1]["uri"], *(n["uri"] for n in names[10:20]) ]
+    timeline.close()
+
+def test_index_is_rebuilt_for_a_new_log(tmp_path):
+    names, events = make_log(5)
+    path = str(tmp_path / "rolling-log.jsonl")
+    write_lines(path, events)
+    Timeline.from_path(path).close()
+
+    # a new cycle's log under the same name
+    restarted = [ dict(events[0], date="2024-01-01", starting_tracks=names[4:6]) ]
+    write_lines(path, restarted, mode="w")
+    timeline = Timeline.from_path(path)
+    assert sorted(t["uri"] for t in timeline.contents_on("2024-01-02")) == [ names[4]["uri"], names[5]["uri"] ]
+    timeline.close()
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from helpers.transport import Transport, is_lastfm_read, make_requests_session
+
+class FakeAdapter(BaseAdapter):
+    """
+    Answers each request with the next of the given replies: a status code,
+    (status code, headers), or an exception to raise. Keeps every request it's sent.
+    """
+
+    def __init__(self, replies, release=None):
+        super().__init__()
+        self.replies = list(replies)
+        self.sent = []
+        self.release = release
+
+    def send(self, request, **kwargs):
+        self.sent.append((request.method, request.url))
+        if self.release is not None:
+            self.release.wait(5)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        status, headers = reply if isinstance(reply, tuple) else (reply, {})
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = b"{}"
+        response.request = request
+        response.url = request.url
+        return response
+
+def make_session(replies, release=None):
+    waits = []
+    transport = Transport(sleep=waits.append)
+    session = make_requests_session(transport)
+    adapter = FakeAdapter(replies, release)
+    session.mount("https://", adapter)
+    return session, adapter, transport, waits
+
+def test_retries_429_after_retry_after():
+    session, adapter, _, waits = make_session([ (429, { "Retry-After": "7" }), 200 ])
+    assert session.get("https://api.spotify.com/v1/me").status_code == 200
+    assert len(adapter.sent) == 2
+    assert len(waits) == 1 and 7 <= waits[0] < 8
+
+def test_identical_gets_in_flight_share_one_response():
+    release = threading.Event()
+    session, adapter, transport, _ = make_session([ 200 ], release)
+    responses = []
+
+    def get():
+        responses.append(session.get("https://api.spotify.com/v1/playlists/rolling"))
+
+    threads = [ threading.Thread(target=get) for _ in range(2) ]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while transport.metrics["requests"] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert [ response.status_code for response in responses ] == [ 200, 200 ]
+    assert len(adapter.sent) == 1
+    assert transport.metrics["coalesced"] == 1
+
+def test_post_that_times_out_is_not_resent():
+    session, adapter, _, _ = make_session([ requests.ReadTimeout("read timed out"), 201 ])
+    with pytest.raises(requests.ReadTimeout):
+        session.post("https://api.spotify.com/v1/playlists/log/items", json={ "uris": [ "a" ] })
+    assert len(adapter.sent) == 1
+
+def test_post_that_never_connected_is_resent():
+    session, adapter, _, _ = make_session([ requests.ConnectTimeout("connect timed out"), 201 ])
+    assert session.post("https://api.spotify.com/v1/playlists/log/items", json={ "uris": [ "a" ] }).status_code == 201
+    assert len(adapter.sent) == 2
+
+def test_post_with_server_error_is_not_resent():
+    session, adapter, _, _ = make_session([ 502, 201 ])
+    assert session.post("https://api.spotify.com/v1/playlists/log/items", json={ "uris": [ "a" ] }).status_code == 502
+    assert len(adapter.sent) == 1
+
+def test_only_lastfm_reads_are_coalesced():
+    import httpx
+
+    def request(method):
+        return httpx.Request("POST", "https://ws.audioscrobbler.com/2.0/", data={ "method": method })
+
+    assert is_lastfm_read(request("user.getRecentTracks"))
+    assert is_lastfm_read(request("track.search"))
+    assert not is_lastfm_read(request("auth.getMobileSession"))
+    assert not is_lastfm_read(request("auth.getToken"))
+
+class CountingBucket:
+    rate = 1
+
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+def test_throttled_host_counts_every_attempt():
+    session, adapter, transport, _ = make_session([ (429, { "Retry-After": "1" }), 200 ])
+    bucket = transport.buckets["api.spotify.com"] = CountingBucket()
+    assert session.get("https://api.spotify.com/v1/me").status_code == 200
+    assert session.get("https://api.spotify.com/v1/me/playlists").status_code == 200
+    assert bucket.acquired == len(adapter.sent) == 3
+
+def test_strictest_rate_wins():
+    transport = Transport()
+    transport.throttle("ws.audioscrobbler.com", 5)
+    transport.throttle("ws.audioscrobbler.com", 20)
+    assert transport.buckets["ws.audioscrobbler.com"].rate == 5
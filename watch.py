@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# keeps running and checks the rolling playlist every few seconds to minutes
+# instead of once a day, so substitutions are logged within moments of happening:
+#   python3 watch.py [config file] [--debug]    (defaults to config/config.json)
+# each check is a single small spotify request for the playlist's snapshot_id.
+# the full tracklist is only fetched, diffed and logged once that changes.
+# checks slow down the longer the playlist sits idle, and speed back up on a change
+
+import argparse
+import os
+import time
+import traceback
+
+import rolling
+from helpers.config import read_config
+from helpers.outbox import OutboxSender
+
+# seconds between checks, overridable with WATCH_MIN_POLL_SECONDS and WATCH_MAX_POLL_SECONDS
+# in config.json. each idle check waits BACKOFF_FACTOR times longer than the last, up to the max
+DEFAULT_MIN_POLL_SECONDS = 30
+DEFAULT_MAX_POLL_SECONDS = 30 * 60
+BACKOFF_FACTOR = 1.5
+
+class Poller:
+    """
+    Adaptive polling interval: starts at min_delay, grows by BACKOFF_FACTOR
+    after every check that found nothing, and drops back to min_delay on a change.
+    Failures back off the same way, so a spotify outage isn't hammered.
+    """
+
+    def __init__(self, min_delay, max_delay):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+
+    def changed(self):
+        self.delay = self.min_delay
+
+    def idle(self):
+        self.delay = min(self.max_delay, self.delay * BACKOFF_FACTOR)
+
+def get_poll_settings(config):
+    min_delay = float(config.get("WATCH_MIN_POLL_SECONDS", DEFAULT_MIN_POLL_SECONDS))
+    max_delay = float(config.get("WATCH_MAX_POLL_SECONDS", DEFAULT_MAX_POLL_SECONDS))
+    return max(1.0, min_delay), max(min_delay, max_delay)
+
+def watch(config_path=None):
+    config = read_config(config_path)
+
+    # spotify is logged in to by the first check (and again after a failed one),
+    # so a network blip while logging in is just another failed check.
+    # last.fm is only logged in to once something changes, then kept
+    spotify = None
+    lastfm = None
+    def get_lastfm():
+        nonlocal lastfm
+        if lastfm is None:
+            lastfm = rolling.authenticate_lastfm(config)
+        return lastfm
+
+    # queued emails go out from a thread here rather than a process per change
+    OutboxSender(lambda: [ config ]).start()
+
+    poller = Poller(*get_poll_settings(config))
+    while True:
+        try:
+            if spotify is None:
+                spotify = rolling.authenticate_spotify(config, config_path)
+            if rolling.run(config, spotify, get_lastfm):
+                rolling.debug_print("rolling playlist changed, logged it")
+                poller.changed()
+            else:
+                poller.idle()
+        except (Exception, SystemExit):
+            # keep watching through network blips, with fresh clients in case one is wedged
+            print("check failed:")
+            traceback.print_exc()
+            spotify = None
+            lastfm = None
+            poller.idle()
+        rolling.debug_print(f"next check in {poller.delay:.0f}s")
+        time.sleep(poller.delay)
+
+def main():
+    parser = argparse.ArgumentParser(description="watch the rolling playlist and log changes as they happen")
+    parser.add_argument("config", nargs="?", help="config file, defaults to config/config.json")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    rolling.debug = args.debug
+    watch(os.path.abspath(args.config) if args.config else None)
+
+if __name__ == "__main__":
+    main()